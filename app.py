@@ -1,52 +1,130 @@
-from flask import Flask, render_template, jsonify, send_from_directory, request, abort
+from flask import Flask, render_template, jsonify, send_from_directory, send_file, request, abort, g, Response
 import os
 import subprocess
+import time
+from file_listing import DirectoryListingService
+from disk_usage import DiskUsageIndexer, format_summary
+from thumbnails import ThumbnailService
+from concurrency import ConcurrencyLimiter, limit_concurrency
+from prompt_builder import PromptBuilder
+import metrics
+import profiling
 
 app = Flask(__name__)
 BASE_DIR = os.path.expanduser("~")
+listing_service = DirectoryListingService(BASE_DIR)
+disk_usage_indexer = DiskUsageIndexer(BASE_DIR)
+thumbnail_service = ThumbnailService()
+THUMBNAIL_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+
+# LLM-backed routes get a small slice of each worker's threads so slow
+# model calls queue up (or are shed with 503) instead of starving listings
+llm_limiter = ConcurrencyLimiter(
+    'LLM',
+    max_concurrent=int(os.getenv('LLM_MAX_CONCURRENCY', '2')),
+    max_queue=int(os.getenv('LLM_MAX_QUEUE', '4')),
+    queue_timeout=float(os.getenv('LLM_QUEUE_TIMEOUT', '30')),
+)
+
+@app.before_request
+def start_request_timer():
+    if metrics.is_enabled():
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_time(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.endpoint or 'unknown'
+        metrics.observe(f"http_{endpoint}", time.perf_counter() - started)
+        metrics.incr(f"http_{endpoint}_status_{response.status_code}")
+    return response
+
+@app.before_request
+def start_request_profile():
+    # PNG_CLEANUP_PROFILE=1 profiles every request; ?profile=1 profiles one
+    session = profiling.start_profile(request.endpoint or 'unknown', force=request.args.get('profile') == '1')
+    if session is not None:
+        g.profile_session = session
+
+@app.after_request
+def save_request_profile(response):
+    session = g.pop('profile_session', None)
+    if session is not None:
+        session.stop()
+        response.headers['X-Profile-Id'] = session.profile_id
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc):
+    # Requests that raised skip after_request; still save what was captured
+    session = g.pop('profile_session', None)
+    if session is not None:
+        session.stop()
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.export_prometheus(), mimetype='text/plain; version=0.0.4')
 
 @app.route("/")
 def index():
     return render_template("index.html")
 
-@app.route('/list-files')
-def list_files():
-    path = request.args.get('path', '')
+def resolve_path(path: str) -> str:
+    """Absolute path under BASE_DIR, aborting with 403 if it escapes."""
     full_path = os.path.abspath(os.path.join(BASE_DIR, path))
 
     if not os.path.commonpath([BASE_DIR, full_path]).startswith(BASE_DIR):
         abort(403)
+    return full_path
 
-    entries = []
-    for entry in os.scandir(full_path):
-        if entry.name == '.DS_Store':
-            continue
-
-        entry_path = os.path.relpath(entry.path, BASE_DIR)
-        entry_info = {
-            'name': entry.name,
-            'path': entry_path,
-            'is_dir': entry.is_dir()
-        }
-
-        # Add preview for text/code files
-        if entry.is_file() and entry.name.split('.')[-1].lower() in ['txt', 'md', 'py', 'js', 'html', 'css']:
-            try:
-                with open(entry.path, 'r', encoding='utf-8') as f:
-                    preview = ''.join([next(f) for _ in range(5)])  # First 5 lines
-                entry_info['preview'] = preview
-            except Exception:
-                entry_info['preview'] = '[Preview unavailable]'
-
-        entries.append(entry_info)
+@app.route('/list-files')
+def list_files():
+    full_path = resolve_path(request.args.get('path', ''))
+    cursor = request.args.get('cursor') or None
+    limit = request.args.get('limit', type=int)
 
-    return jsonify(entries)
+    if not os.path.isdir(full_path):
+        abort(404)
+    try:
+        return jsonify(listing_service.list(full_path, cursor=cursor, limit=limit))
+    except ValueError:
+        abort(400)
+
+@app.route('/preview')
+def preview():
+    full_path = resolve_path(request.args.get('path', ''))
+    if not os.path.isfile(full_path):
+        abort(404)
+    return jsonify({'path': request.args.get('path', ''), 'preview': listing_service.preview(full_path)})
+
+@app.route('/disk-usage')
+def disk_usage():
+    full_path = resolve_path(request.args.get('path', ''))
+    top_n = min(request.args.get('top', 10, type=int), 50)
+    disk_usage_indexer.start()
+    return jsonify(disk_usage_indexer.summary(full_path, top_n=top_n))
+
+@app.route('/server-stats')
+def server_stats():
+    return jsonify({'limiters': [llm_limiter.stats()]})
 
 @app.route('/optimize-storage', methods=['POST'])
+@limit_concurrency(llm_limiter)
 def optimize_storage():
     data = request.get_json()
     user_prompt = data.get('prompt', '')
     file_summary = data.get('file_summary', '')
+    if file_summary:
+        # Client-supplied summaries can be arbitrarily long; keep what fits the budget
+        builder = PromptBuilder()
+        builder.add_section("Files:", file_summary.splitlines())
+        file_summary = builder.build()
+    else:
+        # Summarize real sizes from the disk usage index instead of a bare listing
+        disk_usage_indexer.start()
+        with metrics.timer("disk_usage_summary"):
+            file_summary = format_summary(disk_usage_indexer.summary(resolve_path(data.get('path', ''))))
 
     full_prompt = f"""
 You are a file system optimizer. Given the following local file summary and the user's prompt, suggest the most efficient way to clean up their storage. Be concise and safe.
@@ -70,14 +148,15 @@ Respond with a markdown-formatted list of actions the user should take.
         env = os.environ.copy()
         env["PYTHONIOENCODING"] = "utf-8"
         
-        result = subprocess.run(
-            ['ollama', 'run', 'mistral'],
-            input=full_prompt.encode('utf-8'),  # Encode input as UTF-8
-            capture_output=True,
-            env=env,
-            startupinfo=startupinfo,
-            timeout=120
-        )
+        with metrics.timer("llm_optimize_storage"):
+            result = subprocess.run(
+                ['ollama', 'run', 'mistral'],
+                input=full_prompt.encode('utf-8'),  # Encode input as UTF-8
+                capture_output=True,
+                env=env,
+                startupinfo=startupinfo,
+                timeout=120
+            )
         
         # Decode output using UTF-8
         output = result.stdout.decode('utf-8')
@@ -87,7 +166,32 @@ Respond with a markdown-formatted list of actions the user should take.
 
 @app.route("/files/<path:filename>")
 def serve_file(filename):
-    return send_from_directory(BASE_DIR, filename)
+    # conditional=True answers If-None-Match/If-Modified-Since with 304 and honours Range
+    return send_from_directory(BASE_DIR, filename, conditional=True, etag=True, max_age=3600)
+
+@app.route("/thumbnails/<path:filename>")
+def serve_thumbnail(filename):
+    full_path = resolve_path(filename)
+    if not os.path.isfile(full_path):
+        abort(404)
+    if filename.split('.')[-1].lower() not in THUMBNAIL_EXTENSIONS:
+        abort(415)
+
+    size = min(max(request.args.get('size', 256, type=int), 32), 1024)
+    try:
+        thumbnail_path = thumbnail_service.get(full_path, size)
+    except Exception as e:
+        print(f"Error generating thumbnail for {full_path}: {str(e)}")
+        abort(415)
+    # Thumbnail names change with the source file, so they can be cached for long
+    return send_file(
+        thumbnail_path,
+        mimetype=thumbnail_service.mimetype,
+        conditional=True,
+        etag=True,
+        max_age=86400,
+    )
 
 if __name__ == "__main__":
+    disk_usage_indexer.start()
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,205 @@
+"""End-to-end benchmark for the scan, caption, index and query stages.
+
+Generates a synthetic PNG corpus, runs each stage against it with Llama
+Stack replaced by the in-process fake, and prints JSON results (also
+written to --output) so runs can be compared across commits:
+
+    python benchmarks/bench_pipeline.py --images 500 --captions 20 --output results.json
+    python benchmarks/bench_pipeline.py --images 500 --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Callable, Dict, List
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from PIL import Image, ImageDraw
+
+from fake_llama_stack import FakeLlamaStackClient, FakeAgent
+from image_processor import ImageProcessor
+from llama_agent import LlamaAgent
+from vector_store import VectorStore
+
+SUBJECTS = ["cat", "dog", "chart", "receipt", "terminal", "code editor", "map", "invoice", "chat window", "spreadsheet"]
+QUERIES = ["cat", "screenshot of a chart", "receipts from last month", "terminal window", "find pictures of dogs"]
+
+
+def generate_corpus(root: str, count: int, width: int, height: int, seed: int) -> List[str]:
+    """Write count random PNGs spread over a few nested folders."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(count):
+        folder = os.path.join(root, f"folder{i % 5}", f"sub{i % 3}")
+        os.makedirs(folder, exist_ok=True)
+        image = Image.new("RGB", (width, height), tuple(rng.randrange(256) for _ in range(3)))
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            x0, y0 = rng.randrange(width), rng.randrange(height)
+            x1, y1 = min(width, x0 + rng.randrange(20, width // 2)), min(height, y0 + rng.randrange(20, height // 2))
+            draw.rectangle([x0, y0, x1, y1], fill=tuple(rng.randrange(256) for _ in range(3)))
+        draw.text((10, 10), f"image {i}", fill=(0, 0, 0))
+        path = os.path.join(folder, f"Screen Shot {i:05d}.png")
+        image.save(path)
+        paths.append(path)
+    return paths
+
+
+def synthetic_records(paths: List[str], seed: int) -> List[Dict[str, str]]:
+    """Records shaped like process_single_image output, with fake captions and dates."""
+    rng = random.Random(seed)
+    now = datetime(2025, 4, 20)
+    records = []
+    for path in paths:
+        created = now - timedelta(days=rng.randrange(365), seconds=rng.randrange(86400))
+        records.append({
+            'path': path,
+            'caption': f"a screenshot of a {rng.choice(SUBJECTS)} with a {rng.choice(SUBJECTS)}",
+            'creation_date': created.strftime('%Y-%m-%d'),
+            'creation_time': created.strftime('%H:%M:%S'),
+            'dhash': f"{rng.getrandbits(64):016x}",
+        })
+    return records
+
+
+def percentile(values: List[float], pct: float) -> float:
+    values = sorted(values)
+    return values[min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)]
+
+
+def measure(fn: Callable, items: List, repeat: int = 1) -> Dict[str, float]:
+    """Call fn on each item and summarize per-call latency and throughput."""
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for item in items:
+            call_start = time.perf_counter()
+            fn(item)
+            latencies.append(time.perf_counter() - call_start)
+    total = time.perf_counter() - start
+    return {
+        'calls': len(latencies),
+        'total_seconds': round(total, 4),
+        'throughput_per_second': round(len(latencies) / total, 2) if total else 0.0,
+        'mean_ms': round(1000 * total / len(latencies), 3) if latencies else 0.0,
+        'p50_ms': round(1000 * percentile(latencies, 50), 3) if latencies else 0.0,
+        'p95_ms': round(1000 * percentile(latencies, 95), 3) if latencies else 0.0,
+        'p99_ms': round(1000 * percentile(latencies, 99), 3) if latencies else 0.0,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def run(args) -> Dict:
+    corpus_dir = tempfile.mkdtemp(prefix="png_bench_")
+    stages = {}
+    try:
+        paths = generate_corpus(corpus_dir, args.images, args.width, args.height, args.seed)
+
+        start = time.perf_counter()
+        processor = ImageProcessor()
+        stages['model_load'] = {'total_seconds': round(time.perf_counter() - start, 4)}
+
+        stages['scan_desktop'] = measure(lambda root: list(processor.iter_png_files(root)), [corpus_dir], args.repeat)
+        stages['scan_desktop']['files'] = args.images
+        stages['is_png'] = measure(processor.is_png, paths)
+
+        if args.captions:
+            stages['generate_caption'] = measure(processor.generate_caption, paths[:args.captions])
+        stages['blip_model'] = processor.model_status()
+
+        records = synthetic_records(paths, args.seed)
+        fake_client = FakeLlamaStackClient(
+            latency={"*": args.llama_latency},
+            jitter=args.llama_jitter,
+            error_rate={"*": args.llama_error_rate},
+            seed=args.seed,
+        )
+        agent = LlamaAgent(client=fake_client, agent_cls=FakeAgent)
+        # Cold numbers must not come from the result cache, or --repeat 2+ would be all hits
+        store = VectorStore(llama_agent=agent, result_cache_size=0)
+
+        batches = [records[i:i + args.batch_size] for i in range(0, len(records), args.batch_size)]
+        stages['add_images'] = measure(store.add_images, batches)
+        stages['add_images']['images_per_second'] = round(len(records) / stages['add_images']['total_seconds'], 2)
+
+        stages['traditional_search'] = measure(store.traditional_search, QUERIES, args.repeat)
+        stages['search_images'] = measure(store.search_images, QUERIES, args.repeat)
+        # Warm: the same queries once the result cache holds them, reported separately
+        store.result_cache_size = 256
+        for query in QUERIES:
+            store.search_images(query)
+        stages['search_images_warm'] = measure(store.search_images, QUERIES, args.repeat)
+        stages['llama_stack_calls'] = dict(fake_client.calls)
+        stages['llama_stack_failures'] = dict(fake_client.failures)
+        stages['llama_stack_circuit'] = agent.breaker.stats()
+        stages['embedding'] = store.embedding_service.get_metrics()
+    finally:
+        shutil.rmtree(corpus_dir, ignore_errors=True)
+
+    return {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': vars(args),
+        'stages': stages,
+    }
+
+
+def compare(results: Dict, baseline: Dict) -> Dict[str, float]:
+    """Ratio of current to baseline mean latency for each stage (>1 is slower)."""
+    ratios = {}
+    for name, stage in results['stages'].items():
+        before = baseline.get('stages', {}).get(name, {})
+        if stage.get('mean_ms') and before.get('mean_ms'):
+            ratios[name] = round(stage['mean_ms'] / before['mean_ms'], 3)
+    return ratios
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=200, help="Synthetic corpus size")
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=400)
+    parser.add_argument('--captions', type=int, default=0, help="How many images to run through BLIP (0 skips)")
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--repeat', type=int, default=3, help="Repetitions for scan and query stages")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--llama-latency', type=float, default=0.0, help="Seconds added to every fake Llama Stack call")
+    parser.add_argument('--llama-jitter', type=float, default=0.0, help="Latency jitter as a fraction (+/-)")
+    parser.add_argument('--llama-error-rate', type=float, default=0.0, help="Probability a fake call raises")
+    parser.add_argument('--output', help="Write JSON results to this file")
+    parser.add_argument('--baseline', help="Earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            results['vs_baseline'] = compare(results, json.load(f))
+
+    output = json.dumps(results, indent=2, default=str)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+
+
+if __name__ == "__main__":
+    main()
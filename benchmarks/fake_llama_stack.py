@@ -0,0 +1,259 @@
+"""In-process stand-in for the parts of Llama Stack this project calls.
+
+FakeLlamaStackClient mirrors the attribute layout the client code uses
+(models, vector_dbs, tool_runtime.rag_tool, vector_io, inference) and FakeAgent
+stands in for llama_stack_client.Agent, so LlamaAgent and VectorStore run
+offline with deterministic responses:
+
+    client = FakeLlamaStackClient(latency={"vector_io.query": 0.05}, error_rate={"*": 0.01}, seed=1)
+    agent = LlamaAgent(client=client, agent_cls=FakeAgent)
+
+Endpoint names are the keys of client.calls, e.g. "inference.chat_completion"
+or "agents.turn.create"; "*" applies to every endpoint. Latency and
+injected failures come from a seeded RNG, so a run is reproducible.
+"""
+import random
+import re
+import threading
+import time
+from types import SimpleNamespace
+from typing import List, Dict, Optional
+
+LLM_MODEL_ID = "fake-llm"
+EMBEDDING_MODEL_ID = "fake-embedding"
+
+
+def _words(text: str) -> set:
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+def _canned_reply(messages: List[Dict]) -> str:
+    """Deterministic reply shaped like what each prompt asks for."""
+    system = " ".join(m["content"] for m in messages if m["role"] == "system").lower()
+    user = messages[-1]["content"]
+    if "date information" in system or "extract the date" in user.lower():
+        return '{"start_date": null, "end_date": null}'
+    if "rewrites queries" in system:
+        match = re.search(r":\s*(.*)$", user, re.DOTALL)
+        return match.group(1).strip() if match else user
+    if "confirmation" in user.lower():
+        return "Do you want to delete these images?"
+    return "OK"
+
+
+class _Models:
+    def __init__(self, client):
+        self._client = client
+
+    def list(self):
+        self._client._call("models.list")
+        return [
+            SimpleNamespace(identifier=LLM_MODEL_ID, model_type="llm", metadata={}),
+            SimpleNamespace(identifier=EMBEDDING_MODEL_ID, model_type="embedding",
+                            metadata={"embedding_dimension": 384}),
+        ]
+
+
+class _VectorDBs:
+    def __init__(self, client):
+        self._client = client
+
+    def register(self, vector_db_id: str, **kwargs):
+        self._client._call("vector_dbs.register")
+        with self._client._lock:
+            self._client.documents.setdefault(vector_db_id, {})
+        return SimpleNamespace(identifier=vector_db_id, **kwargs)
+
+    def unregister(self, vector_db_id: str):
+        self._client._call("vector_dbs.unregister")
+        with self._client._lock:
+            self._client.documents.pop(vector_db_id, None)
+
+    def list(self):
+        self._client._call("vector_dbs.list")
+        with self._client._lock:
+            return [SimpleNamespace(identifier=vector_db_id) for vector_db_id in self._client.documents]
+
+
+class _RAGTool:
+    def __init__(self, client):
+        self._client = client
+
+    def insert(self, documents, vector_db_id: str, chunk_size_in_tokens: int = 512):
+        self._client._call("rag_tool.insert")
+        with self._client._lock:
+            store = self._client.documents.setdefault(vector_db_id, {})
+            for document in documents:
+                # RAGDocument is a TypedDict in llama_stack_client
+                if isinstance(document, dict):
+                    document = SimpleNamespace(**document)
+                store[document.document_id] = document
+
+    def query(self, vector_db_ids: List[str], content: str, query_config: Optional[Dict] = None, **kwargs):
+        """One QueryResult-shaped answer: the joined text plus metadata["document_ids"]."""
+        self._client._call("rag_tool.query")
+        max_chunks = (query_config or {}).get("max_chunks", 5)
+        scored = []
+        for vector_db_id in vector_db_ids:
+            scored.extend(self._client._rank(vector_db_id, content))
+        scored.sort(key=lambda item: (-item[0], item[1].document_id))
+        picked = [document for _, document in scored[:max_chunks]]
+        return SimpleNamespace(
+            content="\n".join(document.content for document in picked),
+            metadata={"document_ids": [document.document_id for document in picked]},
+        )
+
+
+class _VectorIO:
+    def __init__(self, client):
+        self._client = client
+
+    def query(self, vector_db_id: str, query: str, params: Optional[Dict] = None, **kwargs):
+        """QueryChunksResponse-shaped chunks and scores; chunk metadata carries the document's."""
+        self._client._call("vector_io.query")
+        max_chunks = (params or {}).get("max_chunks", 5)
+        scored = self._client._rank(vector_db_id, query)[:max_chunks]
+        return SimpleNamespace(
+            chunks=[
+                SimpleNamespace(content=document.content,
+                                metadata={**(document.metadata or {}), "document_id": document.document_id})
+                for _, document in scored
+            ],
+            scores=[score for score, _ in scored],
+        )
+
+
+class _Inference:
+    def __init__(self, client):
+        self._client = client
+
+    def chat_completion(self, model: str, messages: List[Dict], stream: bool = False, **kwargs):
+        self._client._call("inference.chat_completion")
+        # Shaped like ChatCompletionResponse
+        return SimpleNamespace(completion_message=_assistant_message(_canned_reply(messages)), metrics=None)
+
+
+def _assistant_message(text: str):
+    """Shaped like CompletionMessage."""
+    return SimpleNamespace(role="assistant", content=text, stop_reason="end_of_turn")
+
+
+class FakeLlamaStackError(Exception):
+    """Injected server-side failure."""
+
+    status_code = 503
+
+
+class FakeLlamaStackClient:
+    def __init__(
+        self,
+        latency: Optional[Dict[str, float]] = None,
+        jitter: float = 0.0,
+        error_rate: Optional[Dict[str, float]] = None,
+        timeout_rate: Optional[Dict[str, float]] = None,
+        timeout_seconds: float = 1.0,
+        seed: int = 0,
+    ):
+        """Fake client with configurable per-endpoint latency and failures.
+
+        latency: endpoint -> seconds added to every call.
+        jitter: fraction of the latency drawn uniformly at random (+/-).
+        error_rate: endpoint -> probability of raising FakeLlamaStackError.
+        timeout_rate: endpoint -> probability of hanging for timeout_seconds
+            and then raising TimeoutError.
+        """
+        self.latency = latency or {}
+        self.jitter = jitter
+        self.error_rate = error_rate or {}
+        self.timeout_rate = timeout_rate or {}
+        self.timeout_seconds = timeout_seconds
+        self.down = False
+        self._rng = random.Random(seed)
+        self._fail_next: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.calls: Dict[str, int] = {}
+        self.failures: Dict[str, int] = {}
+        # vector_db_id -> document_id -> RAGDocument
+        self.documents: Dict[str, Dict[str, object]] = {}
+        self.models = _Models(self)
+        self.vector_dbs = _VectorDBs(self)
+        self.tool_runtime = SimpleNamespace(rag_tool=_RAGTool(self))
+        self.vector_io = _VectorIO(self)
+        self.inference = _Inference(self)
+
+    def _rank(self, vector_db_id: str, content: str) -> List:
+        """(score, document) pairs ranked by word overlap with content."""
+        query_words = _words(content)
+        scored = []
+        with self._lock:
+            for document in self.documents.get(vector_db_id, {}).values():
+                overlap = len(query_words & _words(document.content))
+                if overlap:
+                    scored.append((overlap / (len(query_words) or 1), document))
+        scored.sort(key=lambda item: (-item[0], item[1].document_id))
+        return scored
+
+    def _setting(self, table: Dict[str, float], endpoint: str) -> float:
+        return table.get(endpoint, table.get("*", 0.0))
+
+    def set_down(self, down: bool = True):
+        """Simulate an outage: every call fails until set_down(False)."""
+        self.down = down
+
+    def fail_next(self, endpoint: str, count: int = 1):
+        """Make the next count calls to endpoint fail."""
+        with self._lock:
+            self._fail_next[endpoint] = self._fail_next.get(endpoint, 0) + count
+
+    def _call(self, endpoint: str):
+        """Count the call, then apply configured latency and failures."""
+        with self._lock:
+            self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+            delay = self._setting(self.latency, endpoint)
+            if delay and self.jitter:
+                delay *= 1 + self._rng.uniform(-self.jitter, self.jitter)
+            forced = self._fail_next.get(endpoint, 0)
+            if forced:
+                self._fail_next[endpoint] = forced - 1
+            roll = self._rng.random()
+            error_rate = self._setting(self.error_rate, endpoint)
+            timeout_rate = self._setting(self.timeout_rate, endpoint)
+            failure = None
+            if self.down or forced or roll < error_rate:
+                failure = "error"
+            elif roll < error_rate + timeout_rate:
+                failure = "timeout"
+            if failure:
+                self.failures[endpoint] = self.failures.get(endpoint, 0) + 1
+
+        if failure == "timeout":
+            time.sleep(self.timeout_seconds)
+            raise TimeoutError(f"Fake Llama Stack timed out on {endpoint}")
+        if delay:
+            time.sleep(delay)
+        if failure == "error":
+            raise FakeLlamaStackError(f"Fake Llama Stack error on {endpoint}")
+
+
+class FakeAgent:
+    def __init__(self, client: FakeLlamaStackClient, model: str, instructions: str = "", **kwargs):
+        self.client = client
+        self.model = model
+        self.instructions = instructions
+        self.sessions: Dict[str, List[Dict]] = {}
+
+    def create_session(self, session_name: str) -> str:
+        self.client._call("agents.session.create")
+        session_id = f"{session_name}-{len(self.sessions)}"
+        self.sessions[session_id] = []
+        return session_id
+
+    def create_turn(self, messages: List[Dict], session_id: str, stream: bool = True, **kwargs):
+        """A Turn, or like the real Agent, a stream of chunks ending in turn_complete unless stream=False."""
+        self.client._call("agents.turn.create")
+        self.sessions[session_id].extend(messages)
+        reply = _canned_reply([{"role": "system", "content": self.instructions}] + messages)
+        turn = SimpleNamespace(session_id=session_id, input_messages=messages, output_message=_assistant_message(reply))
+        if stream:
+            return iter([SimpleNamespace(event=SimpleNamespace(payload=SimpleNamespace(event_type="turn_complete", turn=turn)))])
+        return turn
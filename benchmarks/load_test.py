@@ -0,0 +1,111 @@
+"""Concurrent load test for the file viewer app.
+
+Runs a mix of listing, thumbnail and optimize requests from many client
+threads and reports per-endpoint latency percentiles:
+
+    python benchmarks/load_test.py --url http://127.0.0.1:5000 --clients 32 --duration 30
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(int(round(pct / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def make_requests(base_url: str, path: str, thumbnail: str, prompt: str) -> Dict[str, tuple]:
+    """Endpoint name -> (weight, urllib Request factory)."""
+    query = urllib.parse.quote(path)
+    scenarios = {
+        'list-files': (0.6, lambda: urllib.request.Request(f"{base_url}/list-files?path={query}")),
+        'disk-usage': (0.1, lambda: urllib.request.Request(f"{base_url}/disk-usage?path={query}")),
+        'optimize-storage': (0.05, lambda: urllib.request.Request(
+            f"{base_url}/optimize-storage",
+            data=json.dumps({'prompt': prompt, 'path': path}).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+        )),
+    }
+    if thumbnail:
+        scenarios['thumbnails'] = (0.25, lambda: urllib.request.Request(
+            f"{base_url}/thumbnails/{urllib.parse.quote(thumbnail)}?size=256"))
+    return scenarios
+
+
+def run(base_url: str, clients: int, duration: float, path: str, thumbnail: str, prompt: str) -> Dict:
+    scenarios = make_requests(base_url, path, thumbnail, prompt)
+    names = list(scenarios)
+    weights = [scenarios[name][0] for name in names]
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(seed: int):
+        rng = random.Random(seed)
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            request = scenarios[name][1]()
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(request, timeout=300) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except Exception:
+                status = 'error'
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies[name].append(elapsed)
+                statuses[name][status] += 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    report = {'clients': clients, 'duration_seconds': round(wall, 2), 'endpoints': {}}
+    for name, values in latencies.items():
+        report['endpoints'][name] = {
+            'requests': len(values),
+            'throughput_rps': round(len(values) / wall, 2),
+            'p50_ms': round(1000 * percentile(values, 50), 1),
+            'p90_ms': round(1000 * percentile(values, 90), 1),
+            'p99_ms': round(1000 * percentile(values, 99), 1),
+            'max_ms': round(1000 * max(values), 1),
+            'statuses': {str(k): v for k, v in statuses[name].items()},
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--path', default='', help="Folder (relative to home) to list")
+    parser.add_argument('--thumbnail', default='', help="Image (relative to home) to request thumbnails for")
+    parser.add_argument('--prompt', default='What can I delete safely?')
+    args = parser.parse_args()
+
+    report = run(args.url.rstrip('/'), args.clients, args.duration, args.path, args.thumbnail, args.prompt)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+"""Priority queue deciding which image gets captioned next.
+
+Live file events come first. Images in a date range a query just asked
+about come next, then the backlog, then screenshots whose BLIP caption
+was deferred. Within each tier, newer images go before older ones (by
+day), images directly in a visible folder (the Desktop) go before nested
+ones, and smaller files, which caption faster, go before larger ones.
+"""
+import heapq
+import itertools
+import os
+import threading
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from metadata import parse_screenshot_filename
+
+LIVE, BOOSTED, BACKFILL, DEFERRED = 0, 1, 2, 3
+
+
+class CaptionScheduler:
+    def __init__(self, visible_dirs: Optional[List[str]] = None):
+        self.visible_dirs = {os.path.abspath(d) for d in (visible_dirs or [str(Path.home() / "Desktop")])}
+        self._heap: List[Tuple] = []
+        # path -> the heap entry currently valid for it; older entries are skipped on pop
+        self._entries: Dict[str, Tuple] = {}
+        # path -> (date, size, visible), cached so re-prioritizing needs no stat
+        self._info: Dict[str, Tuple[str, int, bool]] = {}
+        # Paths queued for the BLIP caption they skipped the first time
+        self._deferred = set()
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self.closed = False
+
+    def _describe(self, path: str) -> Tuple[str, int, bool]:
+        try:
+            stat = os.stat(path)
+            size, mtime = stat.st_size, stat.st_mtime
+        except OSError:
+            size, mtime = 0, 0.0
+        _, taken = parse_screenshot_filename(path)
+        date = (taken or datetime.fromtimestamp(mtime)).strftime('%Y-%m-%d')
+        return date, size, os.path.dirname(os.path.abspath(path)) in self.visible_dirs
+
+    @staticmethod
+    def _priority(info: Tuple[str, int, bool], tier: int) -> Tuple:
+        date, size, visible = info
+        # Negate the date's ordinal so newer days sort first
+        days = -datetime.strptime(date, '%Y-%m-%d').toordinal()
+        return (tier, days, not visible, size)
+
+    def _push_locked(self, path: str, tier: int, info: Optional[Tuple[str, int, bool]] = None) -> bool:
+        current = self._entries.get(path)
+        if current is not None and current[0][0] <= tier:
+            return False
+        if path not in self._info:
+            self._info[path] = info or self._describe(path)
+        entry = (self._priority(self._info[path], tier), next(self._counter), path)
+        self._entries[path] = entry
+        heapq.heappush(self._heap, entry)
+        self._work.notify()
+        return True
+
+    def push(self, path: str, live: bool = False) -> bool:
+        """Queue path; returns False once the scheduler is closed."""
+        with self._lock:
+            if self.closed:
+                return False
+            if live:
+                # The file changed, so it is indexed afresh rather than recaptioned
+                self._deferred.discard(path)
+            self._push_locked(path, LIVE if live else BACKFILL)
+            return True
+
+    def push_many(self, paths: Iterable[str], deferred: bool = False) -> int:
+        """Queue paths for the backlog, or with deferred=True for their skipped BLIP caption.
+
+        Returns how many were newly queued.
+        """
+        # stat outside the lock so live pushes aren't held up by a big backlog
+        with self._lock:
+            paths = [path for path in paths if path not in self._entries]
+        described = [(path, self._describe(path)) for path in paths]
+        queued = 0
+        with self._lock:
+            if self.closed:
+                return 0
+            for path, info in described:
+                if self._push_locked(path, DEFERRED if deferred else BACKFILL, info):
+                    queued += 1
+                    if deferred:
+                        self._deferred.add(path)
+        return queued
+
+    def boost_date_range(self, start_date: Optional[str], end_date: Optional[str] = None) -> int:
+        """Move queued images dated within [start_date, end_date] ahead of the backlog."""
+        if not start_date:
+            return 0
+        end_date = end_date or '9999-12-31'
+        boosted = 0
+        with self._lock:
+            for path in list(self._entries):
+                if start_date <= self._info[path][0] <= end_date and self._push_locked(path, BOOSTED):
+                    boosted += 1
+        return boosted
+
+    def pop(self) -> Optional[str]:
+        """Next path by priority, or None when the queue is empty."""
+        with self._lock:
+            return self._pop_locked()
+
+    def pop_entry(self) -> Optional[Tuple[str, bool]]:
+        """(next path, whether it was queued for a deferred caption), or None when empty."""
+        with self._lock:
+            path = self._pop_locked()
+            if path is None:
+                return None
+            deferred = path in self._deferred
+            self._deferred.discard(path)
+            return path, deferred
+
+    def _pop_locked(self) -> Optional[str]:
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            path = entry[2]
+            if self._entries.get(path) is entry:
+                del self._entries[path]
+                del self._info[path]
+                return path
+        return None
+
+    def drain(self, close: bool = True) -> Iterator[str]:
+        """Yield paths by priority until the queue runs dry, then close the scheduler.
+
+        Closing happens under the same lock as the final empty pop, so a
+        push() either lands in this drain or returns False. With
+        close=False the scheduler stays open for later pops.
+        """
+        while True:
+            with self._lock:
+                path = self._pop_locked()
+                if path is None:
+                    self.closed = self.closed or close
+                    return
+            yield path
+
+    def wait_for_work(self, timeout: Optional[float] = None) -> bool:
+        """Block until something is queued, the scheduler closes or timeout passes."""
+        with self._lock:
+            return self._work.wait_for(lambda: self._entries or self.closed, timeout)
+
+    def close(self):
+        """Refuse further pushes and wake any waiter."""
+        with self._lock:
+            self.closed = True
+            self._work.notify_all()
+
+    def order(self, paths: Iterable[str]) -> List[str]:
+        """paths sorted by backlog priority, without queuing them."""
+        with self._lock:
+            described = {path: self._info.get(path) or self._describe(path) for path in paths}
+        return sorted(described, key=lambda path: self._priority(described[path], BACKFILL))
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
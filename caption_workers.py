@@ -0,0 +1,154 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+import zlib
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+
+def default_worker_layout(cpu_count: Optional[int] = None) -> Tuple[int, int]:
+    """Pick (num_workers, threads_per_worker) for captioning on this host.
+
+    BLIP generation stops scaling after a handful of intra-op threads, so a
+    large host gets more processes with few threads each (8 x 4 on 32 cores).
+    """
+    cpus = cpu_count or os.cpu_count() or 1
+    if cpus >= 16:
+        threads = 4
+    elif cpus >= 4:
+        threads = 2
+    else:
+        threads = 1
+    return max(1, cpus // threads), threads
+
+
+def _worker_main(num_threads: int, task_queue, result_queue):
+    """Load a private model copy and caption paths until told to stop."""
+    import torch
+    torch.set_num_threads(num_threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+
+    from image_processor import ImageProcessor
+    processor = ImageProcessor()
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        seq, path, cached = task
+        if cached:
+            # The parent already captioned this file; get_caption reuses it if unchanged
+            processor.caption_cache[path] = cached
+        try:
+            result = processor.process_single_image(path)
+        except Exception as e:
+            print(f"Error processing {path}: {str(e)}")
+            result = None
+        result_queue.put((seq, result, processor.caption_cache.pop(path, None)))
+
+
+class CaptionWorkerPool:
+    def __init__(self, num_workers: Optional[int] = None, threads_per_worker: Optional[int] = None, queue_depth: int = 4,
+                 caption_cache: Optional[Dict[str, Tuple[float, int, str]]] = None):
+        """Pool of captioning processes with work sharded by path hash.
+
+        caption_cache is the parent ImageProcessor's cache: entries are sent
+        along with each path and workers' new captions are written back.
+        """
+        default_workers, default_threads = default_worker_layout()
+        self.num_workers = num_workers or default_workers
+        self.threads_per_worker = threads_per_worker or default_threads
+        self.queue_depth = queue_depth
+        self.caption_cache = caption_cache if caption_cache is not None else {}
+        self._context = mp.get_context("spawn")
+        self._task_queues = []
+        self._result_queue = None
+        self._processes = []
+
+    def start(self):
+        """Start the worker processes; each loads its own model copy."""
+        if self._processes:
+            return
+        self._result_queue = self._context.Queue()
+        for _ in range(self.num_workers):
+            task_queue = self._context.Queue(maxsize=self.queue_depth)
+            process = self._context.Process(
+                target=_worker_main,
+                args=(self.threads_per_worker, task_queue, self._result_queue),
+                daemon=True,
+            )
+            process.start()
+            self._task_queues.append(task_queue)
+            self._processes.append(process)
+
+    def close(self, timeout: float = 30.0):
+        """Stop all workers, terminating any that are dead, stuck or don't exit within timeout."""
+        for task_queue, process in zip(self._task_queues, self._processes):
+            try:
+                task_queue.put_nowait(None)
+            except queue.Full:
+                # A full queue means the worker stopped taking tasks
+                process.terminate()
+        for process in self._processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._task_queues = []
+        self._processes = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def shard_for(self, path: str) -> int:
+        """Stable worker index for a path."""
+        return zlib.crc32(path.encode("utf-8")) % self.num_workers
+
+    def imap(self, paths: Iterable[str]) -> Iterator[Optional[Dict[str, str]]]:
+        """Caption paths across the pool, yielding results in input order."""
+        self.start()
+        total = None
+        feed_error = None
+
+        def feed():
+            nonlocal total, feed_error
+            count = 0
+            try:
+                for path in paths:
+                    self._task_queues[self.shard_for(path)].put((count, path, self.caption_cache.get(path)))
+                    count += 1
+            except BaseException as e:
+                # Raised from imap once the paths already fed are done, so the caller's close() runs
+                feed_error = e
+            finally:
+                total = count
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        pending = {}
+        next_seq = 0
+        while total is None or next_seq < total:
+            try:
+                seq, result, cached = self._result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not all(p.is_alive() for p in self._processes):
+                    raise RuntimeError("A captioning worker exited unexpectedly")
+                continue
+            if result and cached:
+                self.caption_cache[result['path']] = cached
+            pending[seq] = result
+            while next_seq in pending:
+                yield pending.pop(next_seq)
+                next_seq += 1
+
+        feeder.join()
+        if feed_error is not None:
+            raise feed_error
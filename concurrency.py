@@ -0,0 +1,81 @@
+import threading
+from functools import wraps
+from typing import Dict
+from flask import jsonify
+
+
+class ConcurrencyLimiter:
+    def __init__(self, name: str, max_concurrent: int, max_queue: int = 0, queue_timeout: float = 30.0):
+        """Cap concurrent calls and how many callers may wait for a slot."""
+        self.name = name
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.completed = 0
+
+    def acquire(self) -> bool:
+        """Take a slot, waiting in the queue if there is room; False means shed the call."""
+        if self._slots.acquire(blocking=False):
+            with self._lock:
+                self._active += 1
+            return True
+
+        with self._lock:
+            if self._waiting >= self.max_queue:
+                self.rejected += 1
+                return False
+            self._waiting += 1
+        try:
+            acquired = self._slots.acquire(timeout=self.queue_timeout)
+        finally:
+            with self._lock:
+                self._waiting -= 1
+        with self._lock:
+            if acquired:
+                self._active += 1
+            else:
+                self.timed_out += 1
+        return acquired
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+            self.completed += 1
+        self._slots.release()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'name': self.name,
+                'active': self._active,
+                'waiting': self._waiting,
+                'max_concurrent': self.max_concurrent,
+                'max_queue': self.max_queue,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+            }
+
+
+def limit_concurrency(limiter: ConcurrencyLimiter):
+    """Flask view decorator that answers 503 with Retry-After when the limiter is saturated."""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not limiter.acquire():
+                response = jsonify({'error': f"Too many concurrent {limiter.name} requests, try again shortly"})
+                response.status_code = 503
+                response.headers['Retry-After'] = '5'
+                return response
+            try:
+                return view(*args, **kwargs)
+            finally:
+                limiter.release()
+        return wrapper
+    return decorator
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
+
+import metrics
+
+
+class DeletionExecutor:
+    def __init__(self, vector_store=None, journal_path: Optional[str] = None, max_workers: int = 8):
+        """Delete files in parallel, journaling each batch so a crash can be recovered."""
+        self.vector_store = vector_store
+        self.journal_path = journal_path or str(Path.home() / ".png_cleanup" / "deletion_journal.jsonl")
+        self.max_workers = max_workers
+        self._journal_lock = threading.Lock()
+
+    def _append_journal(self, entry: Dict):
+        """Durably append one entry before acting on it."""
+        with self._journal_lock:
+            os.makedirs(os.path.dirname(self.journal_path), exist_ok=True)
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _pending_batches(self) -> Dict[str, List[str]]:
+        """Batches that were journaled but never marked done."""
+        pending = {}
+        try:
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        continue
+                    if entry.get("status") == "pending":
+                        pending[entry["batch"]] = entry["paths"]
+                    elif entry.get("status") == "done":
+                        pending.pop(entry["batch"], None)
+        except FileNotFoundError:
+            pass
+        return pending
+
+    @staticmethod
+    def _delete_one(path: str) -> Tuple[str, int, Optional[str]]:
+        """Remove a file, returning (path, bytes_freed, error)."""
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            return path, size, None
+        except FileNotFoundError:
+            # Already gone, e.g. deleted before a crash; nothing left to free
+            return path, 0, None
+        except Exception as e:
+            return path, 0, str(e)
+
+    def _run_batch(self, batch_id: str, paths: List[str]) -> Dict:
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            outcomes = list(pool.map(self._delete_one, paths))
+
+        deleted = [path for path, _, error in outcomes if error is None]
+        failed = {path: error for path, _, error in outcomes if error is not None}
+        bytes_freed = sum(size for _, size, _ in outcomes)
+        metrics.incr("files_deleted", len(deleted))
+        metrics.incr("bytes_freed", bytes_freed)
+
+        if self.vector_store and deleted:
+            self.vector_store.remove_images(deleted)
+
+        self._append_journal({"batch": batch_id, "status": "done"})
+        if not self._pending_batches():
+            try:
+                os.remove(self.journal_path)
+            except FileNotFoundError:
+                pass
+
+        return {"deleted": deleted, "failed": failed, "bytes_freed": bytes_freed}
+
+    @metrics.timed("delete_files")
+    def delete(self, paths: List[str]) -> Dict:
+        """Delete paths and drop them from the index.
+
+        Returns a dict with the deleted paths, a path -> error map of
+        failures and the total bytes freed.
+        """
+        paths = list(dict.fromkeys(paths))
+        if not paths:
+            return {"deleted": [], "failed": {}, "bytes_freed": 0}
+
+        batch_id = uuid.uuid4().hex
+        self._append_journal({"batch": batch_id, "status": "pending", "paths": paths})
+        return self._run_batch(batch_id, paths)
+
+    def recover(self) -> Optional[Dict]:
+        """Finish any batches interrupted by a crash; returns combined results or None."""
+        pending = self._pending_batches()
+        if not pending:
+            return None
+
+        combined = {"deleted": [], "failed": {}, "bytes_freed": 0}
+        for batch_id, paths in pending.items():
+            result = self._run_batch(batch_id, paths)
+            combined["deleted"].extend(result["deleted"])
+            combined["failed"].update(result["failed"])
+            combined["bytes_freed"] += result["bytes_freed"]
+        return combined
@@ -0,0 +1,298 @@
+import hashlib
+import heapq
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import List, Dict, Optional, Tuple
+
+from formatting import format_bytes
+from prompt_builder import PromptBuilder, DEFAULT_TOKEN_BUDGET
+
+# Files smaller than this are not worth reporting as duplicates
+DUPLICATE_MIN_SIZE = 1024 * 1024
+LARGEST_PER_DIR = 10
+HASH_PREFIX_BYTES = 64 * 1024
+
+
+class DirStats:
+    __slots__ = ('mtime_ns', 'subdirs', 'own_bytes', 'own_files', 'ext_bytes', 'ext_counts', 'largest', 'dup_sized')
+
+    def __init__(self, mtime_ns: int):
+        self.mtime_ns = mtime_ns
+        self.subdirs: List[str] = []
+        self.own_bytes = 0
+        self.own_files = 0
+        self.ext_bytes = Counter()
+        self.ext_counts = Counter()
+        # (size, path) of the largest files directly in this directory
+        self.largest: List[Tuple[int, str]] = []
+        # (size, path) of files big enough to be duplicate candidates
+        self.dup_sized: List[Tuple[int, str]] = []
+
+
+def _extension(name: str) -> str:
+    ext = os.path.splitext(name)[1].lower()
+    return ext or '(none)'
+
+
+def scan_directory(path: str) -> DirStats:
+    """Stat one directory's entries without recursing."""
+    stats = DirStats(os.stat(path).st_mtime_ns)
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    stats.subdirs.append(entry.path)
+                    continue
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                size = entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+
+            ext = _extension(entry.name)
+            stats.own_bytes += size
+            stats.own_files += 1
+            stats.ext_bytes[ext] += size
+            stats.ext_counts[ext] += 1
+            if len(stats.largest) < LARGEST_PER_DIR:
+                heapq.heappush(stats.largest, (size, entry.path))
+            elif size > stats.largest[0][0]:
+                heapq.heapreplace(stats.largest, (size, entry.path))
+            if size >= DUPLICATE_MIN_SIZE:
+                stats.dup_sized.append((size, entry.path))
+    return stats
+
+
+def _prefix_hash(path: str) -> Optional[str]:
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha1(f.read(HASH_PREFIX_BYTES)).hexdigest()
+    except OSError:
+        return None
+
+
+class DiskUsageIndexer:
+    def __init__(self, root: str, max_workers: int = 8, refresh_interval: float = 300.0, full_rescan_every: int = 12):
+        """Per-directory usage index, built with parallel scandir and refreshed incrementally.
+
+        A directory's mtime doesn't change when a file inside it is
+        rewritten in place, so every full_rescan_every-th refresh ignores
+        the cache to pick up size changes.
+        """
+        self.root = os.path.abspath(root)
+        self.max_workers = max_workers
+        self.refresh_interval = refresh_interval
+        self.full_rescan_every = full_rescan_every
+        self._refresh_count = 0
+        self._dirs: Dict[str, DirStats] = {}
+        # Derived once per scan, so summary() does no aggregation over the whole tree and no file I/O:
+        # directory -> bytes of its whole subtree, and duplicate groups across the tree
+        self._recursive_bytes: Dict[str, int] = {}
+        self._duplicates: List[Dict] = []
+        # (root, top_n) -> summary, valid until the next scan
+        self._summaries: Dict[Tuple[str, int], Dict] = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop_event = threading.Event()
+        self.last_scan_seconds = None
+        self.last_scan_at = None
+        self.rescanned_dirs = 0
+
+    def start(self):
+        """Build the index and keep refreshing it in a background thread."""
+        if self._thread:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    @property
+    def ready(self) -> bool:
+        return self.last_scan_at is not None
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Error indexing disk usage: {str(e)}")
+            self._stop_event.wait(self.refresh_interval)
+
+    def refresh(self):
+        """Rescan only directories whose mtime changed since the last pass."""
+        start = time.perf_counter()
+        with self._lock:
+            previous = self._dirs
+        if self.full_rescan_every and self._refresh_count % self.full_rescan_every == 0:
+            previous = {}
+        self._refresh_count += 1
+        updated: Dict[str, DirStats] = {}
+        rescanned = 0
+
+        def visit(path: str):
+            cached = previous.get(path)
+            try:
+                if cached and os.stat(path).st_mtime_ns == cached.mtime_ns:
+                    return path, cached, False
+                return path, scan_directory(path), True
+            except OSError:
+                return path, None, False
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            pending = {pool.submit(visit, self.root)}
+            while pending:
+                # Handle whichever directories finish first, not one arbitrary future at a time
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, stats, scanned = future.result()
+                    if stats is None:
+                        continue
+                    updated[path] = stats
+                    rescanned += scanned
+                    for subdir in stats.subdirs:
+                        pending.add(pool.submit(visit, subdir))
+
+        recursive_bytes = self._aggregate_sizes(updated)
+        duplicates = self._duplicate_groups(updated)
+        with self._lock:
+            self._dirs = updated
+            self._recursive_bytes = recursive_bytes
+            self._duplicates = duplicates
+            self._summaries = {}
+        self.rescanned_dirs = rescanned
+        self.last_scan_seconds = time.perf_counter() - start
+        self.last_scan_at = time.time()
+        # Warm the summary the app asks for most
+        self.summary()
+
+    def _aggregate_sizes(self, dirs: Dict[str, DirStats]) -> Dict[str, int]:
+        """Bytes under each directory, crediting each directory's files to it and every ancestor up to root."""
+        recursive = defaultdict(int)
+        for dir_path, stats in dirs.items():
+            current = dir_path
+            while True:
+                recursive[current] += stats.own_bytes
+                if current == self.root:
+                    break
+                parent = os.path.dirname(current)
+                if parent == current:
+                    break
+                current = parent
+        return dict(recursive)
+
+    def _subtree(self, root: str) -> Dict[str, DirStats]:
+        with self._lock:
+            dirs = self._dirs
+        prefix = root.rstrip(os.sep) + os.sep
+        return {path: stats for path, stats in dirs.items() if path == root or path.startswith(prefix)}
+
+    def summary(self, path: Optional[str] = None, top_n: int = 10) -> Dict:
+        """Compact usage summary for the tree at path (the indexer root by default).
+
+        Served from what the last scan computed; each (path, top_n) is built
+        at most once per scan.
+        """
+        root = os.path.abspath(path or self.root)
+        with self._lock:
+            cached = self._summaries.get((root, top_n))
+            recursive = self._recursive_bytes
+            duplicates = self._duplicates
+        if cached is not None:
+            return cached
+        dirs = self._subtree(root)
+
+        ext_bytes = Counter()
+        ext_counts = Counter()
+        largest = []
+        total_files = 0
+        for stats in dirs.values():
+            total_files += stats.own_files
+            ext_bytes.update(stats.ext_bytes)
+            ext_counts.update(stats.ext_counts)
+            largest.extend(stats.largest)
+
+        # Only the first two levels below root, so the list stays readable
+        top_dirs = heapq.nlargest(
+            top_n,
+            ((recursive.get(p, 0), p) for p in dirs
+             if p != root and os.path.relpath(p, root).count(os.sep) <= 1),
+        )
+
+        prefix = root.rstrip(os.sep) + os.sep
+        duplicate_candidates = []
+        for group in duplicates:
+            paths = [p for p in group['paths'] if p.startswith(prefix)]
+            if len(paths) > 1:
+                duplicate_candidates.append({'bytes': group['bytes'], 'wasted_bytes': group['bytes'] * (len(paths) - 1),
+                                             'paths': paths})
+        duplicate_candidates.sort(key=lambda g: g['wasted_bytes'], reverse=True)
+
+        summary = {
+            'root': root,
+            'ready': self.ready,
+            'last_scan_seconds': round(self.last_scan_seconds, 3) if self.last_scan_seconds else None,
+            'total_bytes': recursive.get(root, sum(stats.own_bytes for stats in dirs.values())),
+            'total_files': total_files,
+            'total_dirs': len(dirs),
+            'largest_dirs': [{'path': p, 'bytes': size} for size, p in top_dirs],
+            'file_types': [
+                {'ext': ext, 'bytes': size, 'count': ext_counts[ext]}
+                for ext, size in ext_bytes.most_common(top_n)
+            ],
+            'largest_files': [{'path': p, 'bytes': size} for size, p in heapq.nlargest(top_n, largest)],
+            'duplicate_candidates': duplicate_candidates[:top_n],
+        }
+        if self.ready:
+            with self._lock:
+                if self._recursive_bytes is recursive:
+                    self._summaries[(root, top_n)] = summary
+        return summary
+
+    @staticmethod
+    def _duplicate_groups(dirs: Dict[str, DirStats]) -> List[Dict]:
+        """Same-size files across the tree, split by a hash of their first bytes, ranked by wasted space."""
+        by_size = defaultdict(list)
+        for stats in dirs.values():
+            for size, file_path in stats.dup_sized:
+                by_size[size].append(file_path)
+        groups = []
+        for size, paths in by_size.items():
+            if len(paths) < 2:
+                continue
+            by_hash = defaultdict(list)
+            for file_path in paths:
+                digest = _prefix_hash(file_path)
+                if digest:
+                    by_hash[digest].append(file_path)
+            for same in by_hash.values():
+                if len(same) > 1:
+                    groups.append({'bytes': size, 'wasted_bytes': size * (len(same) - 1), 'paths': same})
+        groups.sort(key=lambda g: g['wasted_bytes'], reverse=True)
+        return groups
+
+
+def format_summary(summary: Dict, budget_tokens: int = DEFAULT_TOKEN_BUDGET) -> str:
+    """Render a summary as short plain-text lines for an LLM prompt, within budget_tokens."""
+    builder = PromptBuilder(budget_tokens)
+    builder.add(f"Root: {summary['root']}", force=True)
+    builder.add(f"Total: {format_bytes(summary['total_bytes'])} in {summary['total_files']} files, {summary['total_dirs']} folders", force=True)
+    if not summary['ready']:
+        builder.add("(Disk scan still in progress; figures are partial.)", force=True)
+    # Each section gets a share of the budget so none can crowd out the rest
+    share = budget_tokens // 4
+    builder.add_section("Largest folders:", [f"- {d['path']}: {format_bytes(d['bytes'])}" for d in summary['largest_dirs']],
+                        max_tokens=share)
+    builder.add_section("Space by file type:", [f"- {t['ext']}: {format_bytes(t['bytes'])} ({t['count']} files)" for t in summary['file_types']],
+                        max_tokens=share)
+    builder.add_section("Largest files:", [f"- {f['path']}: {format_bytes(f['bytes'])}" for f in summary['largest_files']],
+                        max_tokens=share)
+    builder.add_section("Likely duplicates:", [
+        f"- {len(g['paths'])} copies of {format_bytes(g['bytes'])} ({', '.join(g['paths'][:3])})"
+        for g in summary['duplicate_candidates']
+    ])
+    return builder.build()
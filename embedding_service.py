@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Optional
+
+import numpy as np
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+import metrics
+from model_cache import IdleModel, MODEL_IDLE_TIMEOUT
+
+DEFAULT_EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+class EmbeddingService:
+    def __init__(self, model_name: str = DEFAULT_EMBEDDING_MODEL, batch_size: int = 64, cache_size: int = 1024,
+                 idle_timeout: float = MODEL_IDLE_TIMEOUT):
+        """Shared sentence-transformer embedding with batching and a query cache."""
+        self.model_name = model_name
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        # Cached query vectors stay valid across an idle unload, so repeated
+        # queries never force a reload
+        self._model = IdleModel("embedding", self._load_model, idle_timeout)
+        self._query_cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "model_load_seconds": 0.0,
+            "texts_embedded": 0,
+            "batches": 0,
+            "batch_seconds": 0.0,
+            "queries": 0,
+            "query_cache_hits": 0,
+            "query_seconds": 0.0,
+        }
+
+    def _load_model(self) -> HuggingFaceEmbedding:
+        start = time.perf_counter()
+        model = HuggingFaceEmbedding(
+            model_name=self.model_name,
+            embed_batch_size=self.batch_size,
+        )
+        self._record("model_load_seconds", time.perf_counter() - start)
+        return model
+
+    @property
+    def model(self) -> HuggingFaceEmbedding:
+        """Load the embedding model on first use (or after an idle unload) and reuse it."""
+        return self._model.get()
+
+    def _record(self, key: str, value):
+        with self._metrics_lock:
+            self._metrics[key] += value
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    def embed_texts(self, texts: List[str]) -> np.ndarray:
+        """Embed texts in batches and return an (n, dim) array of unit vectors."""
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+
+        chunks = []
+        for i in range(0, len(texts), self.batch_size):
+            batch = texts[i:i + self.batch_size]
+            model = self.model
+            start = time.perf_counter()
+            vectors = model.get_text_embedding_batch(batch)
+            elapsed = time.perf_counter() - start
+            chunks.append(np.asarray(vectors, dtype=np.float32))
+            with self._metrics_lock:
+                self._metrics["batches"] += 1
+                self._metrics["texts_embedded"] += len(batch)
+                self._metrics["batch_seconds"] += elapsed
+
+        return self._normalize(np.vstack(chunks))
+
+    def embed_query(self, query: str) -> np.ndarray:
+        """Embed a search query, serving repeated queries from an LRU cache."""
+        key = " ".join(query.lower().split())
+        with self._cache_lock:
+            cached = self._query_cache.get(key)
+            if cached is not None:
+                self._query_cache.move_to_end(key)
+        if cached is not None:
+            with self._metrics_lock:
+                self._metrics["queries"] += 1
+                self._metrics["query_cache_hits"] += 1
+            return cached
+
+        model = self.model
+        start = time.perf_counter()
+        vector = self._normalize(np.asarray(model.get_query_embedding(query), dtype=np.float32))
+        elapsed = time.perf_counter() - start
+        with self._metrics_lock:
+            self._metrics["queries"] += 1
+            self._metrics["query_seconds"] += elapsed
+
+        with self._cache_lock:
+            self._query_cache[key] = vector
+            self._query_cache.move_to_end(key)
+            while len(self._query_cache) > self.cache_size:
+                self._query_cache.popitem(last=False)
+        return vector
+
+    def get_metrics(self) -> Dict[str, float]:
+        """Return throughput, latency and cache statistics."""
+        with self._metrics_lock:
+            m = dict(self._metrics)
+        model_stats = self._model.stats()
+        misses = m["queries"] - m["query_cache_hits"]
+        return {
+            "model_name": self.model_name,
+            "model_loaded": self._model.loaded,
+            "model_load_seconds": round(m["model_load_seconds"], 3),
+            "model_loads": self._model.loads,
+            "model_unloads": self._model.unloads,
+            "model_idle_timeout": self._model.idle_timeout,
+            "avg_model_reload_seconds": model_stats["avg_reload_seconds"],
+            "rss_mb": model_stats["rss_mb"],
+            "texts_embedded": m["texts_embedded"],
+            "batches": m["batches"],
+            "texts_per_second": round(m["texts_embedded"] / m["batch_seconds"], 1) if m["batch_seconds"] else 0.0,
+            "avg_batch_latency_ms": round(1000 * m["batch_seconds"] / m["batches"], 2) if m["batches"] else 0.0,
+            "queries": m["queries"],
+            "query_cache_hits": m["query_cache_hits"],
+            "query_cache_hit_rate": round(m["query_cache_hits"] / m["queries"], 3) if m["queries"] else 0.0,
+            "avg_query_latency_ms": round(1000 * m["query_seconds"] / misses, 2) if misses else 0.0,
+            "query_cache_size": len(self._query_cache),
+        }
+
+
+_default_service: Optional[EmbeddingService] = None
+_default_service_lock = threading.Lock()
+
+
+def get_embedding_service() -> EmbeddingService:
+    """Return the process-wide embedding service, creating it on first use."""
+    global _default_service
+    if _default_service is None:
+        with _default_service_lock:
+            if _default_service is None:
+                _default_service = EmbeddingService()
+                metrics.register_gauges("embedding", _default_service.get_metrics)
+    return _default_service
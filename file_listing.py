@@ -0,0 +1,145 @@
+import base64
+import bisect
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+from typing import List, Dict, Optional, Tuple
+
+PREVIEW_EXTENSIONS = {'txt', 'md', 'py', 'js', 'html', 'css'}
+PREVIEW_LINES = 5
+PREVIEW_MAX_CHARS = 2000
+
+
+def read_preview(path: str) -> str:
+    """First few lines of a text file."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return ''.join(islice(f, PREVIEW_LINES))[:PREVIEW_MAX_CHARS]
+    except Exception:
+        return '[Preview unavailable]'
+
+
+def _sort_key(entry: Dict) -> Tuple[bool, str, str]:
+    # Folders first, then case-insensitive name; the raw name breaks ties
+    return (not entry['is_dir'], entry['name'].lower(), entry['name'])
+
+
+def encode_cursor(key: Tuple[bool, str, str]) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str) -> Tuple[bool, str, str]:
+    """The sort key a cursor points after; raises ValueError for anything malformed."""
+    try:
+        is_file, lower, name = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if not isinstance(lower, str) or not isinstance(name, str):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return (bool(is_file), lower, name)
+
+
+class DirectoryListingService:
+    def __init__(self, base_dir: str, page_size: int = 200, preview_budget: float = 0.05,
+                 max_workers: int = 4, cache_size: int = 256):
+        """Paginated directory listings with an mtime-validated cache and lazy previews."""
+        self.base_dir = base_dir
+        self.page_size = page_size
+        self.preview_budget = preview_budget
+        self.cache_size = cache_size
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="preview")
+        self._lock = threading.Lock()
+        # full_path -> (dir mtime_ns, sort keys, entries)
+        self._listings = OrderedDict()
+        # (full_path, mtime_ns) -> preview text
+        self._previews = OrderedDict()
+
+    def _cache_put(self, cache: OrderedDict, key, value, limit: int):
+        with self._lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > limit:
+                cache.popitem(last=False)
+
+    def _scan(self, full_path: str) -> Tuple[List[Tuple], List[Dict]]:
+        entries = []
+        with os.scandir(full_path) as it:
+            for entry in it:
+                if entry.name == '.DS_Store':
+                    continue
+                try:
+                    is_dir = entry.is_dir()
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append({
+                    'name': entry.name,
+                    'path': os.path.relpath(entry.path, self.base_dir),
+                    'is_dir': is_dir,
+                    'size': 0 if is_dir else stat.st_size,
+                    'mtime_ns': stat.st_mtime_ns,
+                })
+        entries.sort(key=_sort_key)
+        return [_sort_key(e) for e in entries], entries
+
+    def _listing(self, full_path: str) -> Tuple[List[Tuple], List[Dict]]:
+        """Directory entries, rescanned only when the directory's mtime changes."""
+        mtime_ns = os.stat(full_path).st_mtime_ns
+        with self._lock:
+            cached = self._listings.get(full_path)
+            if cached and cached[0] == mtime_ns:
+                self._listings.move_to_end(full_path)
+                return cached[1], cached[2]
+
+        keys, entries = self._scan(full_path)
+        self._cache_put(self._listings, full_path, (mtime_ns, keys, entries), self.cache_size)
+        return keys, entries
+
+    def preview(self, full_path: str) -> str:
+        """Cached preview for a file, keyed by its mtime."""
+        key = (full_path, os.stat(full_path).st_mtime_ns)
+        with self._lock:
+            cached = self._previews.get(key)
+        if cached is not None:
+            return cached
+        text = read_preview(full_path)
+        self._cache_put(self._previews, key, text, self.cache_size * 16)
+        return text
+
+    def list(self, full_path: str, cursor: Optional[str] = None, limit: Optional[int] = None) -> Dict:
+        """One page of entries plus the cursor for the next page.
+
+        Previews are read in the thread pool; any not ready within
+        preview_budget seconds are flagged preview_pending so the client
+        can fetch them separately.
+        """
+        limit = max(1, min(limit or self.page_size, self.page_size))
+        keys, entries = self._listing(full_path)
+
+        start = bisect.bisect_right(keys, decode_cursor(cursor)) if cursor else 0
+        page = [dict(e) for e in entries[start:start + limit]]
+        next_cursor = encode_cursor(keys[start + limit - 1]) if start + limit < len(entries) else None
+
+        futures = {}
+        for entry in page:
+            if not entry['is_dir'] and entry['name'].split('.')[-1].lower() in PREVIEW_EXTENSIONS:
+                entry_path = os.path.join(self.base_dir, entry['path'])
+                futures[self._executor.submit(self.preview, entry_path)] = entry
+
+        if futures:
+            done, _ = wait(futures, timeout=self.preview_budget)
+            for future, entry in futures.items():
+                if future not in done:
+                    entry['preview_pending'] = True
+                elif future.exception() is not None:
+                    entry['preview'] = '[Preview unavailable]'
+                else:
+                    entry['preview'] = future.result()
+
+        for entry in page:
+            entry.pop('mtime_ns', None)
+
+        return {'entries': page, 'next_cursor': next_cursor}
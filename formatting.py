@@ -0,0 +1,10 @@
+"""Small formatting helpers shared by the CLI, the web app and LLM prompts."""
+
+
+def format_bytes(num_bytes: int) -> str:
+    """Human-readable size, e.g. '12.3 MB'."""
+    size = float(num_bytes)
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024 or unit == "GB":
+            return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
@@ -0,0 +1,167 @@
+import os
+from typing import Any, Dict, List, Optional, Tuple
+from PIL import Image
+
+# Hamming distance (out of 64 bits) at or below which two images are near-duplicates
+DEFAULT_MAX_DISTANCE = 6
+
+
+def compute_dhash(image_path: str, hash_size: int = 8) -> Optional[str]:
+    """Difference hash of an image as a 16-character hex string."""
+    try:
+        with Image.open(image_path) as image:
+            # draft() lets decoders that support it skip full-resolution decoding
+            image.draft('L', (hash_size * 4, hash_size * 4))
+            pixels = image.convert('L').resize((hash_size + 1, hash_size), Image.BILINEAR).load()
+    except Exception as e:
+        print(f"Error hashing image {image_path}: {str(e)}")
+        return None
+
+    value = 0
+    for y in range(hash_size):
+        for x in range(hash_size):
+            value = (value << 1) | (pixels[x, y] > pixels[x + 1, y])
+    return f"{value:0{hash_size * hash_size // 4}x}"
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class MultiIndexHash:
+    def __init__(self, num_chunks: int = 4, bits: int = 64):
+        """Multi-index hashing over 64-bit hashes for radius queries under Hamming distance.
+
+        Each hash is split into num_chunks substrings, each with its own
+        lookup table. Two hashes within distance r must agree to within
+        r // num_chunks on at least one substring (pigeonhole), so a query
+        probes only those nearby buckets instead of scanning every hash.
+        """
+        self.num_chunks = num_chunks
+        self.chunk_bits = bits // num_chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._tables: List[Dict[int, List[int]]] = [{} for _ in range(num_chunks)]
+        # Removed entries become None, so entry ids in the tables stay valid
+        self._entries: List[Optional[Tuple[int, Any]]] = []
+        self._removed = 0
+        self._flip_masks: Dict[int, List[int]] = {}
+
+    @property
+    def size(self) -> int:
+        return len(self._entries) - self._removed
+
+    def _chunks(self, hash_value: int) -> List[int]:
+        return [(hash_value >> (i * self.chunk_bits)) & self._chunk_mask for i in range(self.num_chunks)]
+
+    def _masks(self, radius: int) -> List[int]:
+        """All chunk-sized bit masks with at most radius bits set."""
+        if radius not in self._flip_masks:
+            masks = [0]
+            frontier = [0]
+            for _ in range(radius):
+                frontier = list({m | (1 << b) for m in frontier for b in range(self.chunk_bits) if not m & (1 << b)})
+                masks.extend(frontier)
+            self._flip_masks[radius] = masks
+        return self._flip_masks[radius]
+
+    def add(self, hash_value: int, item: Any):
+        entry_id = len(self._entries)
+        self._entries.append((hash_value, item))
+        for table, chunk in zip(self._tables, self._chunks(hash_value)):
+            table.setdefault(chunk, []).append(entry_id)
+
+    def remove(self, hash_value: int, item: Any) -> bool:
+        """Drop the entry added with this hash and item; False if there is none."""
+        chunks = self._chunks(hash_value)
+        for entry_id in self._tables[0].get(chunks[0], []):
+            if self._entries[entry_id] == (hash_value, item):
+                break
+        else:
+            return False
+        for table, chunk in zip(self._tables, chunks):
+            bucket = table[chunk]
+            bucket.remove(entry_id)
+            if not bucket:
+                del table[chunk]
+        self._entries[entry_id] = None
+        self._removed += 1
+        return True
+
+    def search(self, hash_value: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """All (distance, item) pairs within max_distance of hash_value."""
+        masks = self._masks(max_distance // self.num_chunks)
+        candidates = set()
+        for table, chunk in zip(self._tables, self._chunks(hash_value)):
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+
+        matches = []
+        entries = self._entries
+        for entry_id in candidates:
+            # Candidates come from the tables, which never hold removed entries
+            other, item = entries[entry_id]
+            distance = (hash_value ^ other).bit_count()
+            if distance <= max_distance:
+                matches.append((distance, item))
+        return matches
+
+
+def group_near_duplicates(records: List[Dict[str, str]], max_distance: int = DEFAULT_MAX_DISTANCE,
+                          index: Optional[MultiIndexHash] = None) -> List[List[Dict[str, str]]]:
+    """Group records whose dhash values are within max_distance of the group's oldest image.
+
+    The oldest record of each group is the one kept, and every other member
+    is within max_distance of it, not merely chained to it through other
+    members. Members are copies carrying 'distance' to the kept image.
+    index may be a prebuilt MultiIndexHash whose items are indexes into records.
+    Groups are returned largest first, each sorted oldest first.
+    """
+    if index is None:
+        index = MultiIndexHash()
+        for i, record in enumerate(records):
+            if record.get('dhash'):
+                index.add(int(record['dhash'], 16), i)
+
+    def age(i):
+        record = records[i]
+        return (record.get('creation_date', ''), record.get('creation_time', ''), record['path'])
+
+    # Oldest first, so each group is seeded by the image it keeps
+    order = sorted((i for i, record in enumerate(records) if record.get('dhash')), key=age)
+    assigned = set()
+    result = []
+    for keeper in order:
+        if keeper in assigned:
+            continue
+        assigned.add(keeper)
+        members = [
+            (distance, j)
+            for distance, j in index.search(int(records[keeper]['dhash'], 16), max_distance)
+            if j not in assigned
+        ]
+        if not members:
+            continue
+        assigned.update(j for _, j in members)
+        group = [dict(records[keeper], distance=0)]
+        group.extend(dict(records[j], distance=distance) for distance, j in sorted(members, key=lambda m: age(m[1])))
+        result.append(group)
+    result.sort(key=len, reverse=True)
+    return result
+
+
+def same_file_contents(path_a: str, path_b: str, chunk_size: int = 1 << 20) -> bool:
+    """Whether two files are byte-for-byte identical; False if either can't be read."""
+    try:
+        if os.path.getsize(path_a) != os.path.getsize(path_b):
+            return False
+        with open(path_a, 'rb') as a, open(path_b, 'rb') as b:
+            while True:
+                chunk = a.read(chunk_size)
+                if chunk != b.read(chunk_size):
+                    return False
+                if not chunk:
+                    return True
+    except OSError:
+        return False
@@ -1,126 +1,253 @@
 import os
+import time
 from pathlib import Path
-from datetime import datetime
 from PIL import Image
 import torch
 from transformers import BlipProcessor, BlipForConditionalGeneration
-from llama_index.core import VectorStoreIndex, Document
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.core import VectorStoreIndex
+from llama_index.core.schema import TextNode
+from embedding_service import get_embedding_service
+from caption_workers import CaptionWorkerPool
+from image_hashing import compute_dhash
+from metadata import extract_metadata, metadata_caption
+from model_cache import IdleModel, load_cached_pretrained, MODEL_IDLE_TIMEOUT
+import metrics
 import magic
-from typing import List, Dict, Tuple
+from typing import List, Dict, Tuple, Iterable, Iterator, Optional, Union
+
+# How screenshots are captioned: "always" runs BLIP, "defer" indexes them with
+# a metadata caption and leaves BLIP for a later pass, "skip" never runs it
+SCREENSHOT_CAPTIONS = os.getenv("SCREENSHOT_CAPTIONS", "defer").lower()
+BLIP_MODEL = "Salesforce/blip-image-captioning-base"
 
 class ImageProcessor:
-    def __init__(self):
-        self.processor = BlipProcessor.from_pretrained("Salesforce/blip-image-captioning-base")
-        self.model = BlipForConditionalGeneration.from_pretrained("Salesforce/blip-image-captioning-base")
+    def __init__(self, screenshot_captions: str = SCREENSHOT_CAPTIONS, idle_timeout: float = MODEL_IDLE_TIMEOUT):
+        """BLIP captioner; with idle_timeout set, the model unloads after that many idle seconds."""
+        self.screenshot_captions = screenshot_captions
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model.to(self.device)
+        self.blip = IdleModel("blip", self._load_blip, idle_timeout, on_unload=self._release_device_memory)
+        if not idle_timeout:
+            # Without idle unloading, pay the load up front as before
+            with metrics.timer("model_load"):
+                self.blip.get()
+        # path -> (mtime, size, caption), so unchanged files are never re-captioned
+        self.caption_cache: Dict[str, Tuple[float, int, str]] = {}
+
+    def _load_blip(self) -> Tuple[BlipProcessor, BlipForConditionalGeneration]:
+        # The safetensors copy only pays off when the model gets reloaded after idling
+        save = bool(self.blip.idle_timeout)
+        processor = load_cached_pretrained(BlipProcessor, BLIP_MODEL, save=save)
+        model = load_cached_pretrained(BlipForConditionalGeneration, BLIP_MODEL, save=save)
+        model.to(self.device)
+        return processor, model
+
+    def _release_device_memory(self):
+        if self.device == "cuda":
+            torch.cuda.empty_cache()
+
+    @property
+    def processor(self) -> BlipProcessor:
+        return self.blip.get()[0]
 
+    @property
+    def model(self) -> BlipForConditionalGeneration:
+        return self.blip.get()[1]
+
+    def model_status(self) -> Dict:
+        """Whether BLIP is loaded, its load/reload latency and this process's RSS."""
+        return self.blip.stats()
+
+    @metrics.timed("magic_sniff")
     def is_png(self, file_path: str) -> bool:
         """Check if file is a PNG using python-magic."""
         mime = magic.Magic(mime=True)
         file_type = mime.from_file(file_path)
         return file_type == 'image/png'
 
-    def scan_desktop(self) -> List[str]:
-        """Scan desktop for PNG files."""
-        desktop_path = str(Path.home() / "Desktop")
-        png_files = []
-        for root, _, files in os.walk(desktop_path):
+    def iter_png_files(self, root_dir: Optional[str] = None) -> Iterator[str]:
+        """Recursively yield PNG files under root_dir (the desktop by default)."""
+        root_dir = root_dir or str(Path.home() / "Desktop")
+        for root, _, files in os.walk(root_dir):
             for file in files:
                 if file.lower().endswith('.png'):
                     full_path = os.path.join(root, file)
                     if self.is_png(full_path):
-                        png_files.append(full_path)
-        return png_files
+                        yield full_path
+
+    @metrics.timed("scan")
+    def scan_desktop(self) -> List[str]:
+        """Scan desktop for PNG files."""
+        return list(self.iter_png_files())
 
     def generate_caption(self, image_path: str) -> str:
         """Generate caption for an image using BLIP."""
         try:
-            image = Image.open(image_path).convert('RGB')
-            inputs = self.processor(image, return_tensors="pt").to(self.device)
-            out = self.model.generate(**inputs, max_length=50)
-            caption = self.processor.decode(out[0], skip_special_tokens=True)
+            processor, model = self.blip.get()
+            with metrics.timer("decode"):
+                image = Image.open(image_path).convert('RGB')
+                inputs = processor(image, return_tensors="pt").to(self.device)
+            with metrics.timer("blip_generate"):
+                out = model.generate(**inputs, max_length=50)
+                caption = processor.decode(out[0], skip_special_tokens=True)
             return caption
         except Exception as e:
             print(f"Error processing image {image_path}: {str(e)}")
+            metrics.incr("caption_errors")
             return ""
 
+    def get_caption(self, image_path: str) -> str:
+        """Return the cached caption for an unchanged file, generating it otherwise."""
+        stat = os.stat(image_path)
+        cached = self.caption_cache.get(image_path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            metrics.incr("caption_cache_hits")
+            return cached[2]
 
-    def process_single_image(self, image_path: str) -> Dict[str, str]:
-        """Process a single image and return its metadata."""
+        caption = self.generate_caption(image_path)
+        if caption:
+            self.caption_cache[image_path] = (stat.st_mtime, stat.st_size, caption)
+        return caption
+
+    @metrics.timed("process_image")
+    def process_single_image(self, image_path: str, force_caption: bool = False) -> Dict[str, str]:
+        """Process a single image and return its metadata.
+        
+        Screenshots get a metadata caption instead of BLIP unless
+        screenshot_captions is "always" or force_caption is set; deferred
+        ones are flagged with needs_caption for a later pass.
+        """
+        metrics.incr("images_processed")
         try:
-            caption = self.generate_caption(image_path)
-            creation_time = datetime.fromtimestamp(os.path.getctime(image_path))
+            with metrics.timer("read_metadata"):
+                info = extract_metadata(image_path)
+            needs_caption = False
+            if info['is_screenshot'] and not force_caption and self.screenshot_captions != "always":
+                caption = metadata_caption(info)
+                needs_caption = self.screenshot_captions == "defer"
+                metrics.incr("captions_skipped")
+            else:
+                caption = self.get_caption(image_path)
+                if not caption and info['is_screenshot']:
+                    # BLIP failed (e.g. out of memory, or the file is still being written);
+                    # keep the metadata caption and leave the screenshot queued for a retry
+                    caption = metadata_caption(info)
+                    needs_caption = True
+            # dHash decodes every pixel (draft() can't shrink a PNG decode), so a
+            # deferred screenshot is hashed by its BLIP pass rather than twice
+            dhash = ''
+            if not needs_caption:
+                with metrics.timer("dhash"):
+                    dhash = compute_dhash(image_path) or ''
+            creation_time = info['capture_time']
             return {
                 'path': image_path,
                 'caption': caption,
                 'creation_date': creation_time.strftime('%Y-%m-%d'),
-                'creation_time': creation_time.strftime('%H:%M:%S')
+                'creation_time': creation_time.strftime('%H:%M:%S'),
+                'time_source': info['time_source'],
+                'is_screenshot': info['is_screenshot'],
+                'needs_caption': needs_caption,
+                'dhash': dhash
             }
         except Exception as e:
             print(f"Error processing {image_path}: {str(e)}")
             return None
 
-    def scan_desktop(self) -> List[str]:
-       """Scan desktop for PNG files."""
-       desktop_path = str(Path.home() / "Desktop")
-       png_files = []
-      
-       for root, _, files in os.walk(desktop_path):
-           for file in files:
-               if file.lower().endswith('.png'):
-                   full_path = os.path.join(root, file)
-                   if self.is_png(full_path):
-                       png_files.append(full_path)
-      
-       return png_files
+    def iter_processed_images(
+        self,
+        image_paths: Optional[Iterable[str]] = None,
+        num_workers: int = 1,
+        threads_per_worker: Optional[int] = None,
+    ) -> Iterator[Dict[str, str]]:
+        """Yield image metadata as each image finishes processing.
+
+        image_paths defaults to a lazy walk of the desktop. With
+        num_workers > 1, captioning runs in a CaptionWorkerPool of separate
+        processes; num_workers=0 sizes the pool for this host.
+        """
+        if image_paths is None:
+            image_paths = self.iter_png_files()
+
+        pool = None
+        if num_workers == 1:
+            results = map(self.process_single_image, image_paths)
+        else:
+            pool = CaptionWorkerPool(num_workers or None, threads_per_worker, caption_cache=self.caption_cache)
+            results = pool.imap(image_paths)
+
+        try:
+            for image_data in results:
+                if image_data:
+                    yield image_data
+        finally:
+            if pool:
+                pool.close()
+
+    def process_images(self, num_workers: int = 1, threads_per_worker: Optional[int] = None) -> List[Dict[str, str]]:
+        """Process all PNG images on desktop and return their metadata."""
+        return list(self.iter_processed_images(num_workers=num_workers, threads_per_worker=threads_per_worker))
+
+    def build_caption_index(
+        self,
+        items: Union[str, Iterable[Union[str, Tuple[str, str]]]],
+        batch_size: int = 64,
+        index: Optional[VectorStoreIndex] = None,
+    ) -> VectorStoreIndex:
+        """Stream images into a caption index batch by batch.
+
+        items is a directory to walk, or an iterable of image paths or
+        (path, caption) pairs. Captions are embedded one batch at a time, so
+        the embedding working set stays bounded, but the index still keeps
+        every node: the default in-memory store grows with the number of
+        images. Pass an index backed by a persistent vector store to keep
+        memory flat for very large folders.
+        """
+        if isinstance(items, str):
+            items = self.iter_png_files(items)
+
+        embedding_service = get_embedding_service()
+        if index is None:
+            index = VectorStoreIndex(nodes=[], embed_model=embedding_service.model)
+
+        indexed = 0
+        start = time.perf_counter()
+        batch: List[Tuple[str, str]] = []
+
+        def flush():
+            nonlocal indexed
+            texts = [f"{caption} ||| {Path(path).name}" for path, caption in batch]  # Append filename
+            embeddings = embedding_service.embed_texts(texts)
+            nodes = [
+                TextNode(
+                    id_=path,
+                    text=text,
+                    embedding=embedding.tolist(),
+                    metadata={'path': path, 'caption': caption},
+                )
+                for (path, caption), text, embedding in zip(batch, texts, embeddings)
+            ]
+            index.insert_nodes(nodes)
+            indexed += len(nodes)
+            elapsed = time.perf_counter() - start
+            print(f"Indexed {indexed} images ({indexed / elapsed:.1f} images/s)")
+            batch.clear()
+
+        for item in items:
+            if isinstance(item, str):
+                try:
+                    path, caption = item, self.get_caption(item)
+                except OSError as e:
+                    print(f"Error processing {item}: {str(e)}")
+                    continue
+            else:
+                path, caption = item
+            if not caption:
+                continue
+            batch.append((path, caption))
+            if len(batch) >= batch_size:
+                flush()
+
+        if batch:
+            flush()
 
-    def generate_caption(self, image_path: str) -> str:
-       """Generate caption for an image using BLIP."""
-       try:
-           image = Image.open(image_path).convert('RGB')
-           inputs = self.processor(image, return_tensors="pt").to(self.device)
-          
-           out = self.model.generate(**inputs, max_length=50)
-           caption = self.processor.decode(out[0], skip_special_tokens=True)
-          
-           return caption
-       except Exception as e:
-           print(f"Error processing image {image_path}: {str(e)}")
-           return ""
-
-
-    def process_images(self) -> List[Dict[str, str]]:
-       """Process all PNG images on desktop and return their metadata."""
-       png_files = self.scan_desktop()
-       processed_images = []
-      
-       for image_path in png_files:
-           try:
-               caption = self.generate_caption(image_path)
-               creation_time = datetime.fromtimestamp(os.path.getctime(image_path))
-              
-               processed_images.append({
-                   'path': image_path,
-                   'caption': caption,
-                   'creation_date': creation_time.strftime('%Y-%m-%d'),
-                   'creation_time': creation_time.strftime('%H:%M:%S')
-               })
-              
-           except Exception as e:
-               print(f"Error processing {image_path}: {str(e)}")
-               continue
-      
-       return processed_images
-
-    def build_caption_index(image_dir: str):
-        documents = []
-        for path in Path(image_dir).glob("*.png"):
-            caption = generate_caption(str(path))
-            text = f"{caption} ||| {path.name}"  # Append filename
-            documents.append(Document(text=text))
-        
-        embed_model = HuggingFaceEmbedding(model_name="sentence-transformers/all-MiniLM-L6-v2")
-        index = VectorStoreIndex.from_documents(documents, embed_model=embed_model)
         return index
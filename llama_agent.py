@@ -1,68 +1,177 @@
-from llama_stack_client import LlamaStackClient, Agent
+from llama_stack_client import Agent
 from typing import Optional, List, Dict
+from llama_client import CircuitBreaker, CircuitOpenError, GuardedClient, get_shared_client, is_retryable, DEFAULT_BASE_URL
+from prompt_builder import estimate_tokens, summarize_images
+import json
+import os
+import re
+import metrics
+
+INSTRUCTIONS = "You are a helpful assistant that helps users find and delete PNG images from their desktop. When asked to find images, identify the relevant criteria (date, content, etc.) and search for matching images. When asked to delete images, always confirm before deletion."
+
+# Estimated tokens an agent session may hold before a fresh one is started
+SESSION_TOKEN_BUDGET = int(os.getenv("LLAMA_SESSION_TOKEN_BUDGET", "4000"))
+
+def message_text(message) -> str:
+    """Text of a CompletionMessage, whose content is a string or a list of content items."""
+    content = message.content
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(getattr(item, "text", "") for item in content)
+    return getattr(content, "text", "")
 
 class LlamaAgent:
-    def __init__(self, base_url="http://localhost:8321"):
-        """Initialize Llama Stack client and agent."""
-        self.client = LlamaStackClient(api_key="")
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, api_key: Optional[str] = None, client=None,
+                 agent_cls=Agent, breaker: Optional[CircuitBreaker] = None):
+        """Initialize Llama Stack client and agent.
         
-        # Get available models
+        api_key defaults to LLAMA_STACK_API_KEY. client and agent_cls can be
+        swapped for local stand-ins, e.g. in benchmarks.
+        """
+        self.raw_client = client or get_shared_client(base_url, api_key)
+        self.agent_cls = agent_cls
+        # Probe with the raw client; guarded calls are rejected while open
+        self.breaker = breaker or CircuitBreaker(probe=self.raw_client.models.list, on_recover=self._on_recover)
+        self.client = GuardedClient(self.raw_client, self.breaker)
+        self.model_id = None
+        self.agent = None
+        self.session_id = None
+        self.session_budget = SESSION_TOKEN_BUDGET
+        # Estimated tokens of context the current session carries into its next turn
+        self.session_tokens = 0
+        self.session_turns = 0
+        self.session_rotations = 0
+        self.last_prompt_tokens = 0
+        # Called after the breaker closes again, e.g. to flush queued uploads
+        self.recover_listeners = []
+        self.connect()
+    
+    @property
+    def circuit_open(self) -> bool:
+        """True while Llama Stack is considered down; callers should stay local."""
+        return self.breaker.is_open
+    
+    def connect(self):
+        """Pick a model and create the agent session."""
         try:
             models = self.client.models.list()
             self.model_id = next(m for m in models if m.model_type == "llm").identifier
             print(f"Using LLM model: {self.model_id}")
             
             # Create an agent with appropriate instructions
-            self.agent = Agent(
-                self.client,
+            agent = self.agent_cls(
+                self.raw_client,
                 model=self.model_id,
-                instructions="You are a helpful assistant that helps users find and delete PNG images from their desktop. When asked to find images, identify the relevant criteria (date, content, etc.) and search for matching images. When asked to delete images, always confirm before deletion.",
+                instructions=INSTRUCTIONS,
             )
-            self.session_id = self.agent.create_session("png_cleanup_session")
+            self.agent = GuardedClient(agent, self.breaker)
+            self.new_session()
         except Exception as e:
             print(f"Error initializing Llama agent: {str(e)}")
             self.model_id = None
             self.agent = None
             self.session_id = None
+            # Server unreachable: start probing so it gets picked up when it comes back
+            if not isinstance(e, StopIteration) and is_retryable(e):
+                self.breaker.trip()
+    
+    def _on_recover(self):
+        if not self.session_id:
+            self.connect()
+        for listener in self.recover_listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"Error after Llama Stack recovered: {str(e)}")
+    
+    def new_session(self):
+        """Start a fresh agent session, dropping the old context."""
+        if self.session_id:
+            self.session_rotations += 1
+            metrics.incr("agent_session_rotations")
+        self.session_id = self.agent.create_session(f"png_cleanup_session-{self.session_rotations}")
+        self.session_tokens = estimate_tokens(INSTRUCTIONS)
+        self.session_turns = 0
+    
+    def _record_prompt(self, prompt_tokens: int, response) -> int:
+        """Track prompt size, preferring the server's count when it reports one."""
+        for metric in getattr(response, "metrics", None) or []:
+            if getattr(metric, "metric", None) == "prompt_tokens":
+                prompt_tokens = int(metric.value)
+        self.last_prompt_tokens = prompt_tokens
+        metrics.incr("llm_prompt_tokens", prompt_tokens)
+        metrics.incr("llm_calls")
+        return prompt_tokens
+    
+    def complete(self, messages: List[Dict]) -> str:
+        """Stateless completion for one-shot tasks; nothing accumulates server-side."""
+        response = self.client.inference.chat_completion(model=self.model_id, messages=messages, stream=False)
+        self._record_prompt(sum(estimate_tokens(m["content"]) for m in messages), response)
+        return message_text(response.completion_message)
     
-    def rewrite_query(self, prompt: str) -> str:
-        """Rewrite user query to be more effective for image caption search."""
-        if not self.client or not self.model_id:
+    def _session_turn(self, content: str) -> str:
+        """One agent turn, rotating the session first if it would exceed the token budget."""
+        message_tokens = estimate_tokens(content)
+        if self.session_turns and self.session_tokens + message_tokens > self.session_budget:
+            self.new_session()
+        turn = self.agent.create_turn(
+            messages=[{"role": "user", "content": content}],
+            session_id=self.session_id,
+            stream=False,
+        )
+        text = message_text(turn.output_message)
+        prompt_tokens = self._record_prompt(self.session_tokens + message_tokens, turn)
+        self.session_tokens = prompt_tokens + estimate_tokens(text)
+        self.session_turns += 1
+        return text
+    
+    def session_status(self) -> str:
+        """One-line summary of the agent session's context size."""
+        return (f"LLM session: {self.session_turns} turns, ~{self.session_tokens}/{self.session_budget} tokens, "
+                f"last prompt ~{self.last_prompt_tokens} tokens, {self.session_rotations} rotations")
+    
+    @metrics.timed("query_rewrite")
+    def rewrite_query(self, prompt: str, strict: bool = False) -> str:
+        """Rewrite user query to be more effective for image caption search.
+        
+        Falls back to the original prompt, or with strict=True raises instead.
+        """
+        if not self.model_id or self.circuit_open:
+            if strict:
+                raise CircuitOpenError("No LLM available to rewrite the query")
             return prompt
             
         try:
-            response = self.client.inference.chat_completion(
-                model=self.model_id,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that rewrites queries to be more effective for image caption search."},
-                    {"role": "user", "content": f"Rephrase this as a search query for image captions: {prompt}"}
-                ],
-                stream=False
-            )
-            return response.text
+            return self.complete([
+                {"role": "system", "content": "You are a helpful assistant that rewrites queries to be more effective for image caption search."},
+                {"role": "user", "content": f"Rephrase this as a search query for image captions: {prompt}"}
+            ])
         except Exception as e:
             print(f"Error rewriting query: {str(e)}")
+            if strict:
+                raise
             return prompt
     
+    @metrics.timed("understand_query")
     def understand_query(self, query: str) -> Dict:
-        """Parse user query to understand intent (find or delete) and criteria."""
-        if not self.agent or not self.session_id:
+        """Parse user query to understand intent (find or delete) and criteria.
+        
+        A one-shot task, so it uses stateless inference rather than the agent session.
+        """
+        if not self.model_id or self.circuit_open:
             # Fallback simple parsing
             intent = "delete" if "delete" in query.lower() else "find"
             return {"intent": intent, "query": query}
             
         try:
-            response = self.agent.create_turn(
-                messages=[{"role": "user", "content": f"Parse this query and extract the intent (find or delete) and criteria (date, content description, etc.): '{query}'"}],
-                session_id=self.session_id,
-            )
-            
-            # Try to extract structured information
-            import json
-            import re
+            text = self.complete([
+                {"role": "system", "content": INSTRUCTIONS},
+                {"role": "user", "content": f"Parse this query and extract the intent (find or delete) and criteria (date, content description, etc.): '{query}'"}
+            ])
             
             # Look for JSON in the response
-            json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
+            json_match = re.search(r'\{.*\}', text, re.DOTALL)
             if json_match:
                 try:
                     parsed = json.loads(json_match.group(0))
@@ -71,8 +180,8 @@ class LlamaAgent:
                     pass
             
             # Fallback to simple text analysis
-            intent = "delete" if "delete" in query.lower() or "delete" in response.text.lower() else "find"
-            return {"intent": intent, "query": query, "analysis": response.text}
+            intent = "delete" if "delete" in query.lower() or "delete" in text.lower() else "find"
+            return {"intent": intent, "query": query, "analysis": text}
             
         except Exception as e:
             print(f"Error understanding query: {str(e)}")
@@ -80,19 +189,16 @@ class LlamaAgent:
             intent = "delete" if "delete" in query.lower() else "find"
             return {"intent": intent, "query": query}
     
+    @metrics.timed("agent_confirmation")
     def confirm_deletion(self, images: List[Dict], query: str) -> str:
         """Ask user to confirm deletion of specific images."""
-        if not self.agent or not self.session_id:
+        if not self.agent or not self.session_id or self.circuit_open:
             # Fallback confirmation message
             return f"Are you sure you want to delete these {len(images)} images matching '{query}'?"
             
         try:
-            image_list = "\n".join([f"- {img['path']} (Caption: {img['caption']})" for img in images])
-            response = self.agent.create_turn(
-                messages=[{"role": "user", "content": f"Based on the query '{query}', I found these images:\n{image_list}\nShould I delete them? Generate a confirmation message for the user."}],
-                session_id=self.session_id,
-            )
-            return response.text
+            image_list = summarize_images(images)
+            return self._session_turn(f"Based on the query '{query}', I found these images:\n{image_list}\nShould I delete them? Generate a confirmation message for the user.")
         except Exception as e:
             print(f"Error generating confirmation: {str(e)}")
             # Fallback confirmation message
@@ -0,0 +1,222 @@
+"""Shared Llama Stack client with timeouts, bounded retries and a circuit breaker.
+
+Every call made through a GuardedClient is retried at most max_retries
+times within a per-call deadline. Calls that still fail count against a
+CircuitBreaker. Once the breaker opens, calls fail immediately with
+CircuitOpenError, and a background thread probes the server until it
+answers again. Callers check breaker.is_open to skip Llama Stack entirely
+and use local search instead.
+"""
+import os
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+import metrics
+
+DEFAULT_BASE_URL = os.getenv("LLAMA_STACK_URL", "http://localhost:8321")
+DEFAULT_TIMEOUT = float(os.getenv("LLAMA_STACK_TIMEOUT", "10"))
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv("LLAMA_STACK_CONNECT_TIMEOUT", "2"))
+DEFAULT_MAX_RETRIES = int(os.getenv("LLAMA_STACK_MAX_RETRIES", "1"))
+DEFAULT_MAX_CONNECTIONS = int(os.getenv("LLAMA_STACK_MAX_CONNECTIONS", "16"))
+
+_shared_clients: Dict[Tuple[str, str], object] = {}
+_shared_lock = threading.Lock()
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Llama Stack while the breaker is open."""
+
+
+def create_client(base_url: str = DEFAULT_BASE_URL, api_key: Optional[str] = None,
+                  timeout: float = DEFAULT_TIMEOUT, max_connections: int = DEFAULT_MAX_CONNECTIONS):
+    """LlamaStackClient over a keep-alive connection pool.
+
+    The client's own retries are turned off; GuardedClient does the retrying.
+    """
+    import httpx
+    from llama_stack_client import LlamaStackClient
+
+    http_client = httpx.Client(
+        timeout=httpx.Timeout(timeout, connect=min(DEFAULT_CONNECT_TIMEOUT, timeout)),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections,
+                            keepalive_expiry=60),
+    )
+    return LlamaStackClient(
+        base_url=base_url,
+        api_key=api_key if api_key is not None else os.getenv("LLAMA_STACK_API_KEY", ""),
+        timeout=timeout,
+        max_retries=0,
+        http_client=http_client,
+    )
+
+
+def get_shared_client(base_url: str = DEFAULT_BASE_URL, api_key: Optional[str] = None):
+    """One pooled client per (base_url, api_key), shared by everything in the process."""
+    api_key = api_key if api_key is not None else os.getenv("LLAMA_STACK_API_KEY", "")
+    with _shared_lock:
+        client = _shared_clients.get((base_url, api_key))
+        if client is None:
+            client = _shared_clients[(base_url, api_key)] = create_client(base_url, api_key)
+        return client
+
+
+def _transport_errors() -> Tuple[type, ...]:
+    """Exception types meaning the server couldn't be reached or didn't answer in time."""
+    errors = [ConnectionError, TimeoutError]
+    try:
+        import httpx
+        errors.append(httpx.TransportError)
+    except ImportError:
+        pass
+    try:
+        from llama_stack_client import APIConnectionError
+        errors.append(APIConnectionError)  # includes APITimeoutError
+    except ImportError:
+        pass
+    return tuple(errors)
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Connection problems, timeouts, 429s and 5xx responses are worth retrying.
+    
+    Anything else, other 4xx responses and bugs such as a TypeError or a
+    response that fails to parse, would fail the same way again and says
+    nothing about the server's health.
+    """
+    if isinstance(exc, CircuitOpenError):
+        return False
+    status = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    return isinstance(exc, _transport_errors())
+
+
+class CircuitBreaker:
+    def __init__(self, name: str = "llama_stack", failure_threshold: int = 3, reset_timeout: float = 15.0,
+                 probe: Optional[Callable[[], object]] = None, on_recover: Optional[Callable[[], None]] = None):
+        """Open after failure_threshold consecutive failures; probe every reset_timeout until healthy.
+
+        Without a probe the breaker simply closes again after reset_timeout.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.on_recover = on_recover
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def record_success(self):
+        with self._lock:
+            self.consecutive_failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            should_trip = self.consecutive_failures >= self.failure_threshold
+        if should_trip:
+            self.trip()
+
+    def trip(self):
+        """Open the breaker now and start probing for recovery."""
+        with self._lock:
+            if self.opened_at is not None:
+                return
+            self.opened_at = time.time()
+            self._probe_thread = threading.Thread(target=self._probe_until_healthy, daemon=True)
+            self._probe_thread.start()
+        metrics.incr(f"{self.name}_circuit_opened")
+        print(f"{self.name} is unavailable; using local search until it recovers.")
+
+    def reset(self):
+        with self._lock:
+            was_open = self.opened_at is not None
+            self.opened_at = None
+            self.consecutive_failures = 0
+        if was_open:
+            print(f"{self.name} is reachable again.")
+            if self.on_recover:
+                try:
+                    self.on_recover()
+                except Exception as e:
+                    print(f"Error after {self.name} recovered: {str(e)}")
+
+    def _probe_until_healthy(self):
+        while self.is_open:
+            time.sleep(self.reset_timeout)
+            try:
+                if self.probe:
+                    self.probe()
+            except Exception:
+                metrics.incr(f"{self.name}_probe_failures")
+                continue
+            self.reset()
+
+    def stats(self) -> Dict:
+        return {
+            "open": self.is_open,
+            "consecutive_failures": self.consecutive_failures,
+            "open_seconds": round(time.time() - self.opened_at, 1) if self.opened_at else 0.0,
+        }
+
+
+class GuardedClient:
+    def __init__(self, target, breaker: CircuitBreaker, max_retries: int = DEFAULT_MAX_RETRIES,
+                 deadline: float = 2 * DEFAULT_TIMEOUT, backoff: float = 0.25, _path: str = ""):
+        """Proxy for a client (or Agent) whose method calls go through the breaker.
+
+        Attribute access mirrors target, so client.inference.chat_completion(...)
+        works unchanged. Each call gets at most max_retries retries, and none
+        are started once deadline seconds have passed since the first attempt.
+        """
+        self._target = target
+        self._breaker = breaker
+        self._max_retries = max_retries
+        self._deadline = deadline
+        self._backoff = backoff
+        self._path = _path
+
+    @property
+    def raw(self):
+        return self._target
+
+    def __getattr__(self, name):
+        attr = getattr(self._target, name)
+        path = f"{self._path}.{name}" if self._path else name
+        if callable(attr):
+            return lambda *args, **kwargs: self._call(path, attr, args, kwargs)
+        if hasattr(attr, "__dict__"):
+            return GuardedClient(attr, self._breaker, self._max_retries, self._deadline, self._backoff, path)
+        return attr
+
+    def _call(self, path: str, fn: Callable, args, kwargs):
+        if self._breaker.is_open:
+            metrics.incr("llama_stack_calls_rejected")
+            raise CircuitOpenError(f"Llama Stack circuit is open; skipped {path}")
+
+        deadline = time.monotonic() + self._deadline
+        attempt = 0
+        while True:
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                if (not is_retryable(e) or attempt >= self._max_retries
+                        or time.monotonic() + delay >= deadline):
+                    if is_retryable(e):
+                        self._breaker.record_failure()
+                    raise
+                attempt += 1
+                metrics.incr("llama_stack_retries")
+                time.sleep(delay)
+                continue
+            self._breaker.record_success()
+            return result
@@ -2,17 +2,31 @@ import os
 from dotenv import load_dotenv
 from image_processor import ImageProcessor
 from vector_store import VectorStore
+from sharded_store import ShardedVectorStore
 from llama_agent import LlamaAgent
+from deletion_executor import DeletionExecutor
+from formatting import format_bytes
+from caption_scheduler import CaptionScheduler
+from image_hashing import same_file_contents
+import metrics
+import profiling
 import time
+import threading
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from pathlib import Path
 from datetime import datetime
 
+# Seconds between checks for screenshots still waiting for a BLIP caption
+RECAPTION_INTERVAL = float(os.getenv("RECAPTION_INTERVAL", "300"))
+# Recaptioned screenshots are added to the index this many at a time
+RECAPTION_BATCH_SIZE = 32
+
 class DesktopEventHandler(FileSystemEventHandler):
-    def __init__(self, image_processor, vector_store):
+    def __init__(self, image_processor, vector_store, backfill=None):
         self.image_processor = image_processor
         self.vector_store = vector_store
+        self.backfill = backfill
         self.last_processed = {}
 
     def on_created(self, event):
@@ -31,6 +45,10 @@ class DesktopEventHandler(FileSystemEventHandler):
                 return
         self.last_processed[image_path] = current_time
 
+        # While backfill runs, jump its queue instead of competing with it for the model
+        if self.backfill and self.backfill.submit(image_path):
+            return
+
         try:
             # Process single image
             image_data = self.image_processor.process_single_image(image_path)
@@ -41,6 +59,192 @@ class DesktopEventHandler(FileSystemEventHandler):
         except Exception as e:
             print(f"Error processing new image {image_path}: {str(e)}")
 
+class BackfillWorker(threading.Thread):
+    def __init__(self, image_processor, vector_store, num_workers=1):
+        """Caption and index existing images in the background."""
+        super().__init__(daemon=True)
+        self.image_processor = image_processor
+        self.vector_store = vector_store
+        self.num_workers = num_workers
+        self.scheduler = CaptionScheduler()
+        self.total = None
+        self.done = 0
+        self.finished = False
+        self._resume_event = threading.Event()
+        self._resume_event.set()
+        self._stop_event = threading.Event()
+        self._started_at = None
+        self._paused_at = None
+        self._paused_seconds = 0.0
+
+    def run(self):
+        self._started_at = time.time()
+        try:
+            self.scheduler.push_many(self.image_processor.scan_desktop())
+            # Includes any live events submitted during the scan
+            self.total = len(self.scheduler)
+            # The scheduler stays open: live events keep arriving while deferred captions run
+            records = self.image_processor.iter_processed_images(self._gated(self.scheduler.drain(close=False)),
+                                                                 num_workers=self.num_workers)
+            self.vector_store.add_images(self._counted(records))
+            
+            # Screenshots were indexed from metadata alone; caption them now that everything is searchable
+            self._caption_deferred()
+        except Exception as e:
+            print(f"\nError during backfill: {str(e)}")
+        finally:
+            self.finished = True
+        if not self._stop_event.is_set():
+            print(f"\nBackfill complete: indexed {self.done} images.")
+        
+        # Screenshots indexed later by the watcher are deferred too; caption
+        # them whenever the queue goes idle, and at least every interval
+        while not self._stop_event.is_set():
+            self.scheduler.wait_for_work(RECAPTION_INTERVAL)
+            try:
+                self._caption_deferred()
+            except Exception as e:
+                print(f"\nError captioning deferred screenshots: {str(e)}")
+        self.scheduler.close()
+
+    def _caption_deferred(self):
+        """Run deferred BLIP captions through the scheduler, so live events and query boosts still go first."""
+        queued = self.scheduler.push_many(self.vector_store.paths_needing_captions(), deferred=True)
+        if queued:
+            print(f"\nCaptioning {queued} screenshots in the background...")
+        batch = []
+        try:
+            while not self._stop_event.is_set():
+                if batch and not self._resume_event.is_set():
+                    self.vector_store.add_images(batch)
+                    batch = []
+                self._resume_event.wait()
+                entry = self.scheduler.pop_entry()
+                if entry is None:
+                    return
+                path, deferred = entry
+                if not deferred:
+                    self.done += 1  # a live event, already counted in total
+                record = self.image_processor.process_single_image(path, force_caption=deferred)
+                if record:
+                    batch.append(record)
+                # Live events are searchable right away; recaptions are added in batches
+                if batch and (not deferred or len(batch) >= RECAPTION_BATCH_SIZE):
+                    self.vector_store.add_images(batch)
+                    batch = []
+        finally:
+            if batch:
+                self.vector_store.add_images(batch)
+
+    def submit(self, path) -> bool:
+        """Queue a live event ahead of the backlog; False if the caller should process it itself."""
+        if self._paused_at or not self.scheduler.push(path, live=True):
+            return False
+        if self.total is not None:
+            self.total += 1
+        return True
+    
+    def boost_date_range(self, date_range):
+        """Caption queued images from a date range a query just asked about first."""
+        boosted = self.scheduler.boost_date_range(date_range.get("start_date"), date_range.get("end_date"))
+        if boosted:
+            print(f"(Prioritizing {boosted} not-yet-indexed images from that date range.)")
+    
+    def _gated(self, paths):
+        """Hand out paths only while not paused or stopped."""
+        for path in paths:
+            self._resume_event.wait()
+            if self._stop_event.is_set():
+                return
+            yield path
+
+    def _counted(self, records):
+        for record in records:
+            self.done += 1
+            yield record
+
+    def pause(self):
+        if self._resume_event.is_set():
+            self._paused_at = time.time()
+            self._resume_event.clear()
+
+    def resume(self):
+        if not self._resume_event.is_set():
+            self._paused_seconds += time.time() - self._paused_at
+            self._paused_at = None
+            self._resume_event.set()
+
+    def stop(self):
+        self._stop_event.set()
+        self._resume_event.set()
+        self.scheduler.close()
+
+    def status(self) -> str:
+        """One-line progress summary with throughput and ETA."""
+        if self.finished:
+            return f"Backfill complete: {self.done} images indexed."
+        if self.total is None:
+            return "Backfill: scanning desktop..."
+
+        now = self._paused_at or time.time()
+        active = max(now - self._started_at - self._paused_seconds, 1e-6)
+        rate = self.done / active
+        percent = 100 * self.done / self.total if self.total else 100
+        line = f"Backfill: {self.done}/{self.total} images ({percent:.0f}%), {rate:.1f} images/s"
+        if rate > 0:
+            remaining = (self.total - self.done) / rate
+            line += f", ETA {int(remaining // 60)}m {int(remaining % 60)}s"
+        if self._paused_at:
+            line += " [paused]"
+        return line
+
+def find_matches(query, llama_agent, vector_store, backfill):
+    """Work out the intent and print matching images; returns (intent_analysis, results)."""
+    # Parse user intent
+    intent_analysis = llama_agent.understand_query(query)
+    print(f"Understanding query: {intent_analysis}")
+    
+    if "duplicate" in query.lower():
+        # Keep the oldest image in each group; only byte-identical copies of it
+        # are deletion candidates, since a matching dHash alone can be a false positive
+        groups = vector_store.find_duplicates()
+        if not groups:
+            print("No duplicate images found.")
+            return intent_analysis, []
+        
+        duplicates = []
+        print(f"\nFound {len(groups)} groups of duplicate images:")
+        for i, group in enumerate(groups, 1):
+            print(f"\n{i}. Keeping: {group[0]['path']}")
+            for candidate in group[1:]:
+                if same_file_contents(group[0]['path'], candidate['path']):
+                    print(f"   Duplicate: {candidate['path']}")
+                    duplicates.append(candidate)
+                else:
+                    print(f"   Similar, not deleted ({candidate['distance']} bits apart): {candidate['path']}")
+        if not duplicates:
+            print("\nNone of these are exact copies, so nothing will be deleted.")
+        return intent_analysis, duplicates
+    
+    # Search for images
+    results = vector_store.search_images(query)
+    
+    if not results:
+        print("No matching images found.")
+        if not backfill.finished:
+            print(backfill.status())
+        return intent_analysis, []
+    
+    # Display results
+    print("\nFound matching images:")
+    for i, result in enumerate(results, 1):
+        print(f"\n{i}. Path: {result['path']}")
+        print(f"   Caption: {result['caption']}")
+        print(f"   Date: {result['creation_date']} {result['creation_time']}")
+        if 'relevance_score' in result:
+            print(f"   Relevance: {result['relevance_score']:.2f}")
+    return intent_analysis, results
+
 def main():
     # Load environment variables
     load_dotenv()
@@ -49,23 +253,38 @@ def main():
     
     # Initialize Llama Stack client and agent
     print("Connecting to Llama Stack...")
-    llama_agent = LlamaAgent(api_key="9b6c7caa-68ac-4f87-93e9-eed31b9a95d1")
+    llama_agent = LlamaAgent()
     
     # Initialize components
     image_processor = ImageProcessor()
-    vector_store = VectorStore(llama_agent=llama_agent)
+    desktop_path = str(Path.home() / "Desktop")
+    if os.getenv("PNG_CLEANUP_SHARDED", "0").lower() in ("1", "true", "yes"):
+        # Snapshots the index per watched root, so it survives restarts
+        vector_store = ShardedVectorStore(llama_agent=llama_agent)
+        vector_store.register_root(desktop_path)
+    else:
+        # Snapshots aren't kept here, so persist deletions to keep them masked in Llama Stack results
+        vector_store = VectorStore(llama_agent=llama_agent,
+                                   tombstone_path=str(Path.home() / ".png_cleanup" / "deleted_paths.json"))
     
-    # Process existing images
-    print("Processing existing images...")
-    processed_images = image_processor.process_images()
+    # Finish any deletions interrupted by a previous crash
+    deletion_executor = DeletionExecutor(vector_store)
+    recovered = deletion_executor.recover()
+    if recovered:
+        print(f"Recovered interrupted deletion: removed {len(recovered['deleted'])} images, freed {format_bytes(recovered['bytes_freed'])}")
     
-    if processed_images:
-        print(f"Found {len(processed_images)} existing PNG images")
-        vector_store.add_images(processed_images)
+    # Process existing images in the background so queries work right away
+    print("Processing existing images in the background...")
+    backfill = BackfillWorker(
+        image_processor,
+        vector_store,
+        num_workers=int(os.getenv("CAPTION_WORKERS", "1")),
+    )
+    vector_store.date_query_listeners.append(backfill.boost_date_range)
+    backfill.start()
     
     # Set up file system observer
-    desktop_path = str(Path.home() / "Desktop")
-    event_handler = DesktopEventHandler(image_processor, vector_store)
+    event_handler = DesktopEventHandler(image_processor, vector_store, backfill)
     observer = Observer()
     observer.schedule(event_handler, desktop_path, recursive=False)
     observer.start()
@@ -76,34 +295,59 @@ def main():
     print("- Find images from January 2021")
     print("- Delete all screenshots from last week")
     print("- Find images containing cats")
-    print("\nType 'exit' to quit.")
+    print("- Find duplicate screenshots")
+    print("\nType 'status' for backfill progress, 'pause'/'resume' to control it, or 'exit' to quit.")
+    if metrics.is_enabled():
+        print("Metrics are enabled; type 'metrics' to print them.")
+    if profiling.PROFILE_ENABLED:
+        print(f"Profiling every query; profiles are saved to {profiling.PROFILE_DIR}")
+    else:
+        print("End a query with --profile to profile it.")
     
     try:
         while True:
             query = input("\nEnter your query: ").strip()
             if query.lower() == 'exit':
                 break
+            if query.lower() == 'status':
+                print(backfill.status())
+                if llama_agent.session_id:
+                    print(llama_agent.session_status())
+                if llama_agent.circuit_open:
+                    print("Llama Stack is unreachable; searching locally.")
+                pending = vector_store.pending_upload_count()
+                if pending:
+                    print(f"{pending} images are waiting to be uploaded to Llama Stack.")
+                print(image_processor.blip.status())
+                continue
+            if query.lower() == 'pause':
+                backfill.pause()
+                print(backfill.status())
+                continue
+            if query.lower() == 'resume':
+                backfill.resume()
+                print(backfill.status())
+                continue
+            if query.lower() == 'metrics':
+                print(metrics.export_prometheus())
+                continue
+            if not query:
+                continue
             
-            # Parse user intent
-            intent_analysis = llama_agent.understand_query(query)
-            print(f"Understanding query: {intent_analysis}")
+            metrics.incr("repl_queries")
             
-            # Search for images
-            results = vector_store.search_images(query)
+            # "--profile" at the end of a query profiles just that query
+            profile = query.endswith("--profile")
+            if profile:
+                query = query[:-len("--profile")].strip()
+                if not query:
+                    continue
             
+            with profiling.profile_request("query", force=profile):
+                intent_analysis, results = find_matches(query, llama_agent, vector_store, backfill)
             if not results:
-                print("No matching images found.")
                 continue
             
-            # Display results
-            print("\nFound matching images:")
-            for i, result in enumerate(results, 1):
-                print(f"\n{i}. Path: {result['path']}")
-                print(f"   Caption: {result['caption']}")
-                print(f"   Date: {result['creation_date']} {result['creation_time']}")
-                if 'relevance_score' in result:
-                    print(f"   Relevance: {result['relevance_score']:.2f}")
-            
             # If intent is to delete, confirm with user
             if "delete" in query.lower() or intent_analysis.get("intent") == "delete":
                 confirmation_msg = vector_store.confirm_deletion(results, query)
@@ -111,21 +355,23 @@ def main():
                 
                 user_confirm = input("Type 'yes' to confirm deletion: ").strip().lower()
                 if user_confirm == 'yes':
-                    # Delete files
-                    for result in results:
-                        try:
-                            os.remove(result['path'])
-                            print(f"Deleted: {result['path']}")
-                        except Exception as e:
-                            print(f"Error deleting {result['path']}: {str(e)}")
+                    # Delete files and drop them from the index
+                    outcome = deletion_executor.delete([result['path'] for result in results])
+                    for path in outcome['deleted']:
+                        print(f"Deleted: {path}")
+                    for path, error in outcome['failed'].items():
+                        print(f"Error deleting {path}: {error}")
+                    print(f"Freed {format_bytes(outcome['bytes_freed'])}")
                 else:
                     print("Deletion cancelled.")
     
     except KeyboardInterrupt:
         print("\nShutting down...")
     finally:
+        backfill.stop()
         observer.stop()
         observer.join()
+        vector_store.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,243 @@
+"""Read capture time and screenshot hints from PNG files without decoding pixels.
+
+Only the chunks before the first IDAT are read: IHDR for dimensions,
+tEXt/zTXt/iTXt (including the XMP packet macOS writes), tIME and eXIf.
+Screenshot filename patterns from macOS, Windows, GNOME, KDE and Android
+supply a capture time even when the file carries no metadata.
+"""
+import os
+import re
+import struct
+import zlib
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional, Tuple
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# Stop reading text chunks past this size; they are not worth the I/O
+MAX_TEXT_CHUNK = 1024 * 1024
+# Longest description used in a stand-in caption, so it stays within one RAG chunk
+CAPTION_DESCRIPTION_MAX_CHARS = 200
+
+_DATE = r"(?P<year>\d{4})-?(?P<month>\d{2})-?(?P<day>\d{2})"
+SCREENSHOT_PATTERNS = [
+    # macOS: "Screen Shot 2025-04-16 at 2.08.36 PM", "Screenshot 2025-04-16 at 14.08.36"
+    re.compile(r"^screen ?shot " + _DATE + r" at (?P<hour>\d{1,2})\.(?P<minute>\d{2})\.(?P<second>\d{2})(?:\s?(?P<ampm>[AP]M))?", re.I),
+    # GNOME: "Screenshot from 2025-04-16 14-08-36"
+    re.compile(r"^screenshot from " + _DATE + r"[ _](?P<hour>\d{2})-(?P<minute>\d{2})-(?P<second>\d{2})", re.I),
+    # Windows Snipping Tool, KDE Spectacle, Android:
+    # "Screenshot 2025-04-16 140836", "Screenshot_20250416_140836", "Screenshot_20250416-140836"
+    re.compile(r"^screenshot[ _-]" + _DATE + r"[ _-](?P<hour>\d{2})-?(?P<minute>\d{2})-?(?P<second>\d{2})", re.I),
+    # Date-less variants still mark a screenshot: "Screenshot (12)", "Screen Shot.png"
+    re.compile(r"^screen ?shot\b", re.I),
+]
+
+# Software tags written by screenshot tools
+SCREENSHOT_SOFTWARE = ("screenshot", "greenshot", "sharex", "spectacle", "flameshot", "snipping", "lightshot", "shutter")
+
+# Common display resolutions, including HiDPI multiples
+SCREEN_SIZES = {
+    (1280, 720), (1280, 800), (1366, 768), (1440, 900), (1536, 864), (1600, 900), (1680, 1050),
+    (1920, 1080), (1920, 1200), (2048, 1152), (2560, 1080), (2560, 1440), (2560, 1600), (2880, 1800),
+    (3024, 1964), (3440, 1440), (3456, 2234), (3840, 2160), (5120, 2880),
+}
+
+
+def parse_screenshot_filename(path: str) -> Tuple[bool, Optional[datetime]]:
+    """Return (looks like a screenshot, capture time parsed from the name)."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    for pattern in SCREENSHOT_PATTERNS:
+        match = pattern.match(name)
+        if not match:
+            continue
+        fields = match.groupdict()
+        if not fields.get("year"):
+            return True, None
+        hour = int(fields["hour"])
+        ampm = (fields.get("ampm") or "").upper()
+        if ampm == "PM" and hour < 12:
+            hour += 12
+        elif ampm == "AM" and hour == 12:
+            hour = 0
+        try:
+            return True, datetime(int(fields["year"]), int(fields["month"]), int(fields["day"]),
+                                  hour, int(fields["minute"]), int(fields["second"]))
+        except ValueError:
+            return True, None
+    return False, None
+
+
+def parse_datetime(value: str) -> Optional[datetime]:
+    """Parse Exif, ISO 8601 (XMP) or RFC 1123 (PNG "Creation Time") timestamps."""
+    value = value.strip().strip("\x00")
+    for fmt, length in (("%Y:%m:%d %H:%M:%S", 19), ("%Y-%m-%dT%H:%M:%S", 19), ("%Y-%m-%d %H:%M:%S", 19), ("%Y-%m-%d", 10)):
+        try:
+            return datetime.strptime(value[:length], fmt)
+        except ValueError:
+            continue
+    try:
+        return parsedate_to_datetime(value).replace(tzinfo=None)
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def parse_exif(data: bytes) -> Dict[str, str]:
+    """Pull DateTimeOriginal, DateTime, Make and Software out of a raw TIFF/Exif block."""
+    tags = {0x0132: "DateTime", 0x010F: "Make", 0x0131: "Software", 0x9003: "DateTimeOriginal"}
+    found = {}
+    if data.startswith(b"Exif\x00\x00"):
+        data = data[6:]
+    if len(data) < 8 or data[:2] not in (b"II", b"MM"):
+        return found
+    endian = "<" if data[:2] == b"II" else ">"
+
+    def read_ifd(offset: int, depth: int = 0):
+        if depth > 2 or offset + 2 > len(data):
+            return
+        (count,) = struct.unpack_from(endian + "H", data, offset)
+        for i in range(min(count, 256)):
+            entry = offset + 2 + 12 * i
+            if entry + 12 > len(data):
+                return
+            tag, kind, length = struct.unpack_from(endian + "HHI", data, entry)
+            if tag == 0x8769:  # Exif sub-IFD
+                read_ifd(struct.unpack_from(endian + "I", data, entry + 8)[0], depth + 1)
+            elif tag in tags and kind == 2:  # ASCII
+                start = entry + 8 if length <= 4 else struct.unpack_from(endian + "I", data, entry + 8)[0]
+                found[tags[tag]] = data[start:start + length].split(b"\x00")[0].decode("latin-1", "replace")
+
+    try:
+        read_ifd(struct.unpack_from(endian + "I", data, 4)[0])
+    except struct.error:
+        pass
+    return found
+
+
+def read_png_chunks(path: str) -> Dict:
+    """Read IHDR and the metadata chunks that precede the image data."""
+    info = {"width": None, "height": None, "text": {}, "time": None, "exif": {}}
+    with open(path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            raise ValueError(f"{path} is not a PNG file")
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, kind = struct.unpack(">I4s", header)
+            if kind in (b"IDAT", b"IEND"):
+                break
+            if kind in (b"IHDR", b"tIME", b"tEXt", b"zTXt", b"iTXt", b"eXIf") and length <= MAX_TEXT_CHUNK:
+                data = f.read(length)
+                f.seek(4, os.SEEK_CUR)  # CRC
+            else:
+                f.seek(length + 4, os.SEEK_CUR)
+                continue
+
+            if kind == b"IHDR":
+                info["width"], info["height"] = struct.unpack(">II", data[:8])
+            elif kind == b"tIME":
+                try:
+                    info["time"] = datetime(*struct.unpack(">HBBBBB", data[:7]))
+                except (ValueError, struct.error):
+                    pass
+            elif kind == b"eXIf":
+                info["exif"] = parse_exif(data)
+            else:
+                key, _, value = data.partition(b"\x00")
+                try:
+                    if kind == b"zTXt":
+                        value = zlib.decompress(value[1:])
+                    elif kind == b"iTXt":
+                        # compression flag, method, language tag, translated keyword, text
+                        flag = value[:1]
+                        value = value[2:].split(b"\x00", 2)[-1]
+                        if flag == b"\x01":
+                            value = zlib.decompress(value)
+                except zlib.error:
+                    continue
+                encoding = "utf-8" if kind == b"iTXt" else "latin-1"
+                info["text"][key.decode("latin-1")] = value.decode(encoding, "replace")
+    return info
+
+
+def _xmp_value(xmp: str, name: str) -> Optional[str]:
+    match = re.search(rf"{name}>([^<]+)<", xmp) or re.search(rf'{name}="([^"]+)"', xmp)
+    return match.group(1) if match else None
+
+
+def extract_metadata(path: str) -> Dict:
+    """Capture time, dimensions and a screenshot verdict for a PNG.
+
+    The capture time comes from the first source that has one: Exif,
+    XMP, a tEXt "Creation Time", the filename, tIME (last modification)
+    and finally the file's mtime. time_source names the one used.
+    """
+    metadata = {"capture_time": None, "time_source": None, "width": None, "height": None,
+                "is_screenshot": False, "screenshot_reason": None, "description": None}
+    try:
+        chunks = read_png_chunks(path)
+    except (OSError, ValueError, struct.error) as e:
+        print(f"Error reading PNG metadata for {path}: {str(e)}")
+        chunks = {"width": None, "height": None, "text": {}, "time": None, "exif": {}}
+    metadata["width"], metadata["height"] = chunks["width"], chunks["height"]
+
+    text = chunks["text"]
+    exif = chunks["exif"]
+    xmp = text.get("XML:com.adobe.xmp", "")
+    named_screenshot, filename_time = parse_screenshot_filename(path)
+
+    candidates = [
+        ("exif", exif.get("DateTimeOriginal") or exif.get("DateTime")),
+        ("xmp", _xmp_value(xmp, "photoshop:DateCreated") or _xmp_value(xmp, "xmp:CreateDate")),
+        ("text", text.get("Creation Time")),
+    ]
+    for source, value in candidates:
+        parsed = parse_datetime(value) if value else None
+        if parsed:
+            metadata["capture_time"], metadata["time_source"] = parsed, source
+            break
+    else:
+        if filename_time:
+            metadata["capture_time"], metadata["time_source"] = filename_time, "filename"
+        elif chunks["time"]:
+            metadata["capture_time"], metadata["time_source"] = chunks["time"], "tIME"
+        else:
+            metadata["capture_time"] = datetime.fromtimestamp(os.path.getmtime(path))
+            metadata["time_source"] = "mtime"
+
+    metadata["description"] = text.get("Description") or text.get("Title") or _xmp_value(xmp, "dc:description")
+
+    software = " ".join([text.get("Software", ""), exif.get("Software", "")]).lower()
+    if named_screenshot:
+        metadata["is_screenshot"], metadata["screenshot_reason"] = True, "filename"
+    elif "screenshot" in xmp.lower() or "screenshot" in text.get("Comment", "").lower():
+        metadata["is_screenshot"], metadata["screenshot_reason"] = True, "xmp"
+    elif any(tool in software for tool in SCREENSHOT_SOFTWARE):
+        metadata["is_screenshot"], metadata["screenshot_reason"] = True, "software"
+    elif not exif.get("Make") and (metadata["width"], metadata["height"]) in SCREEN_SIZES:
+        # Full-screen dimensions with no camera make
+        metadata["is_screenshot"], metadata["screenshot_reason"] = True, "dimensions"
+    return metadata
+
+
+def _short_description(text: str, max_chars: int = CAPTION_DESCRIPTION_MAX_CHARS) -> str:
+    """First sentence of text, cut at a word boundary if still over max_chars."""
+    text = " ".join(text.split())
+    match = re.match(r"(.+?[.!?])(?:\s|$)", text)
+    if match:
+        text = match.group(1)
+    if len(text) <= max_chars:
+        return text
+    cut = text[:max_chars].rsplit(" ", 1)[0] or text[:max_chars]
+    return cut.rstrip(" ,;:") + "..."
+
+
+def metadata_caption(metadata: Dict) -> str:
+    """Stand-in caption for a screenshot that hasn't been through BLIP."""
+    caption = "a screenshot"
+    description = _short_description(metadata.get("description") or "")
+    if description:
+        caption += f" of {description}"
+    if metadata.get("width") and metadata.get("height"):
+        caption += f" ({metadata['width']}x{metadata['height']})"
+    return caption
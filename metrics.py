@@ -0,0 +1,211 @@
+"""Lightweight timers and counters for the captioning and search pipeline.
+
+Disabled by default; set PNG_CLEANUP_METRICS=1 (or call enable()) to
+record. While disabled, timer() hands back a shared no-op context manager
+and incr() returns immediately, so instrumented hot paths pay only a
+flag check.
+
+    with metrics.timer("blip_generate"):
+        out = model.generate(...)
+    metrics.incr("caption_cache_hits")
+
+export_prometheus() renders everything in the Prometheus text format,
+plus gauges from any callback added with register_gauges().
+Set PNG_CLEANUP_METRICS_LOG=1 to also log one JSON line per timed stage
+to the "png_cleanup.metrics" logger.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Callable, Dict, List
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+logger = logging.getLogger("png_cleanup.metrics")
+
+_enabled = os.getenv("PNG_CLEANUP_METRICS", "0").lower() in ("1", "true", "yes")
+_log_enabled = os.getenv("PNG_CLEANUP_METRICS_LOG", "0").lower() in ("1", "true", "yes")
+_lock = threading.Lock()
+# stage -> [count, total_seconds, max_seconds, per-bucket counts]
+_timers: Dict[str, list] = {}
+_counters: Dict[str, float] = {}
+# name -> callback returning current values, read on each export
+_gauges: Dict[str, Callable[[], Dict]] = {}
+
+
+def _ensure_log_handler():
+    """Log JSON lines to stderr unless the application configured its own handler."""
+    if _log_enabled and not logger.handlers and not logging.getLogger().handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+
+
+_ensure_log_handler()
+
+
+def enable(flag: bool = True, log: bool = None):
+    """Turn recording (and optionally structured logging) on or off."""
+    global _enabled, _log_enabled
+    _enabled = flag
+    if log is not None:
+        _log_enabled = log
+        _ensure_log_handler()
+
+
+def is_enabled() -> bool:
+    return _enabled
+
+
+def reset():
+    with _lock:
+        _timers.clear()
+        _counters.clear()
+
+
+def register_gauges(name: str, callback: Callable[[], Dict]):
+    """Export callback()'s numeric values as {prefix}_{name}_{key} gauges.
+
+    Gauges describe current state (cache sizes, loaded models), so they are
+    exported whether or not recording is enabled. Registering a name again
+    replaces its callback.
+    """
+    with _lock:
+        _gauges[name] = callback
+
+
+def observe(stage: str, seconds: float):
+    """Record one duration for stage."""
+    if not _enabled:
+        return
+    with _lock:
+        entry = _timers.get(stage)
+        if entry is None:
+            entry = _timers[stage] = [0, 0.0, 0.0, [0] * (len(BUCKETS) + 1)]
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3][bisect_left(BUCKETS, seconds)] += 1
+    if _log_enabled:
+        logger.info(json.dumps({"event": "stage", "stage": stage, "seconds": round(seconds, 6)}))
+
+
+def incr(name: str, value: float = 1):
+    """Add value to a counter."""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+class _Timer:
+    __slots__ = ("stage", "start")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(self.stage, time.perf_counter() - self.start)
+        if exc_type is not None:
+            incr(f"{self.stage}_errors")
+        return False
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+def timer(stage: str):
+    """Context manager timing the enclosed block as stage."""
+    if not _enabled:
+        return _NOOP_TIMER
+    return _Timer(stage)
+
+
+def timed(stage: str):
+    """Decorator timing every call of the wrapped function as stage."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            with _Timer(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def snapshot() -> Dict[str, Dict]:
+    """Current timers and counters as plain dicts."""
+    with _lock:
+        timers = {
+            stage: {
+                "count": count,
+                "total_seconds": round(total, 6),
+                "mean_ms": round(1000 * total / count, 3) if count else 0.0,
+                "max_ms": round(1000 * maximum, 3),
+            }
+            for stage, (count, total, maximum, _) in _timers.items()
+        }
+        counters = dict(_counters)
+    return {"timers": timers, "counters": counters}
+
+
+def export_prometheus(prefix: str = "png_cleanup") -> str:
+    """Render all metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    with _lock:
+        if _timers:
+            lines.append(f"# HELP {prefix}_stage_seconds Time spent per pipeline stage.")
+            lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for stage in sorted(_timers):
+                count, total, _, buckets = _timers[stage]
+                cumulative = 0
+                for bound, bucket_count in zip(BUCKETS, buckets):
+                    cumulative += bucket_count
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {count}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {count}')
+        if _counters:
+            lines.append(f"# HELP {prefix}_events_total Pipeline event counters.")
+            lines.append(f"# TYPE {prefix}_events_total counter")
+            for name in sorted(_counters):
+                lines.append(f'{prefix}_events_total{{event="{name}"}} {_counters[name]:g}')
+        gauges = dict(_gauges)
+    # Callbacks may take their own locks, so they run outside ours
+    for name in sorted(gauges):
+        try:
+            values = gauges[name]()
+        except Exception as e:
+            logger.warning("Gauge callback %s failed: %s", name, e)
+            continue
+        for key in sorted(values):
+            value = values[key]
+            # Strings and unset values (e.g. no reload yet) have no numeric sample
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# TYPE {prefix}_{name}_{key} gauge")
+            lines.append(f"{prefix}_{name}_{key} {value:g}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,216 @@
+"""Load models on demand and drop them again after a period of disuse.
+
+A long-running daemon may go hours without a new PNG, so keeping BLIP and
+the embedding model resident costs memory for nothing. An IdleModel loads
+on first use and, when idle_timeout is set, unloads once nothing has used
+it for that long. The next use reloads it.
+
+When idle unloading is on, hub models are re-saved once as safetensors
+under MODEL_CACHE_DIR. Safetensors files are memory-mapped on load, which
+makes the reload after an idle unload cheaper than the first load from the
+hub. With models kept loaded there is no reload to speed up, so nothing is
+written.
+"""
+import gc
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional
+
+import metrics
+
+# Seconds without use before a model is unloaded; 0 keeps models loaded
+MODEL_IDLE_TIMEOUT = float(os.getenv("PNG_CLEANUP_MODEL_IDLE_TIMEOUT", "0"))
+MODEL_CACHE_DIR = os.getenv("PNG_CLEANUP_MODEL_CACHE", str(Path.home() / ".png_cleanup" / "models"))
+# A save lock older than this is assumed to belong to a crashed process
+SAVE_LOCK_STALE_SECONDS = 600
+
+
+def resident_memory_bytes() -> int:
+    """Current resident set size of this process, or 0 if it can't be read."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+        # Peak rather than current RSS, but the best available off Linux;
+        # ru_maxrss is in bytes on macOS and kilobytes elsewhere
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if os.uname().sysname == "Darwin" else peak * 1024
+    except (ImportError, OSError):
+        return 0
+
+
+def format_mb(num_bytes: int) -> str:
+    return f"{num_bytes / (1024 * 1024):.1f} MB"
+
+
+def _claim_save_lock(lock_path: str) -> bool:
+    """Create lock_path exclusively; False if another process is already saving."""
+    try:
+        if time.time() - os.path.getmtime(lock_path) > SAVE_LOCK_STALE_SECONDS:
+            os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        return True
+    except OSError:
+        return False
+
+
+def load_cached_pretrained(cls, model_id: str, cache_dir: str = MODEL_CACHE_DIR, save: bool = True, **kwargs):
+    """cls.from_pretrained(model_id), served from a local safetensors copy once one exists.
+    
+    With save=False an existing copy is still used but none is written.
+    """
+    # One directory per class, so a model and its processor don't share files
+    local_dir = os.path.join(cache_dir, model_id.replace("/", "--"), cls.__name__)
+    if os.path.isdir(local_dir) and os.listdir(local_dir):
+        try:
+            return cls.from_pretrained(local_dir, **kwargs)
+        except Exception as e:
+            print(f"Error loading cached {model_id}, reloading from the hub: {str(e)}")
+
+    model = cls.from_pretrained(model_id, **kwargs)
+    if not save:
+        return model
+    # Caption worker processes load at the same time; only one of them writes the copy
+    os.makedirs(os.path.dirname(local_dir), exist_ok=True)
+    lock_path = f"{local_dir}.lock"
+    if not _claim_save_lock(lock_path):
+        return model
+    tmp_dir = f"{local_dir}.tmp-{os.getpid()}"
+    try:
+        # save_pretrained on processors has no safe_serialization argument
+        if hasattr(model, "state_dict"):
+            model.save_pretrained(tmp_dir, safe_serialization=True)
+        else:
+            model.save_pretrained(tmp_dir)
+        os.makedirs(local_dir, exist_ok=True)
+        for name in os.listdir(tmp_dir):
+            os.replace(os.path.join(tmp_dir, name), os.path.join(local_dir, name))
+    except Exception as e:
+        print(f"Error caching {model_id} to {local_dir}: {str(e)}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            os.remove(lock_path)
+        except OSError:
+            pass
+    return model
+
+
+class IdleModel:
+    def __init__(self, name: str, loader: Callable[[], Any], idle_timeout: float = MODEL_IDLE_TIMEOUT,
+                 on_unload: Optional[Callable[[], None]] = None):
+        """Hold whatever loader() returns, unloading it after idle_timeout seconds unused."""
+        self.name = name
+        self.loader = loader
+        self.idle_timeout = idle_timeout
+        self.on_unload = on_unload
+        self._value = None
+        self._last_used = 0.0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._reaper = None
+        self.loads = 0
+        self.unloads = 0
+        self.first_load_seconds = 0.0
+        self.last_load_seconds = 0.0
+        self.reload_seconds = 0.0
+        self.last_freed_bytes = 0
+
+    @property
+    def loaded(self) -> bool:
+        return self._value is not None
+
+    def get(self):
+        """The loaded model, loading it first if it was never loaded or was unloaded."""
+        with self._lock:
+            self._last_used = time.monotonic()
+            if self._value is None:
+                self._load_locked()
+            return self._value
+
+    def _load_locked(self):
+        start = time.perf_counter()
+        with metrics.timer(f"{self.name}_model_load"):
+            self._value = self.loader()
+        self.last_load_seconds = time.perf_counter() - start
+        if self.loads:
+            self.reload_seconds += self.last_load_seconds
+            metrics.incr(f"{self.name}_model_reloads")
+        else:
+            self.first_load_seconds = self.last_load_seconds
+        self.loads += 1
+        self._last_used = time.monotonic()
+        if self.idle_timeout and self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap, name=f"{self.name}-idle-unload", daemon=True)
+            self._reaper.start()
+
+    def unload(self) -> bool:
+        """Drop the model now; returns False if it wasn't loaded."""
+        with self._lock:
+            return self._unload_locked()
+
+    def _unload_locked(self) -> bool:
+        if self._value is None:
+            return False
+        before = resident_memory_bytes()
+        # Callers still holding the model keep it alive until they finish
+        self._value = None
+        gc.collect()
+        if self.on_unload:
+            try:
+                self.on_unload()
+            except Exception as e:
+                print(f"Error releasing {self.name} model memory: {str(e)}")
+        self.last_freed_bytes = max(0, before - resident_memory_bytes())
+        self.unloads += 1
+        metrics.incr(f"{self.name}_model_unloads")
+        print(f"Unloaded {self.name} model, freed {format_mb(self.last_freed_bytes)}")
+        return True
+
+    def _reap(self):
+        interval = max(1.0, min(self.idle_timeout / 4, 30.0))
+        while not self._stopped.wait(interval):
+            with self._lock:
+                if self._value is not None and time.monotonic() - self._last_used >= self.idle_timeout:
+                    self._unload_locked()
+
+    def close(self):
+        """Stop the idle reaper and drop the model."""
+        self._stopped.set()
+        self.unload()
+
+    def status(self) -> str:
+        """One line for the REPL's status command."""
+        stats = self.stats()
+        if stats["loaded"]:
+            state = f"loaded, idle {stats['idle_seconds']}s"
+        else:
+            state = "unloaded" if self.loads else "not loaded yet"
+        line = f"{self.name} model: {state}; loaded {self.loads}x (first {stats['first_load_seconds']}s"
+        if stats["avg_reload_seconds"] is not None:
+            line += f", reload avg {stats['avg_reload_seconds']}s"
+        return line + f"); process RSS {stats['rss_mb']} MB"
+
+    def stats(self) -> Dict:
+        idle = time.monotonic() - self._last_used if self._value is not None else None
+        return {
+            "model": self.name,
+            "loaded": self.loaded,
+            "idle_timeout": self.idle_timeout,
+            "idle_seconds": round(idle, 1) if idle is not None else None,
+            "loads": self.loads,
+            "unloads": self.unloads,
+            "first_load_seconds": round(self.first_load_seconds, 3),
+            "avg_reload_seconds": round(self.reload_seconds / (self.loads - 1), 3) if self.loads > 1 else None,
+            "last_freed_mb": round(self.last_freed_bytes / (1024 * 1024), 1),
+            "rss_mb": round(resident_memory_bytes() / (1024 * 1024), 1),
+        }
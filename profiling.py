@@ -0,0 +1,170 @@
+"""Opt-in per-request profiling for the query path.
+
+Profile every REPL query and Flask request with PNG_CLEANUP_PROFILE=1, or
+just one: end a REPL query with --profile, or add ?profile=1 to a request.
+Each profile writes two files to PNG_CLEANUP_PROFILE_DIR (default
+~/.png_cleanup/profiles):
+
+- <id>.prof: cProfile stats, for pstats or snakeviz
+- <id>.collapsed: sampled stacks in the collapsed format read by
+  flamegraph.pl and speedscope
+
+Only the newest PNG_CLEANUP_PROFILE_KEEP profiles (default 20) are kept,
+and each sampler stops recording after MAX_SAMPLES samples.
+
+Only one cProfile profiler can be active per process (Python 3.12+ raises
+otherwise), so sessions are serialized: a request that starts while
+another is being profiled simply runs unprofiled.
+"""
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+PROFILE_ENABLED = os.getenv("PNG_CLEANUP_PROFILE", "0").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.getenv("PNG_CLEANUP_PROFILE_DIR", str(Path.home() / ".png_cleanup" / "profiles"))
+PROFILE_KEEP = int(os.getenv("PNG_CLEANUP_PROFILE_KEEP", "20"))
+SAMPLE_INTERVAL = 0.005
+MAX_SAMPLES = 20000
+
+# Held by the one active ProfileSession
+_profile_lock = threading.Lock()
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id: int, interval: float = SAMPLE_INTERVAL, max_samples: int = MAX_SAMPLES):
+        """Periodically record the stack of one thread as collapsed frames."""
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_samples = max_samples
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval) and self.samples < self.max_samples:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[";".join(reversed(names))] += 1
+            self.samples += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class ProfileSession:
+    def __init__(self, label: str):
+        """cProfile plus a stack sampler around the current thread."""
+        safe_label = "".join(c if c.isalnum() or c in "-_" else "_" for c in label)[:40]
+        self.profile_id = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{safe_label}"
+        self._profiler = cProfile.Profile()
+        self._sampler = StackSampler(threading.get_ident())
+        self.elapsed = 0.0
+
+    def start(self) -> Optional["ProfileSession"]:
+        """Start profiling; None if another session (or profiling tool) is already active."""
+        if not _profile_lock.acquire(blocking=False):
+            return None
+        self._started = time.perf_counter()
+        self._sampler.start()
+        try:
+            self._profiler.enable()
+        except ValueError:
+            # Another profiling tool is active
+            self._sampler.stop()
+            _profile_lock.release()
+            return None
+        return self
+
+    def stop(self) -> str:
+        """Stop profiling, write the dumps and return the .prof path."""
+        try:
+            self._profiler.disable()
+        finally:
+            _profile_lock.release()
+        self._sampler.stop()
+        self.elapsed = time.perf_counter() - self._started
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.profile_id)
+        self._profiler.dump_stats(base + ".prof")
+        with open(base + ".collapsed", "w", encoding="utf-8") as f:
+            f.write(self._sampler.collapsed())
+        prune_profiles()
+        return base + ".prof"
+
+    def summary(self, limit: int = 10) -> str:
+        """Top functions by cumulative time."""
+        stream = io.StringIO()
+        pstats.Stats(self._profiler, stream=stream).sort_stats("cumulative").print_stats(limit)
+        return stream.getvalue()
+
+
+def prune_profiles(keep: int = PROFILE_KEEP):
+    """Delete all but the newest keep profiles."""
+    try:
+        names = os.listdir(PROFILE_DIR)
+    except FileNotFoundError:
+        return
+    profile_ids = sorted({os.path.splitext(name)[0] for name in names if name.endswith((".prof", ".collapsed"))})
+    for profile_id in profile_ids[:-keep] if keep else profile_ids:
+        for extension in (".prof", ".collapsed"):
+            try:
+                os.remove(os.path.join(PROFILE_DIR, profile_id + extension))
+            except FileNotFoundError:
+                pass
+
+
+def should_profile(force: bool = False) -> bool:
+    return force or PROFILE_ENABLED
+
+
+@contextmanager
+def profile_request(label: str, force: bool = False, verbose: bool = True):
+    """Profile the enclosed block when profiling is enabled or forced.
+
+    Yields the ProfileSession, or None when not profiling.
+    """
+    if not should_profile(force):
+        yield None
+        return
+
+    session = ProfileSession(label).start()
+    if session is None:
+        if verbose:
+            print(f"\nNot profiling '{label}': another profile is in progress.")
+        yield None
+        return
+    try:
+        yield session
+    finally:
+        path = session.stop()
+        if verbose:
+            print(f"\nProfiled '{label}' in {session.elapsed * 1000:.1f} ms, saved to {path}")
+            print(session.summary())
+
+
+def start_profile(label: str, force: bool = False) -> Optional[ProfileSession]:
+    """Start a session for callers that can't wrap a block, e.g. Flask hooks."""
+    if not should_profile(force):
+        return None
+    return ProfileSession(label).start()
@@ -0,0 +1,119 @@
+"""Build LLM prompts that stay within a token budget.
+
+Large result sets are summarized instead of listed: counts by month and
+folder, the most common captions and a few sample paths come first, and
+individual items are listed only while budget remains.
+"""
+import os
+from collections import Counter
+from typing import Dict, Iterable, List, Optional
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token) for budgeting prompts."""
+    return len(text) // 4 + 1
+
+
+class PromptBuilder:
+    def __init__(self, budget_tokens: int = DEFAULT_TOKEN_BUDGET):
+        """Accumulate prompt lines until the token budget is spent."""
+        self.budget_tokens = budget_tokens
+        self.used_tokens = 0
+        self.lines: List[str] = []
+
+    @property
+    def remaining(self) -> int:
+        return self.budget_tokens - self.used_tokens
+
+    def add(self, line: str, force: bool = False) -> bool:
+        """Append line if it fits (or force is set); returns whether it was added."""
+        tokens = estimate_tokens(line)
+        if not force and tokens > self.remaining:
+            return False
+        self.lines.append(line)
+        self.used_tokens += tokens
+        return True
+
+    def add_section(self, header: str, items: Iterable[str], total: Optional[int] = None,
+                    max_tokens: Optional[int] = None) -> int:
+        """Add a header and as many items as fit in max_tokens (default: all remaining).
+
+        Items that don't fit are reported as "... and N more". Returns the
+        number of items listed.
+        """
+        items = list(items)
+        total = len(items) if total is None else total
+        available = self.remaining if max_tokens is None else min(max_tokens, self.remaining)
+        # Keep room for the "... and N more" line
+        more_tokens = estimate_tokens(f"- ... and {total} more")
+        available -= estimate_tokens(header)
+        if not items or estimate_tokens(items[0]) + (more_tokens if total > 1 else 0) > available:
+            return 0
+
+        self.add(header, force=True)
+        listed = 0
+        for item in items:
+            tokens = estimate_tokens(item)
+            if tokens + (0 if listed == total - 1 else more_tokens) > available:
+                break
+            self.add(item, force=True)
+            available -= tokens
+            listed += 1
+        if listed < total:
+            self.add(f"- ... and {total - listed} more", force=True)
+        return listed
+
+    def build(self) -> str:
+        return "\n".join(self.lines)
+
+
+def _month_counts(images: List[Dict]) -> List[str]:
+    months = Counter(img.get('creation_date', '')[:7] or 'unknown' for img in images)
+    return [f"- {month}: {count} images" for month, count in sorted(months.items())]
+
+
+def _sample(items: List, count: int) -> List:
+    """Up to count items spread evenly across the list."""
+    if len(items) <= count:
+        return items
+    step = len(items) / count
+    return [items[int(i * step)] for i in range(count)]
+
+
+def summarize_images(images: List[Dict], budget_tokens: int = DEFAULT_TOKEN_BUDGET) -> str:
+    """Describe matched images within budget_tokens.
+
+    Small sets are listed in full. Larger ones get aggregate counts, the
+    most common captions and sample paths, then as many items as still fit.
+    """
+    item_lines = [
+        f"- {img['path']} (Caption: {img['caption']}, Date: {img.get('creation_date', 'unknown')})"
+        for img in images
+    ]
+    builder = PromptBuilder(budget_tokens)
+    full_listing = f"{len(images)} images:\n" + "\n".join(item_lines)
+    if estimate_tokens(full_listing) <= budget_tokens:
+        builder.add(full_listing)
+        return builder.build()
+
+    dates = sorted(img['creation_date'] for img in images if img.get('creation_date'))
+    builder.add(f"{len(images)} images in total" + (f", dated {dates[0]} to {dates[-1]}." if dates else "."))
+
+    # Aggregates share the budget so a long tail in one can't crowd out the others
+    share = budget_tokens // 5
+    builder.add_section("By month:", _month_counts(images), max_tokens=share)
+
+    folders = Counter(os.path.dirname(img['path']) for img in images)
+    builder.add_section("By folder:", [f"- {folder}: {count} images" for folder, count in folders.most_common()],
+                        max_tokens=share)
+
+    captions = Counter(img['caption'] for img in images)
+    builder.add_section("Most common captions:", [f"- {caption} ({count})" for caption, count in captions.most_common()],
+                        max_tokens=share)
+
+    builder.add_section("Sample paths:", [f"- {img['path']}" for img in _sample(images, 5)], max_tokens=share)
+
+    builder.add_section("Items:", item_lines)
+    return builder.build()
@@ -0,0 +1,80 @@
+"""Production server for the file viewer app.
+
+Uses gunicorn with threaded workers where available, and waitress on
+Windows or when gunicorn isn't installed:
+
+    python serve.py --threads 16 --port 5000
+
+The disk usage indexer and the LLM concurrency limiter live in the app
+process, so each extra worker crawls the home directory again and lets
+through its own share of LLM calls. The default is therefore one worker
+with many threads; the routes mostly wait on disk and the LLM, not the CPU.
+"""
+import argparse
+import os
+
+from app import app, llm_limiter
+
+
+def run_gunicorn(host: str, port: int, workers: int, threads: int, timeout: int):
+    from gunicorn.app.base import BaseApplication
+
+    class FlaskApplication(BaseApplication):
+        def load_config(self):
+            self.cfg.set('bind', f"{host}:{port}")
+            self.cfg.set('workers', workers)
+            self.cfg.set('worker_class', 'gthread')
+            self.cfg.set('threads', threads)
+            # Must outlive the slowest LLM call, which is capped at 120s
+            self.cfg.set('timeout', timeout)
+            self.cfg.set('keepalive', 5)
+
+        def load(self):
+            return app
+
+    FlaskApplication().run()
+
+
+def run_waitress(host: str, port: int, workers: int, threads: int):
+    from waitress import serve
+
+    # waitress is single-process, so give it the threads all workers would have had
+    serve(app, host=host, port=port, threads=workers * threads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the file viewer with a production WSGI server.")
+    parser.add_argument('--host', default=os.getenv('HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5000')))
+    parser.add_argument('--workers', type=int, default=int(os.getenv('WEB_WORKERS', '1')))
+    parser.add_argument('--threads', type=int, default=int(os.getenv('WEB_THREADS', '16')))
+    parser.add_argument('--timeout', type=int, default=180)
+    parser.add_argument('--server', choices=['auto', 'gunicorn', 'waitress'], default='auto')
+    args = parser.parse_args()
+
+    llm_threads = llm_limiter.max_concurrent + llm_limiter.max_queue
+    if llm_threads >= args.threads:
+        print(f"Warning: LLM routes may hold {llm_threads} of {args.threads} threads per worker; "
+              f"raise --threads or lower LLM_MAX_CONCURRENCY/LLM_MAX_QUEUE so listings stay responsive.")
+    if args.workers > 1:
+        print(f"Warning: each of the {args.workers} workers runs its own disk usage crawl and admits up to "
+              f"{llm_limiter.max_concurrent} concurrent LLM calls; prefer one worker with more --threads.")
+
+    server = args.server
+    if server == 'auto':
+        try:
+            import gunicorn  # noqa: F401
+            server = 'gunicorn' if os.name != 'nt' else 'waitress'
+        except ImportError:
+            server = 'waitress'
+
+    print(f"Serving on http://{args.host}:{args.port} with {server} "
+          f"({args.workers} workers x {args.threads} threads)")
+    if server == 'gunicorn':
+        run_gunicorn(args.host, args.port, args.workers, args.threads, args.timeout)
+    else:
+        run_waitress(args.host, args.port, args.workers, args.threads)
+
+
+if __name__ == "__main__":
+    main()
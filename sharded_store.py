@@ -0,0 +1,370 @@
+"""Image index partitioned into per-user, per-root VectorStore shards.
+
+Each shard keeps its own records, embeddings and hash index, snapshots to
+its own directory and uses its own Llama Stack vector DB. Shards load the
+first time they are needed. Only max_loaded stay in memory: the least
+recently used shard that nobody is using is saved and dropped, so memory
+follows active users, not total users. Searches fan out over the relevant
+shards in parallel and merge the per-shard top-k with a heap.
+
+Shards are pinned while in use, so eviction never drops a shard another
+thread is adding to or searching. Loading and saving happen outside the
+registry lock; a slow shard only holds up callers that need that shard.
+Evicted shards are saved on a background thread, and only if they changed
+since they were loaded or last saved, so a read-only search over many
+shards doesn't rewrite their snapshots.
+
+Merged results are cached against every searched shard's generation. A
+change to one shard only misses the merged cache; the other shards still
+answer from their own caches, and the date range and rewritten query are
+reused so no LLM call is repeated.
+"""
+import hashlib
+import heapq
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from image_hashing import group_near_duplicates, DEFAULT_MAX_DISTANCE
+from vector_store import VectorStore, normalize_query
+import metrics
+
+DEFAULT_USER = "default"
+
+
+class ShardedVectorStore:
+    def __init__(self, llama_agent=None, snapshot_dir: Optional[str] = None, max_loaded: int = 8,
+                 max_workers: int = 8, embedding_service=None, cache_size: int = 256):
+        self.llama_agent = llama_agent
+        self.snapshot_dir = snapshot_dir or str(Path.home() / ".png_cleanup" / "shards")
+        self.max_loaded = max_loaded
+        self.embedding_service = embedding_service
+        # shard_id -> (user, root) for every known shard, loaded or not
+        self.roots: Dict[str, Tuple[str, str]] = {}
+        # shard_id -> VectorStore, least recently used first
+        self._loaded: "OrderedDict[str, VectorStore]" = OrderedDict()
+        # shard_id -> number of callers currently using it; pinned shards are never evicted
+        self._pins: Dict[str, int] = {}
+        # shard_id -> event set once its in-progress load or save finishes
+        self._busy: Dict[str, threading.Event] = {}
+        # shard_id -> shard generation its snapshot matches; a newer generation is unsaved
+        self._saved_generation: Dict[str, int] = {}
+        self._lock = threading.RLock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="shard-search")
+        # Saves of evicted shards, off the request threads that evict them
+        self._save_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shard-save")
+        self.cache_size = cache_size
+        # (query, day) -> (date_range, rewritten_query); depends only on the query
+        self._plan_cache: "OrderedDict[Tuple, Tuple]" = OrderedDict()
+        # (query, top_k, day, shard generations) -> merged results
+        self._result_cache: "OrderedDict[Tuple, List[Dict]]" = OrderedDict()
+        # Shared with every shard, so date boosts work as with a single VectorStore
+        self.date_query_listeners = []
+
+    @staticmethod
+    def shard_id(user: str, root: str) -> str:
+        digest = hashlib.sha1(os.path.abspath(root).encode("utf-8")).hexdigest()[:12]
+        safe_user = "".join(c if c.isalnum() or c in "-_" else "_" for c in user)
+        return f"{safe_user}-{digest}"
+
+    def register_root(self, root: str, user: str = DEFAULT_USER) -> str:
+        """Make root a shard for user; returns the shard id."""
+        shard_id = self.shard_id(user, root)
+        with self._lock:
+            self.roots[shard_id] = (user, os.path.abspath(root))
+        return shard_id
+
+    def shard_ids(self, user: Optional[str] = None, roots: Optional[Iterable[str]] = None) -> List[str]:
+        """Shards for user (all users when None), optionally limited to roots."""
+        wanted = {os.path.abspath(root) for root in roots} if roots else None
+        with self._lock:
+            return [
+                shard_id for shard_id, (owner, root) in self.roots.items()
+                if (user is None or owner == user) and (wanted is None or root in wanted)
+            ]
+
+    def shard_for_path(self, path: str, user: str = DEFAULT_USER) -> Optional[str]:
+        """The user's shard whose root most specifically contains path."""
+        path = os.path.abspath(path)
+        best, best_len = None, -1
+        with self._lock:
+            for shard_id, (owner, root) in self.roots.items():
+                if owner == user and (path == root or path.startswith(root + os.sep)) and len(root) > best_len:
+                    best, best_len = shard_id, len(root)
+        return best
+
+    def _snapshot_path(self, shard_id: str) -> str:
+        return os.path.join(self.snapshot_dir, shard_id)
+
+    def _acquire(self, shard_id: str) -> VectorStore:
+        """Pin a shard, loading it from its snapshot (or creating it) if needed."""
+        while True:
+            with self._lock:
+                shard = self._loaded.get(shard_id)
+                if shard is not None:
+                    self._loaded.move_to_end(shard_id)
+                    self._pins[shard_id] = self._pins.get(shard_id, 0) + 1
+                    return shard
+                if shard_id not in self.roots:
+                    raise KeyError(f"Unknown shard: {shard_id}")
+                busy = self._busy.get(shard_id)
+                if busy is None:
+                    busy = self._busy[shard_id] = threading.Event()
+                    break
+            # Another thread is loading or saving this shard; use its result
+            busy.wait()
+
+        try:
+            with metrics.timer("shard_load"):
+                shard = VectorStore(
+                    llama_agent=self.llama_agent,
+                    vector_db_id=f"png_image_vector_db_{shard_id}",
+                    embedding_service=self.embedding_service,
+                )
+                shard.date_query_listeners = self.date_query_listeners
+                shard.load(self._snapshot_path(shard_id))
+            metrics.incr("shard_loads")
+            with self._lock:
+                self._saved_generation[shard_id] = shard.generation
+                self._loaded[shard_id] = shard
+                self._pins[shard_id] = self._pins.get(shard_id, 0) + 1
+            return shard
+        finally:
+            with self._lock:
+                self._busy.pop(shard_id).set()
+
+    def _release(self, shard_id: str):
+        with self._lock:
+            self._pins[shard_id] -= 1
+            if not self._pins[shard_id]:
+                del self._pins[shard_id]
+        self._evict()
+
+    @contextmanager
+    def pinned(self, shard_id: str) -> Iterator[VectorStore]:
+        """Use a shard without it being evicted meanwhile."""
+        shard = self._acquire(shard_id)
+        try:
+            yield shard
+        finally:
+            self._release(shard_id)
+
+    def get_shard(self, shard_id: str) -> VectorStore:
+        """Load a shard and return it unpinned; it may be evicted once more than max_loaded are in use."""
+        with self.pinned(shard_id) as shard:
+            return shard
+
+    def _evict(self):
+        """Save and drop least recently used unpinned shards beyond max_loaded."""
+        evicted = []
+        with self._lock:
+            for shard_id in list(self._loaded):
+                if len(self._loaded) <= self.max_loaded:
+                    break
+                if self._pins.get(shard_id) or shard_id in self._busy:
+                    continue
+                evicted.append((shard_id, self._loaded.pop(shard_id)))
+                self._busy[shard_id] = threading.Event()
+        for shard_id, shard in evicted:
+            if self._is_dirty(shard_id, shard):
+                self._save_pool.submit(self._save_and_close, shard_id, shard)
+            else:
+                self._save_and_close(shard_id, shard)
+
+    def _is_dirty(self, shard_id: str, shard: VectorStore) -> bool:
+        with self._lock:
+            return shard.generation != self._saved_generation.get(shard_id)
+
+    def _save(self, shard_id: str, shard: VectorStore):
+        """Snapshot a shard if it changed since its last load or save."""
+        if not self._is_dirty(shard_id, shard):
+            metrics.incr("shard_saves_skipped")
+            return
+        # Read first: a change made during the save leaves the shard dirty
+        generation = shard.generation
+        shard.save(self._snapshot_path(shard_id))
+        with self._lock:
+            self._saved_generation[shard_id] = generation
+
+    def _save_and_close(self, shard_id: str, shard: VectorStore):
+        try:
+            self._save(shard_id, shard)
+            shard.close()
+            metrics.incr("shard_unloads")
+        except Exception as e:
+            print(f"Error saving shard {shard_id}: {str(e)}")
+        finally:
+            with self._lock:
+                self._busy.pop(shard_id).set()
+
+    def unload(self, shard_id: str) -> bool:
+        """Snapshot a shard and drop it from memory; False if it is in use or not loaded."""
+        with self._lock:
+            if self._pins.get(shard_id) or shard_id in self._busy or shard_id not in self._loaded:
+                return False
+            shard = self._loaded.pop(shard_id)
+            self._busy[shard_id] = threading.Event()
+        self._save_and_close(shard_id, shard)
+        return True
+
+    def save_all(self):
+        """Snapshot every loaded shard that changed."""
+        with self._lock:
+            shards = list(self._loaded.items())
+        for shard_id, shard in shards:
+            self._save(shard_id, shard)
+
+    def loaded_shards(self) -> List[str]:
+        with self._lock:
+            return list(self._loaded)
+
+    def _route(self, items: Iterable, user: str, key, batch_size: int) -> Iterator[Tuple[str, list]]:
+        """Stream (shard_id, batch) pairs, buffering at most batch_size items per shard."""
+        buffers: Dict[str, list] = {}
+        for item in items:
+            shard_id = self.shard_for_path(key(item), user)
+            if shard_id is None:
+                print(f"No registered root for {key(item)}; skipping.")
+                continue
+            buffer = buffers.setdefault(shard_id, [])
+            buffer.append(item)
+            if len(buffer) >= batch_size:
+                yield shard_id, buffers.pop(shard_id)
+        yield from buffers.items()
+
+    def add_images(self, processed_images: Iterable[Dict[str, str]], user: str = DEFAULT_USER,
+                   batch_size: int = 32) -> int:
+        """Route records to the shards whose roots contain them."""
+        added = 0
+        for shard_id, records in self._route(processed_images, user, lambda img: img['path'], batch_size):
+            with self.pinned(shard_id) as shard:
+                added += shard.add_images(records, batch_size)
+        return added
+
+    def remove_images(self, paths: Iterable[str], user: str = DEFAULT_USER, batch_size: int = 256) -> int:
+        removed = 0
+        for shard_id, shard_paths in self._route(paths, user, lambda path: path, batch_size):
+            with self.pinned(shard_id) as shard:
+                removed += shard.remove_images(shard_paths)
+        return removed
+
+    @metrics.timed("sharded_search")
+    def search_images(self, query: str, top_k: int = 5, user: Optional[str] = DEFAULT_USER,
+                      roots: Optional[Iterable[str]] = None) -> List[Dict]:
+        """Search the relevant shards in parallel and merge their top_k results."""
+        shard_ids = self.shard_ids(user, roots)
+        if not shard_ids:
+            return []
+        shards = []
+        try:
+            for shard_id in shard_ids:
+                shards.append(self._acquire(shard_id))
+            return self._search_pinned(query, top_k, shard_ids, shards)
+        finally:
+            for shard_id in shard_ids[:len(shards)]:
+                self._release(shard_id)
+
+    def _search_pinned(self, query: str, top_k: int, shard_ids: List[str], shards: List[VectorStore]) -> List[Dict]:
+        day = datetime.now().date().isoformat()
+        generations = tuple((shard_id, shard.generation) for shard_id, shard in zip(shard_ids, shards))
+        key = (normalize_query(query), top_k, day, generations)
+        cached = self._cache_get(self._result_cache, key)
+        if cached is not None:
+            metrics.incr("sharded_cache_hits")
+            return [dict(result) for result in cached]
+
+        # Derive the date range and RAG query once instead of once per shard
+        plan_key = (normalize_query(query), day)
+        plan = self._cache_get(self._plan_cache, plan_key)
+        degraded = False
+        if plan is None:
+            date_range, date_ok = shards[0]._parse_date_query(query)
+            rewritten_query = None
+            llm_up = self.llama_agent and not self.llama_agent.circuit_open
+            if llm_up:
+                try:
+                    rewritten_query = self.llama_agent.rewrite_query(query, strict=True)
+                except Exception:
+                    rewritten_query = query
+                    degraded = True
+                # Only a failure while the LLM is reachable degrades results; local mode is expected
+                degraded = degraded or not date_ok
+            plan = (date_range, rewritten_query)
+            # A plan made without the LLM would outlive the outage that caused it
+            if llm_up and not degraded:
+                self._cache_put(self._plan_cache, plan_key, plan)
+        date_range, rewritten_query = plan
+
+        futures = [
+            self._pool.submit(shard._search, query, top_k, date_range, rewritten_query)
+            for shard in shards
+        ]
+        per_shard = []
+        for future in futures:
+            try:
+                results, shard_degraded = future.result()
+                per_shard.append(results)
+                degraded = degraded or shard_degraded
+            except Exception as e:
+                print(f"Error searching shard: {str(e)}")
+        results = heapq.nlargest(top_k, (result for results in per_shard for result in results),
+                                 key=lambda result: result.get('relevance_score', 0))
+        if len(per_shard) == len(shards) and not degraded:
+            self._cache_put(self._result_cache, key, [dict(result) for result in results])
+        return results
+
+    def _cache_get(self, cache: OrderedDict, key):
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+            return value
+
+    def _cache_put(self, cache: OrderedDict, key, value):
+        with self._lock:
+            cache[key] = value
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+
+    def _collect(self, user: Optional[str], roots: Optional[Iterable[str]], method: str) -> list:
+        collected = []
+        for shard_id in self.shard_ids(user, roots):
+            with self.pinned(shard_id) as shard:
+                collected.extend(getattr(shard, method)())
+        return collected
+
+    def find_duplicates(self, user: Optional[str] = DEFAULT_USER, roots: Optional[Iterable[str]] = None,
+                        max_distance: int = DEFAULT_MAX_DISTANCE) -> List[List[Dict]]:
+        """Near-duplicate groups across the relevant shards."""
+        return group_near_duplicates(self._collect(user, roots, 'records'), max_distance)
+
+    def paths_needing_captions(self, user: Optional[str] = DEFAULT_USER) -> List[str]:
+        return self._collect(user, None, 'paths_needing_captions')
+
+    def pending_upload_count(self) -> int:
+        with self._lock:
+            shards = list(self._loaded.values())
+        return sum(shard.pending_upload_count() for shard in shards)
+
+    def confirm_deletion(self, images: List[Dict], query: str) -> str:
+        with self._lock:
+            shard_id = next(iter(self._loaded), None) or next(iter(self.roots), None)
+        if shard_id is None:
+            return f"Are you sure you want to delete these {len(images)} images matching '{query}'?"
+        with self.pinned(shard_id) as shard:
+            return shard.confirm_deletion(images, query)
+
+    def close(self):
+        """Snapshot loaded shards and stop the search and save pools."""
+        self._save_pool.shutdown(wait=True)
+        self.save_all()
+        with self._lock:
+            shards = list(self._loaded.values())
+        for shard in shards:
+            shard.close()
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,76 @@
+from vector_store import VectorStore
+from datetime import datetime, timedelta
+import numpy as np
+
+# Words that mean the same thing share a dimension, so semantic matches need no shared keyword
+CONCEPTS = {"dog": 0, "puppy": 0, "cat": 1, "kitten": 1, "receipt": 2, "invoice": 2, "beach": 3}
+
+
+class ConceptEmbeddings:
+    """Embeds text by the concepts its words name, so tests run without downloading a model."""
+
+    def embed_texts(self, texts):
+        vectors = np.zeros((len(texts), len(set(CONCEPTS.values()))), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                if word in CONCEPTS:
+                    vectors[row, CONCEPTS[word]] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def embed_query(self, query):
+        return self.embed_texts([query])[0]
+
+
+def days_ago(days):
+    return (datetime.now().date() - timedelta(days=days)).isoformat()
+
+
+def record(path, caption, creation_date, is_screenshot=False):
+    return {'path': path, 'caption': caption, 'creation_date': creation_date, 'creation_time': '12:00:00',
+            'dhash': '', 'is_screenshot': is_screenshot}
+
+
+store = VectorStore(embedding_service=ConceptEmbeddings())
+store.add_images([
+    record("/home/user/Desktop/dog.png", "a dog on the grass", days_ago(31)),
+    record("/home/user/Desktop/cat.png", "a cat asleep", days_ago(30)),
+    record("/home/user/Desktop/old/receipt.png", "a receipt", "2024-06-30", is_screenshot=True),
+    record("/home/user/Desktop/older/invoice.png", "an invoice", "2024-07-01", is_screenshot=True),
+    record("/home/user/Desktop/beach.png", "the beach at sunset", days_ago(1)),
+])
+
+
+def names(rule):
+    return sorted(result['path'].rsplit('/', 1)[1] for _, result in store.evaluate_rules([rule]))
+
+
+# older_than_days excludes the boundary day; date_to is inclusive
+print(f"Older than 30 days: {names({'older_than_days': 30})}")
+assert names({'older_than_days': 30}) == ['dog.png', 'invoice.png', 'receipt.png']
+assert names({'newer_than_days': 30}) == ['beach.png', 'cat.png']
+assert names({'date_to': '2024-06-30'}) == ['receipt.png']
+assert names({'date_from': '2024-06-30', 'date_to': '2024-07-01'}) == ['invoice.png', 'receipt.png']
+
+# A folder matches only paths under it, not siblings sharing its prefix
+assert names({'folder': '/home/user/Desktop/old'}) == ['receipt.png']
+assert names({'screenshot': True}) == ['invoice.png', 'receipt.png']
+assert names({'screenshot': False, 'keyword': 'a'}) == ['beach.png', 'cat.png', 'dog.png']
+assert names({'keyword': 'sunset'}) == ['beach.png']
+
+# Conditions combine
+assert names({'screenshot': True, 'date_to': '2024-06-30', 'folder': '/home/user/Desktop'}) == ['receipt.png']
+
+# Queries match by meaning as well as by text, and results carry their similarity
+matches = list(store.batch_search(["puppy", "kitten", "invoice", "volcano"]))
+print(f"Batch matches: {[(query, result['path']) for query, result in matches]}")
+found = {(query, result['path'].rsplit('/', 1)[1]) for query, result in matches}
+assert found == {("puppy", "dog.png"), ("kitten", "cat.png"), ("invoice", "receipt.png"), ("invoice", "invoice.png")}
+assert all(result['similarity'] >= 0.35 for _, result in matches)
+
+# A threshold above every score leaves only literal caption matches
+assert {result['path'] for _, result in store.batch_search(["invoice"], min_similarity=1.1)} == {"/home/user/Desktop/older/invoice.png"}
+
+# Rules are evaluated chunk by chunk with the same results
+assert list(store.evaluate_rules([{'query': 'dog'}], chunk_size=2)) == list(store.evaluate_rules([{'query': 'dog'}]))
@@ -0,0 +1,57 @@
+from caption_scheduler import CaptionScheduler
+import os
+import tempfile
+import shutil
+import time
+
+root = tempfile.mkdtemp()
+nested = os.path.join(root, "archive")
+os.makedirs(nested)
+
+def make(folder, name, age_days, size):
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    mtime = time.time() - age_days * 86400
+    os.utime(path, (mtime, mtime))
+    return path
+
+old = make(root, "old.png", 30, 10)
+recent_big = make(root, "recent_big.png", 1, 5000)
+recent_small = make(root, "recent_small.png", 1, 10)
+recent_nested = make(nested, "recent_nested.png", 1, 10)
+named = make(nested, "Screen Shot 2020-01-05 at 1.00.00 PM.png", 0, 10)
+
+scheduler = CaptionScheduler(visible_dirs=[root])
+scheduler.push_many([old, recent_big, recent_nested, named, recent_small])
+
+# Newest first, visible folder before nested, smaller before larger;
+# the screenshot is dated by its filename, not its mtime
+order = scheduler.order([old, recent_big, recent_nested, named, recent_small])
+print(f"Backlog order: {[os.path.basename(p) for p in order]}")
+assert order == [recent_small, recent_big, recent_nested, old, named]
+
+# Queries boost a date range; live events preempt everything
+assert scheduler.boost_date_range("2020-01-01", "2020-01-31") == 1
+live = make(root, "live.png", 400, 10)
+assert scheduler.push(live, live=True)
+
+drained = list(scheduler.drain())
+print(f"Drain order: {[os.path.basename(p) for p in drained]}")
+assert drained[:2] == [live, named]
+assert drained[2:] == [recent_small, recent_big, recent_nested, old]
+
+# Once drained, live events are handled by the caller
+assert not scheduler.push(live, live=True)
+
+# Deferred captions queue behind everything else; a live event still preempts them
+scheduler = CaptionScheduler(visible_dirs=[root])
+assert scheduler.push_many([named, old], deferred=True) == 2
+scheduler.push(recent_small, live=True)
+entries = [scheduler.pop_entry() for _ in range(3)]
+print(f"Deferred order: {[(os.path.basename(p), d) for p, d in entries]}")
+assert entries == [(recent_small, False), (old, True), (named, True)]
+assert scheduler.pop_entry() is None and not scheduler.closed
+scheduler.close()
+assert scheduler.wait_for_work(timeout=1)
+shutil.rmtree(root)
@@ -0,0 +1,61 @@
+from vector_store import VectorStore
+from benchmarks.fake_llama_stack import FakeLlamaStackClient, FakeAgent
+from llama_agent import LlamaAgent
+import numpy as np
+import os
+import tempfile
+import time
+
+
+class ConstantEmbeddings:
+    """Every caption embeds to the same vector, so tests run without downloading a model."""
+
+    def embed_texts(self, texts):
+        return np.ones((len(texts), 4), dtype=np.float32) / 2
+
+    def embed_query(self, query):
+        return np.ones(4, dtype=np.float32) / 2
+
+
+def record(path):
+    return {'path': path, 'caption': "a cat", 'creation_date': '2025-01-01', 'creation_time': '12:00:00', 'dhash': ''}
+
+
+tombstones = os.path.join(tempfile.mkdtemp(), "deleted_paths.json")
+client = FakeLlamaStackClient()
+agent = LlamaAgent(client=client, agent_cls=FakeAgent)
+store = VectorStore(llama_agent=agent, embedding_service=ConstantEmbeddings(), tombstone_path=tombstones)
+store.add_images([record("/tmp/cat1.png"), record("/tmp/cat2.png")])
+assert store.remove_images(["/tmp/cat1.png"]) == 1
+store.close()
+
+# A restarted store still masks the deletion, though the Llama Stack DB keeps the document
+restarted = VectorStore(llama_agent=agent, embedding_service=ConstantEmbeddings(), tombstone_path=tombstones)
+print(f"Deleted paths after restart: {restarted.deleted_paths}")
+assert restarted.deleted_paths == {"/tmp/cat1.png"}
+
+# Re-adding the file lifts its tombstone, on disk too
+restarted.add_images([record("/tmp/cat1.png")])
+assert not VectorStore(embedding_service=ConstantEmbeddings(), tombstone_path=tombstones).deleted_paths
+restarted.close()
+
+# Once dead chunks outnumber live ones, the vector DB is rebuilt from local records
+import vector_store
+vector_store.RAG_COMPACT_MIN_DEAD = 4
+store = VectorStore(llama_agent=agent, vector_db_id="compacted", embedding_service=ConstantEmbeddings())
+store.add_images([record(f"/tmp/dog{i}.png") for i in range(8)])
+store.remove_images([f"/tmp/dog{i}.png" for i in range(6)])
+for _ in range(50):
+    if not store._compacting and store.remote_chunks == 2:
+        break
+    time.sleep(0.05)
+print(f"After compaction: {len(client.documents['compacted'])} remote documents, {store.dead_chunk_count()} dead")
+assert sorted(client.documents["compacted"]) == ["/tmp/dog6.png", "/tmp/dog7.png"]
+assert not store.deleted_paths and store.dead_chunk_count() == 0
+
+# Short RAG results are topped up from local search
+client.documents["compacted"].clear()
+results = store.search_images("a cat", top_k=5)
+print(f"Topped up: {[result['path'] for result in results]}")
+assert {result['path'] for result in results} == {"/tmp/dog6.png", "/tmp/dog7.png"}
+store.close()
@@ -0,0 +1,64 @@
+from benchmarks.fake_llama_stack import FakeLlamaStackClient, FakeAgent, FakeLlamaStackError
+from llama_agent import LlamaAgent
+import time
+
+
+def failures_for(seed):
+    client = FakeLlamaStackClient(error_rate={"*": 0.3}, seed=seed)
+    outcome = []
+    for _ in range(20):
+        try:
+            client.models.list()
+            outcome.append("ok")
+        except FakeLlamaStackError:
+            outcome.append("error")
+    return outcome
+
+
+# Same seed, same injected failures
+print(f"Failure pattern: {failures_for(1)}")
+assert failures_for(1) == failures_for(1)
+
+# Latency is applied per endpoint
+client = FakeLlamaStackClient(latency={"rag_tool.query": 0.05})
+start = time.perf_counter()
+client.tool_runtime.rag_tool.query(vector_db_ids=["db"], content="cat")
+elapsed = time.perf_counter() - start
+print(f"rag_tool.query took {elapsed:.3f}s")
+assert elapsed >= 0.05
+
+# Canned RAG results come from inserted documents, in the real client's response shapes
+document = {"document_id": "/tmp/cat.png", "content": "a cat on a sofa (2025-01-01)", "metadata": {"path": "/tmp/cat.png"}}
+client.tool_runtime.rag_tool.insert(documents=[document], vector_db_id="db")
+result = client.tool_runtime.rag_tool.query(vector_db_ids=["db"], content="cat", query_config={"max_chunks": 5})
+print(f"RAG tool document ids: {result.metadata['document_ids']}")
+assert result.metadata["document_ids"] == ["/tmp/cat.png"]
+response = client.vector_io.query(vector_db_id="db", query="cat", params={"max_chunks": 5})
+print(f"Chunks: {[(chunk.metadata['path'], score) for chunk, score in zip(response.chunks, response.scores)]}")
+assert response.chunks[0].metadata["document_id"] == "/tmp/cat.png"
+
+# Outages and targeted failures
+client.set_down()
+try:
+    client.inference.chat_completion(model="fake-llm", messages=[{"role": "user", "content": "hi"}])
+    raise AssertionError("expected an injected failure")
+except FakeLlamaStackError as e:
+    print(f"Injected failure: {e}")
+client.set_down(False)
+
+agent = FakeAgent(client, model="fake-llm")
+session_id = agent.create_session("test")
+turn = agent.create_turn(messages=[{'role': 'user', 'content': 'hello'}], session_id=session_id, stream=False)
+print(f"Agent turn: {turn.output_message.content}")
+reply = client.inference.chat_completion(model="fake-llm", messages=[{"role": "user", "content": "hi"}])
+assert isinstance(reply.completion_message.content, str)
+print(f"Calls: {client.calls}")
+
+# LlamaAgent reads the real response shapes: a stateless rewrite succeeds and the session turn is not streamed
+llama_agent = LlamaAgent(client=client, agent_cls=FakeAgent)
+rewritten = llama_agent.rewrite_query("cats on a sofa", strict=True)
+print(f"Rewritten: {rewritten}")
+assert isinstance(rewritten, str) and rewritten
+confirmation = llama_agent.confirm_deletion([{'path': "/tmp/cat.png", 'caption': "a cat", 'creation_date': "2025-01-01"}], "delete cats")
+print(f"Confirmation: {confirmation}")
+assert llama_agent.session_turns == 1
@@ -0,0 +1,59 @@
+from image_hashing import MultiIndexHash, group_near_duplicates, hamming_distance, same_file_contents
+import os
+import tempfile
+import random
+
+random.seed(0)
+
+# Random 64-bit hashes plus a few near-copies (3 bits flipped)
+records = [{'path': f"image_{i}.png", 'dhash': f"{random.getrandbits(64):016x}"} for i in range(1000)]
+for i in range(5):
+    value = int(records[i]['dhash'], 16)
+    for bit in random.sample(range(64), 3):
+        value ^= 1 << bit
+    records.append({'path': f"copy_of_image_{i}.png", 'dhash': f"{value:016x}"})
+
+index = MultiIndexHash()
+for i, record in enumerate(records):
+    index.add(int(record['dhash'], 16), i)
+
+# Every hash within the radius must be found, matching a brute-force scan
+query = int(records[0]['dhash'], 16)
+expected = sorted(j for j, r in enumerate(records) if hamming_distance(query, int(r['dhash'], 16)) <= 6)
+found = sorted(j for _, j in index.search(query, 6))
+print(f"Brute force: {expected}, index: {found}")
+assert expected == found
+
+groups = group_near_duplicates(records)
+print(f"Found {len(groups)} duplicate groups:")
+for group in groups:
+    print([record['path'] for record in group])
+assert len(groups) == 5
+
+# Removed entries drop out of searches, so a row can be rehashed in place
+assert index.remove(query, 0) and not index.remove(query, 0)
+assert 0 not in [j for _, j in index.search(query, 6)] and index.size == len(records) - 1
+
+# Groups don't chain: C is within the radius of B but not of A, the image kept
+a = 0
+b = a ^ 0b11111
+c = b ^ (0b11111 << 5)
+chain = [
+    {'path': "a.png", 'dhash': f"{a:016x}", 'creation_date': "2025-01-01"},
+    {'path': "b.png", 'dhash': f"{b:016x}", 'creation_date': "2025-01-02"},
+    {'path': "c.png", 'dhash': f"{c:016x}", 'creation_date': "2025-01-03"},
+]
+groups = group_near_duplicates(chain)
+print(f"Chained groups: {[[(r['path'], r['distance']) for r in group] for group in groups]}")
+assert [[r['path'] for r in group] for group in groups] == [["a.png", "b.png"]]
+assert groups[0][1]['distance'] == 5
+
+# Only byte-identical files count as exact copies
+folder = tempfile.mkdtemp()
+paths = [os.path.join(folder, name) for name in ("one.png", "two.png", "three.png")]
+for path, content in zip(paths, (b"same", b"same", b"diff")):
+    with open(path, "wb") as f:
+        f.write(content)
+assert same_file_contents(paths[0], paths[1])
+assert not same_file_contents(paths[0], paths[2])
+assert not same_file_contents(paths[0], os.path.join(folder, "missing.png"))
@@ -0,0 +1,56 @@
+from benchmarks.fake_llama_stack import FakeLlamaStackClient, FakeLlamaStackError
+from llama_client import CircuitBreaker, GuardedClient, CircuitOpenError
+from types import SimpleNamespace
+import time
+
+fake = FakeLlamaStackClient()
+breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.2, probe=fake.models.list)
+client = GuardedClient(fake, breaker, max_retries=1, backoff=0.01)
+
+# A single transient failure is retried away
+fake.fail_next("models.list")
+models = client.models.list()
+print(f"Models after one retry: {[m.identifier for m in models]}")
+assert fake.calls["models.list"] == 2
+assert not breaker.is_open
+
+# Repeated failures open the breaker; calls then fail fast
+fake.set_down()
+for _ in range(2):
+    try:
+        client.inference.chat_completion(model="fake-llm", messages=[{"role": "user", "content": "hi"}])
+    except FakeLlamaStackError as e:
+        print(f"Failed after retries: {e}")
+print(f"Breaker: {breaker.stats()}")
+assert breaker.is_open
+
+calls_before = fake.calls["inference.chat_completion"]
+start = time.perf_counter()
+try:
+    client.inference.chat_completion(model="fake-llm", messages=[{"role": "user", "content": "hi"}])
+    raise AssertionError("expected CircuitOpenError")
+except CircuitOpenError as e:
+    print(f"Rejected in {1000 * (time.perf_counter() - start):.2f} ms: {e}")
+assert fake.calls["inference.chat_completion"] == calls_before
+
+# The background probe closes the breaker once the server is back
+fake.set_down(False)
+time.sleep(0.5)
+print(f"Breaker after recovery: {breaker.stats()}")
+assert not breaker.is_open
+
+# Bugs are raised at once, without retries, and never count against the breaker
+attempts = []
+
+def broken():
+    attempts.append(1)
+    raise TypeError("unexpected keyword argument")
+
+buggy = GuardedClient(SimpleNamespace(broken=broken), breaker, max_retries=2, backoff=0.01)
+for _ in range(3):
+    try:
+        buggy.broken()
+    except TypeError:
+        pass
+print(f"Breaker after programming errors: {breaker.stats()}")
+assert len(attempts) == 3 and not breaker.is_open and breaker.consecutive_failures == 0
@@ -0,0 +1,26 @@
+from metadata import CAPTION_DESCRIPTION_MAX_CHARS, extract_metadata, metadata_caption, parse_screenshot_filename
+import glob
+
+# The sample screenshots carry their capture time in the filename
+for path in sorted(glob.glob("input_folder/**/*.png", recursive=True)):
+    info = extract_metadata(path)
+    print(f"{path}: {info['capture_time']} ({info['time_source']}), {info['width']}x{info['height']}, screenshot={info['is_screenshot']}")
+    assert info['is_screenshot']
+    assert info['time_source'] == "filename"
+
+is_screenshot, taken = parse_screenshot_filename("Screen Shot 2025-04-16 at 2.08.36 PM.png")
+print(f"macOS filename: {taken}")
+assert is_screenshot and taken.hour == 14
+
+is_screenshot, taken = parse_screenshot_filename("Screenshot_20250416-140836.png")
+print(f"Android filename: {taken}")
+assert is_screenshot and taken.minute == 8
+
+assert parse_screenshot_filename("holiday.png") == (False, None)
+
+# Long PNG descriptions are cut to their first sentence, or a bounded length
+caption = metadata_caption({'description': "Login page. " + "x" * 5000, 'width': 1920, 'height': 1080})
+print(f"Caption: {caption}")
+assert caption == "a screenshot of Login page. (1920x1080)"
+caption = metadata_caption({'description': "word " * 2000})
+assert len(caption) <= len("a screenshot of ") + CAPTION_DESCRIPTION_MAX_CHARS + 3
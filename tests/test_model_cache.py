@@ -0,0 +1,67 @@
+from model_cache import IdleModel, load_cached_pretrained, resident_memory_bytes
+import os
+import tempfile
+import time
+
+loads = []
+
+
+def loader():
+    loads.append(time.perf_counter())
+    return bytearray(32 * 1024 * 1024)
+
+
+# Nothing is loaded until first use
+model = IdleModel("test", loader, idle_timeout=1.0)
+assert not model.loaded
+first = model.get()
+assert model.get() is first and len(loads) == 1
+print(f"RSS after load: {resident_memory_bytes() / (1024 * 1024):.1f} MB")
+del first
+
+# Unloaded after the idle timeout, reloaded on the next use
+time.sleep(2.5)
+print(model.status())
+assert not model.loaded and model.unloads == 1
+model.get()
+assert len(loads) == 2
+print(model.status())
+assert model.stats()["avg_reload_seconds"] is not None
+
+# Without a timeout the model stays resident
+resident = IdleModel("resident", loader, idle_timeout=0)
+resident.get()
+time.sleep(1.5)
+assert resident.loaded
+model.close()
+resident.close()
+
+
+class FakePretrained:
+    sources = []
+
+    @classmethod
+    def from_pretrained(cls, source):
+        cls.sources.append(source)
+        return cls()
+
+    def save_pretrained(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        open(os.path.join(directory, "config.json"), "w").close()
+
+
+# Kept-resident models are never re-saved; idle-unloaded ones are, once
+cache_dir = tempfile.mkdtemp()
+load_cached_pretrained(FakePretrained, "org/model", cache_dir=cache_dir, save=False)
+assert not os.listdir(cache_dir)
+load_cached_pretrained(FakePretrained, "org/model", cache_dir=cache_dir)
+load_cached_pretrained(FakePretrained, "org/model", cache_dir=cache_dir)
+local_dir = os.path.join(cache_dir, "org--model", "FakePretrained")
+print(f"Loaded from: {FakePretrained.sources}")
+assert FakePretrained.sources == ["org/model", "org/model", local_dir]
+
+# Another process already saving means this one skips the copy
+os.makedirs(os.path.join(cache_dir, "org--other"))
+open(os.path.join(cache_dir, "org--other", "FakePretrained.lock"), "w").close()
+load_cached_pretrained(FakePretrained, "org/other", cache_dir=cache_dir)
+assert not os.path.isdir(os.path.join(cache_dir, "org--other", "FakePretrained"))
@@ -0,0 +1,23 @@
+from prompt_builder import summarize_images, estimate_tokens
+
+images = [
+    {
+        'path': f"/home/user/Desktop/folder{i % 4}/Screen Shot {i}.png",
+        'caption': ["a screenshot of a chart", "a cat on a sofa", "a terminal window"][i % 3],
+        'creation_date': f"2024-{1 + i % 12:02d}-{1 + i % 28:02d}",
+    }
+    for i in range(5000)
+]
+
+# Thousands of matches are aggregated and stay within the budget
+summary = summarize_images(images, budget_tokens=800)
+print(summary)
+print(f"Estimated tokens: {estimate_tokens(summary)}")
+assert estimate_tokens(summary) <= 800
+assert "5000 images in total" in summary
+assert "By folder:" in summary and "more" in summary
+
+# Small result sets are listed in full
+summary = summarize_images(images[:3], budget_tokens=800)
+print(summary)
+assert all(img['path'] in summary for img in images[:3])
@@ -0,0 +1,86 @@
+from sharded_store import ShardedVectorStore
+from llama_agent import LlamaAgent
+from benchmarks.fake_llama_stack import FakeLlamaStackClient, FakeAgent
+import numpy as np
+import os
+import tempfile
+import threading
+import time
+import zlib
+
+
+class WordEmbeddings:
+    """Bag-of-words vectors, so tests run without downloading a model."""
+
+    def embed_texts(self, texts):
+        vectors = np.zeros((len(texts), 64), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[row, zlib.crc32(word.encode()) % 64] += 1
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        return vectors / norms
+
+    def embed_query(self, query):
+        return self.embed_texts([query])[0]
+
+
+def record(path, caption):
+    return {'path': path, 'caption': caption, 'creation_date': '2025-01-01', 'creation_time': '12:00:00', 'dhash': ''}
+
+
+client = FakeLlamaStackClient()
+agent = LlamaAgent(client=client, agent_cls=FakeAgent)
+store = ShardedVectorStore(llama_agent=agent, snapshot_dir=tempfile.mkdtemp(), max_loaded=1,
+                           embedding_service=WordEmbeddings())
+roots = [f"/home/user{i}/Desktop" for i in range(3)]
+for root in roots:
+    store.register_root(root)
+
+# Records are routed per root, and with max_loaded=1 every other shard is snapshotted and evicted
+added = store.add_images(record(f"{root}/cat{i}.png", f"a cat number {i}") for root in roots for i in range(5))
+print(f"Added {added}, loaded shards: {store.loaded_shards()}")
+assert added == 15 and len(store.loaded_shards()) == 1
+
+# Evicted shards reload from their snapshots when searched
+results = store.search_images("cat", top_k=20)
+print(f"Found {len(results)} results across shards")
+assert len(results) == 15
+
+# Read-only searches evict shards without rewriting their snapshots
+def snapshot_times():
+    store._save_pool.submit(lambda: None).result()  # wait for background saves
+    return {shard_id: os.path.getmtime(os.path.join(store._snapshot_path(shard_id), "records.json"))
+            for shard_id in store.shard_ids() if shard_id not in store.loaded_shards()}
+
+before = snapshot_times()
+time.sleep(0.05)
+store.search_images("cat number 3", top_k=20)
+after = snapshot_times()
+print(f"Snapshots rewritten by a search: {sum(before[k] != after.get(k, before[k]) for k in before)}")
+assert before and all(before[k] == after[k] for k in before if k in after)
+
+# Concurrent adds never land in an evicted shard
+threads = [
+    threading.Thread(target=store.add_images, args=([record(f"{root}/dog{t}.png", "a dog")],))
+    for t in range(10) for root in roots
+]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+assert len(store.search_images("dog", top_k=100)) == 30
+
+# Removal goes to the owning shard
+assert store.remove_images([f"{roots[0]}/cat0.png"]) == 1
+assert len(store.search_images("cat", top_k=20)) == 14
+store.close()
+
+# Local mode (no LLM) is expected, not degraded, so merged results are cached
+local = ShardedVectorStore(snapshot_dir=tempfile.mkdtemp(), embedding_service=WordEmbeddings())
+local.register_root(roots[0])
+local.add_images([record(f"{roots[0]}/fish.png", "a fish")])
+local.search_images("fish")
+local.search_images("fish")
+assert len(local._result_cache) == 1
+local.close()
@@ -0,0 +1,65 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, Optional
+from PIL import Image, features
+
+
+class ThumbnailService:
+    def __init__(self, cache_dir: Optional[str] = None, max_workers: int = 4, quality: int = 80):
+        """Resized image previews rendered in a worker pool and cached on disk."""
+        self.cache_dir = cache_dir or str(Path.home() / ".cache" / "png_cleanup" / "thumbnails")
+        self.quality = quality
+        self.format = "WEBP" if features.check("webp") else "PNG"
+        self.extension = ".webp" if self.format == "WEBP" else ".png"
+        self.mimetype = "image/webp" if self.format == "WEBP" else "image/png"
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="thumbnail")
+        self._lock = threading.Lock()
+        # cache path -> future, so concurrent requests for one thumbnail render it once
+        self._in_flight: Dict[str, Future] = {}
+
+    def cache_path(self, image_path: str, size: int) -> str:
+        """Cache location for a thumbnail; changes whenever the source file does."""
+        stat = os.stat(image_path)
+        key = hashlib.sha1(f"{image_path}:{stat.st_mtime_ns}:{stat.st_size}:{size}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], key + self.extension)
+
+    def _render(self, image_path: str, size: int, target: str) -> str:
+        with Image.open(image_path) as image:
+            image.draft("RGB", (size, size))
+            image.thumbnail((size, size))
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Write to a temp file and rename so readers never see a partial thumbnail
+            tmp_path = f"{target}.{threading.get_ident()}.tmp"
+            image.save(tmp_path, self.format, quality=self.quality)
+        os.replace(tmp_path, target)
+        return target
+
+    def get(self, image_path: str, size: int = 256, timeout: float = 30.0) -> str:
+        """Path to a cached thumbnail of image_path, rendering it if needed."""
+        target = self.cache_path(image_path, size)
+        if os.path.exists(target):
+            return target
+
+        submitted = False
+        with self._lock:
+            future = self._in_flight.get(target)
+            if future is None:
+                future = self._executor.submit(self._render, image_path, size, target)
+                self._in_flight[target] = future
+                submitted = True
+        # Registered outside the lock: a render that already finished runs
+        # the callback right here, and _forget takes the lock itself
+        if submitted:
+            future.add_done_callback(lambda done: self._forget(target, done))
+        return future.result(timeout=timeout)
+
+    def _forget(self, target: str, future: Future):
+        with self._lock:
+            if self._in_flight.get(target) is future:
+                del self._in_flight[target]
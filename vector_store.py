@@ -1,28 +1,109 @@
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Iterable, Iterator, Tuple
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
 import json
+import os
 import re
-from datetime import datetime
+import threading
+from datetime import datetime, timedelta
+import numpy as np
 from llama_stack_client import LlamaStackClient, RAGDocument
+from embedding_service import get_embedding_service
+from image_hashing import MultiIndexHash, group_near_duplicates, DEFAULT_MAX_DISTANCE
+from prompt_builder import summarize_images
+import metrics
+
+# Minimum cosine similarity for a caption to count as a semantic match
+SEMANTIC_MATCH_THRESHOLD = 0.35
+# Larger than any caption document, so each image is stored as one chunk
+RAG_CHUNK_SIZE_TOKENS = 512
+# RAG queries never fetch more than this multiple of top_k
+RAG_MAX_OVERFETCH = 8
+# The Llama Stack vector DB has no per-document delete, so chunks of deleted
+# or re-uploaded images pile up; once dead chunks outnumber live ones by this
+# ratio (and there are at least RAG_COMPACT_MIN_DEAD), the DB is rebuilt
+RAG_COMPACT_RATIO = 1.0
+RAG_COMPACT_MIN_DEAD = 256
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, for cache keys."""
+    return " ".join(query.lower().split())
 
 class VectorStore:
-    def __init__(self, llama_agent=None, vector_db_id="png_image_vector_db"):
-        """Initialize the vector store with Llama Stack integration."""
+    def __init__(self, llama_agent=None, vector_db_id="png_image_vector_db", embedding_service=None,
+                 result_cache_size: int = 256, tombstone_path: Optional[str] = None):
+        """Initialize the vector store with Llama Stack integration.
+        
+        With tombstone_path set, deleted_paths (and the count of chunks
+        uploaded to the vector DB) are kept in that file, so images deleted in
+        an earlier run stay masked in Llama Stack results.
+        """
         self.processed_images = []
+        self.caption_embeddings = None
+        # caption_embeddings is a view of the first _embedding_rows rows of this
+        # buffer, which grows geometrically so appends are amortized O(1)
+        self._embedding_buffer = None
+        self._embedding_rows = 0
+        # path -> row in processed_images / caption_embeddings
+        self._path_index = {}
+        # Perceptual hashes; items are rows in processed_images
+        self.hash_index = MultiIndexHash()
+        self._lock = threading.RLock()
+        # Paths deleted locally; the Llama Stack vector DB may still return them
+        self.deleted_paths = set()
+        # Chunks uploaded since the vector DB was created, live or dead
+        self.remote_chunks = 0
+        self._compacting = False
+        self.tombstone_path = tombstone_path
+        if tombstone_path:
+            self._load_tombstones()
+        # path -> record indexed locally but not yet uploaded to Llama Stack
+        self._pending_uploads = OrderedDict()
+        self._upload_lock = threading.Lock()
+        # Bumped on every change to the indexed images; cached results carry the generation they saw
+        self.generation = 0
+        self._result_cache = OrderedDict()
+        self.result_cache_size = result_cache_size
+        # (generation, sorted creation dates, rows), see _date_index
+        self._sorted_dates = None
+        # top_k multiplier for RAG queries, adapted to the share of usable hits
+        self.rag_overfetch = 2.0
+        self.embedding_service = embedding_service or get_embedding_service()
         self.llama_agent = llama_agent
         self.vector_db_id = vector_db_id
+        self.vector_db_ready = False
+        # Whether the vector DB was already on the server when we registered it
+        self.remote_db_existed = False
+        # Called with each date range parsed from a query, e.g. to prioritize indexing it
+        self.date_query_listeners = []
         self.client = None
         
         if llama_agent:
             self.client = llama_agent.client
             self.setup_vector_db_with_llama_stack()
+            llama_agent.recover_listeners.append(self._on_llama_stack_recovered)
+    
+    def close(self):
+        """Stop reacting to Llama Stack recovery, e.g. before dropping an unloaded shard."""
+        if self.llama_agent and self._on_llama_stack_recovered in self.llama_agent.recover_listeners:
+            self.llama_agent.recover_listeners.remove(self._on_llama_stack_recovered)
+    
+    def _on_llama_stack_recovered(self):
+        if not self.vector_db_ready:
+            self.setup_vector_db_with_llama_stack()
+        self.flush_pending_uploads()
     
     def setup_vector_db_with_llama_stack(self):
         """Set up vector database with Llama Stack."""
-        if not self.client:
+        if not self.client or self.llama_agent.circuit_open:
             return
             
         # Get embedding model from available models
-        embedding_models = [m for m in self.client.models.list() if m.model_type == "embedding"]
+        try:
+            embedding_models = [m for m in self.client.models.list() if m.model_type == "embedding"]
+        except Exception as e:
+            print(f"Error listing embedding models: {str(e)}")
+            return
         if not embedding_models:
             print("No embedding models available. Vector store setup failed.")
             return
@@ -31,6 +112,14 @@ class VectorStore:
         embedding_model_id = embedding_model.identifier
         embedding_dimension = embedding_model.metadata["embedding_dimension"]
         
+        # A DB the server doesn't already have (new, or lost in a server
+        # restart) starts empty, so every local record has to be uploaded
+        try:
+            existed = any(db.identifier == self.vector_db_id for db in self.client.vector_dbs.list())
+        except Exception as e:
+            print(f"Error listing vector databases: {str(e)}")
+            existed = False
+        
         # Register vector DB with Llama Stack
         try:
             self.client.vector_dbs.register(
@@ -39,72 +128,615 @@ class VectorStore:
                 embedding_dimension=embedding_dimension,
                 provider_id="faiss",
             )
+            self.vector_db_ready = True
+            self.remote_db_existed = existed
             print(f"Vector database '{self.vector_db_id}' registered successfully")
+            if not existed:
+                with self._lock:
+                    self.remote_chunks = 0
+                self._queue_all_uploads()
         except Exception as e:
             print(f"Error registering vector database: {str(e)}")
     
-    def add_images(self, processed_images: List[Dict[str, str]]):
-        """Add processed images to the local store."""
-        self.processed_images.extend(processed_images)
+    def add_images(self, processed_images: Iterable[Dict[str, str]], batch_size: int = 32) -> int:
+        """Add processed images to the store, flushing every batch_size records.
         
-        # If Llama Stack is available, add to vector store
-        if self.client:
-            self.add_images_to_llama_stack(processed_images)
+        Accepts any iterable, so a generator of records becomes searchable
+        batch by batch while it is still being produced.
+        """
+        added = 0
+        batch = []
+        for img in processed_images:
+            batch.append(img)
+            if len(batch) >= batch_size:
+                self._add_batch(batch)
+                added += len(batch)
+                batch = []
+        
+        if batch:
+            self._add_batch(batch)
+            added += len(batch)
+        return added
     
-    def add_images_to_llama_stack(self, processed_images: List[Dict[str, str]]):
-        """Add processed images to Llama Stack vector DB."""
-        if not self.client:
+    def _add_batch(self, batch: List[Dict[str, str]]):
+        """Embed, store and upload one batch of records."""
+        # The same path twice in one batch; the later record wins
+        batch = list({img['path']: img for img in batch}.values())
+        embeddings = self.embed_captions(batch)
+        with self._lock:
+            appended = []
+            for i, img in enumerate(batch):
+                row = self._path_index.get(img['path'])
+                if row is not None:
+                    # A re-processed file overwrites its row rather than rebuilding the indexes
+                    self._replace_record(row, img, embeddings[i] if embeddings is not None else None)
+                    continue
+                row = len(self.processed_images) + len(appended)
+                self._path_index[img['path']] = row
+                appended.append(i)
+                if img.get('dhash'):
+                    self.hash_index.add(int(img['dhash'], 16), row)
+            
+            if appended:
+                new_records = [batch[i] for i in appended]
+                self.processed_images.extend(new_records)
+                self._append_embeddings(embeddings[appended] if embeddings is not None else None, len(appended))
+            restored = self.deleted_paths.intersection(img['path'] for img in batch)
+            if restored:
+                self.deleted_paths.difference_update(restored)
+                self._save_tombstones()
+            for img in batch:
+                self._pending_uploads.pop(img['path'], None)
+                self._pending_uploads[img['path']] = img
+            self._bump_generation()
+        
+        # Upload now if Llama Stack is available; otherwise the batch waits
+        # for the vector DB to be registered or the breaker to close
+        self.flush_pending_uploads()
+    
+    def _queue_all_uploads(self):
+        with self._lock:
+            for img in self.processed_images:
+                self._pending_uploads[img['path']] = img
+    
+    def pending_upload_count(self) -> int:
+        with self._lock:
+            return len(self._pending_uploads)
+    
+    def flush_pending_uploads(self, batch_size: int = 32) -> int:
+        """Upload records indexed while Llama Stack was unavailable; returns how many were uploaded."""
+        if not self.client or not self.vector_db_ready or self.llama_agent.circuit_open:
+            return 0
+        # One flusher at a time, so concurrent batches don't upload the same records twice
+        if not self._upload_lock.acquire(blocking=False):
+            return 0
+        uploaded = 0
+        try:
+            while not self.llama_agent.circuit_open:
+                with self._lock:
+                    batch = list(self._pending_uploads.values())[:batch_size]
+                if not batch or not self.add_images_to_llama_stack(batch):
+                    break
+                with self._lock:
+                    for img in batch:
+                        # A record replaced during the upload stays queued
+                        if self._pending_uploads.get(img['path']) is img:
+                            del self._pending_uploads[img['path']]
+                    self.remote_chunks += len(batch)
+                    # RAG results cached before the upload missed this batch
+                    self._bump_generation()
+                uploaded += len(batch)
+        finally:
+            self._upload_lock.release()
+        if uploaded:
+            with self._lock:
+                self._save_tombstones()
+            self._maybe_compact()
+        return uploaded
+    
+    def dead_chunk_count(self) -> int:
+        """Estimated chunks in the vector DB for deleted images or superseded captions."""
+        with self._lock:
+            live = len(self.processed_images) - len(self._pending_uploads)
+            return max(0, self.remote_chunks - live)
+    
+    def _maybe_compact(self):
+        """Rebuild the vector DB in the background once dead chunks dominate it."""
+        dead = self.dead_chunk_count()
+        with self._lock:
+            live = max(len(self.processed_images), 1)
+            if self._compacting or dead < RAG_COMPACT_MIN_DEAD or dead / live < RAG_COMPACT_RATIO:
+                return
+            self._compacting = True
+        threading.Thread(target=self.compact_remote, name="vector-db-compaction", daemon=True).start()
+    
+    def compact_remote(self) -> bool:
+        """Drop the vector DB and re-upload every local record, discarding dead chunks.
+        
+        RAG returns short results while the upload runs; searches top them
+        up from local search.
+        """
+        try:
+            if not self.client or not self.vector_db_ready or self.llama_agent.circuit_open:
+                return False
+            # Keep flushes out while the DB is swapped
+            with self._upload_lock:
+                dead = self.dead_chunk_count()
+                try:
+                    self.client.vector_dbs.unregister(vector_db_id=self.vector_db_id)
+                except Exception as e:
+                    print(f"Error compacting vector database: {str(e)}")
+                    return False
+                self.vector_db_ready = False
+                with self._lock:
+                    # Nothing deleted is left remotely to mask
+                    self.remote_chunks = 0
+                    self.deleted_paths.clear()
+                    self._save_tombstones()
+                    self._bump_generation()
+            metrics.incr("rag_compactions")
+            print(f"Compacting vector database '{self.vector_db_id}': dropping ~{dead} stale chunks")
+            # The DB is new again, so setup queues every local record
+            self.setup_vector_db_with_llama_stack()
+            self.flush_pending_uploads()
+            return True
+        finally:
+            with self._lock:
+                self._compacting = False
+    
+    def records(self) -> List[Dict]:
+        """Snapshot of every indexed record."""
+        with self._lock:
+            return list(self.processed_images)
+    
+    def paths_needing_captions(self) -> List[str]:
+        """Images indexed with a metadata caption whose BLIP caption was deferred."""
+        with self._lock:
+            return [img['path'] for img in self.processed_images if img.get('needs_caption')]
+    
+    def remove_images(self, paths: Iterable[str]) -> int:
+        """Remove images from the local store and mask them in Llama Stack results."""
+        paths = set(paths)
+        if not paths:
+            return 0
+        
+        with self._lock:
+            removed = self._drop_records(paths)
+            self.deleted_paths.update(paths)
+            self._save_tombstones()
+            for path in paths:
+                self._pending_uploads.pop(path, None)
+            self._bump_generation()
+        self._maybe_compact()
+        return removed
+    
+    def _load_tombstones(self):
+        try:
+            with open(self.tombstone_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+            # Older files hold just the list of deleted paths
+            if isinstance(state, list):
+                state = {'deleted_paths': state}
+            self.deleted_paths = set(state.get('deleted_paths', []))
+            self.remote_chunks = state.get('remote_chunks', 0)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print(f"Error loading deleted paths from {self.tombstone_path}: {str(e)}")
+    
+    def _save_tombstones(self):
+        """Write deleted_paths to tombstone_path, if set. Caller holds the lock."""
+        if not self.tombstone_path:
             return
+        try:
+            os.makedirs(os.path.dirname(self.tombstone_path), exist_ok=True)
+            with open(f"{self.tombstone_path}.tmp", 'w', encoding='utf-8') as f:
+                json.dump({'deleted_paths': sorted(self.deleted_paths), 'remote_chunks': self.remote_chunks}, f)
+            os.replace(f"{self.tombstone_path}.tmp", self.tombstone_path)
+        except OSError as e:
+            print(f"Error saving deleted paths to {self.tombstone_path}: {str(e)}")
+    
+    def _bump_generation(self):
+        """Invalidate cached search results. Caller holds the lock."""
+        self.generation += 1
+        self._result_cache.clear()
+    
+    def _replace_record(self, row: int, img: Dict[str, str], vector: Optional[np.ndarray]):
+        """Overwrite one row's record, embedding and hash entry. Caller holds the lock."""
+        old = self.processed_images[row]
+        if old.get('dhash'):
+            self.hash_index.remove(int(old['dhash'], 16), row)
+        if img.get('dhash'):
+            self.hash_index.add(int(img['dhash'], 16), row)
+        self.processed_images[row] = img
+        
+        if self.caption_embeddings is None:
+            if vector is None:
+                return
+            # Every earlier batch failed to embed; start a zeroed matrix
+            self._set_embeddings(np.zeros((len(self.processed_images), len(vector)), dtype=np.float32))
+        self.caption_embeddings[row] = vector if vector is not None else 0
+    
+    def _drop_records(self, paths: set) -> int:
+        """Remove records for paths and rebuild the row-based indexes. Caller holds the lock."""
+        keep = [i for i, img in enumerate(self.processed_images) if img['path'] not in paths]
+        removed = len(self.processed_images) - len(keep)
+        if not removed:
+            return 0
+        
+        self.processed_images = [self.processed_images[i] for i in keep]
+        if self.caption_embeddings is not None:
+            self._set_embeddings(self.caption_embeddings[keep])
+        self._rebuild_indexes()
+        return removed
+    
+    def _rebuild_indexes(self):
+        """Recompute the path and hash indexes from processed_images. Caller holds the lock."""
+        self._path_index = {}
+        self.hash_index = MultiIndexHash()
+        for row, img in enumerate(self.processed_images):
+            self._path_index[img['path']] = row
+            if img.get('dhash'):
+                self.hash_index.add(int(img['dhash'], 16), row)
+    
+    def save(self, directory: str):
+        """Write a snapshot (records, embeddings, tombstones) to directory."""
+        with self._lock:
+            state = {
+                'vector_db_id': self.vector_db_id,
+                'images': list(self.processed_images),
+                'deleted_paths': sorted(self.deleted_paths),
+                'pending_uploads': list(self._pending_uploads),
+                'remote_chunks': self.remote_chunks,
+                'generation': self.generation,
+            }
+            embeddings = self.caption_embeddings
+        
+        os.makedirs(directory, exist_ok=True)
+        if embeddings is not None:
+            with open(os.path.join(directory, 'embeddings.npy.tmp'), 'wb') as f:
+                np.save(f, embeddings)
+            os.replace(os.path.join(directory, 'embeddings.npy.tmp'), os.path.join(directory, 'embeddings.npy'))
+        with open(os.path.join(directory, 'records.json.tmp'), 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(os.path.join(directory, 'records.json.tmp'), os.path.join(directory, 'records.json'))
+    
+    def load(self, directory: str) -> bool:
+        """Replace the local store with a snapshot from save(); returns False if there is none."""
+        try:
+            with open(os.path.join(directory, 'records.json'), 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        
+        images = state['images']
+        try:
+            embeddings = np.load(os.path.join(directory, 'embeddings.npy'))
+        except FileNotFoundError:
+            embeddings = None
+        if embeddings is not None and len(embeddings) != len(images):
+            # Interrupted save; the records are authoritative
+            embeddings = None
+        if embeddings is None and images:
+            embeddings = self.embed_captions(images)
+        
+        with self._lock:
+            self.processed_images = images
+            self._set_embeddings(embeddings)
+            self.deleted_paths = set(state.get('deleted_paths', []))
+            self._rebuild_indexes()
+            self._pending_uploads = OrderedDict(
+                (path, images[self._path_index[path]])
+                for path in state.get('pending_uploads', []) if path in self._path_index
+            )
+            self.remote_chunks = state.get('remote_chunks', 0)
+            if self.vector_db_ready and not self.remote_db_existed:
+                # The snapshot's records were uploaded to a DB the server no longer has
+                self.remote_chunks = 0
+                self._queue_all_uploads()
+            # Continue from the saved generation so keys cached before an unload can't match
+            self.generation = max(self.generation, state.get('generation', 0))
+            self._bump_generation()
+        return True
+    
+    def find_duplicates(self, max_distance: int = DEFAULT_MAX_DISTANCE) -> List[List[Dict]]:
+        """Groups of visually identical or near-identical images, oldest first in each group."""
+        with self._lock:
+            return group_near_duplicates(self.processed_images, max_distance, self.hash_index)
+    
+    def _date_index(self):
+        """(sorted creation dates, matching rows), rebuilt once per generation. Caller holds the lock."""
+        if self._sorted_dates is None or self._sorted_dates[0] != self.generation:
+            order = sorted(range(len(self.processed_images)), key=lambda row: self.processed_images[row].get('creation_date', ''))
+            dates = [self.processed_images[row].get('creation_date', '') for row in order]
+            self._sorted_dates = (self.generation, dates, np.asarray(order, dtype=np.int64))
+        return self._sorted_dates[1], self._sorted_dates[2]
+    
+    def batch_search(self, queries: List[str], min_similarity: float = SEMANTIC_MATCH_THRESHOLD,
+                     chunk_size: int = 4096) -> Iterator[Tuple[str, Dict]]:
+        """Every image matching each query, as a stream of (query, record) pairs.
+        
+        Uses keyword and embedding matching only, with no LLM calls and no top_k cap.
+        """
+        return self.evaluate_rules([{'name': query, 'query': query, 'min_similarity': min_similarity} for query in queries],
+                                   chunk_size)
+    
+    def evaluate_rules(self, rules: List[Dict], chunk_size: int = 4096) -> Iterator[Tuple[str, Dict]]:
+        """Evaluate declarative cleanup rules over the whole index, streaming (rule name, record) matches.
+        
+        A rule is a dict whose conditions must all hold:
+            query: caption contains this text or is semantically similar
+                (cosine >= min_similarity, default SEMANTIC_MATCH_THRESHOLD)
+            keyword: caption contains this text
+            screenshot: is_screenshot equals this
+            older_than_days / newer_than_days: age by creation date
+            date_from / date_to: inclusive YYYY-MM-DD bounds
+            folder: path is under this folder
+        
+        All query embeddings are scored in one matrix multiply per chunk of
+        rows, and date conditions share one sorted date index.
+        """
+        with self._lock:
+            images = list(self.processed_images)
+            embeddings = self.caption_embeddings
+            dates, date_rows = self._date_index()
+        if not images or not rules:
+            return
+        metrics.incr("rule_evaluations", len(rules))
+        
+        today = datetime.now().date()
+        compiled = []
+        date_masks = {}
+        for i, rule in enumerate(rules):
+            start = rule.get('date_from') or ''
+            end = rule.get('date_to') or '9999-12-31'
+            if rule.get('older_than_days') is not None:
+                end = min(end, (today - timedelta(days=rule['older_than_days'] + 1)).isoformat())
+            if rule.get('newer_than_days') is not None:
+                start = max(start, (today - timedelta(days=rule['newer_than_days'])).isoformat())
+            if (start, end) not in date_masks:
+                mask = np.zeros(len(images), dtype=bool)
+                mask[date_rows[bisect_left(dates, start):bisect_right(dates, end)]] = True
+                date_masks[(start, end)] = mask
+            folder = rule.get('folder')
+            compiled.append({
+                'name': rule.get('name', f"rule {i + 1}"),
+                'dates': date_masks[(start, end)],
+                'query': (rule.get('query') or '').lower(),
+                'keyword': (rule.get('keyword') or '').lower(),
+                'screenshot': rule.get('screenshot'),
+                'folder': os.path.join(os.path.abspath(folder), '') if folder else None,
+                'min_similarity': rule.get('min_similarity', SEMANTIC_MATCH_THRESHOLD),
+            })
+        
+        # One (rules x dim) matrix for every rule with a semantic query
+        semantic = [rule for rule in compiled if rule['query']]
+        query_matrix = None
+        if semantic and embeddings is not None and len(embeddings):
+            try:
+                query_matrix = np.stack([self.embedding_service.embed_query(rule['query']) for rule in semantic])
+                for column, rule in enumerate(semantic):
+                    rule['column'] = column
+            except Exception as e:
+                print(f"Error embedding rule queries: {str(e)}")
+        
+        for start in range(0, len(images), chunk_size):
+            chunk = images[start:start + chunk_size]
+            end = start + len(chunk)
+            similarities = None
+            if query_matrix is not None:
+                similarities = embeddings[start:end] @ query_matrix.T
+            captions = [(img['caption'] or '').lower() for img in chunk]
+            screenshots = np.fromiter((bool(img.get('is_screenshot')) for img in chunk), dtype=bool, count=len(chunk))
+            
+            for rule in compiled:
+                mask = rule['dates'][start:end].copy()
+                if rule['keyword']:
+                    mask &= np.fromiter((rule['keyword'] in caption for caption in captions), dtype=bool, count=len(chunk))
+                if rule['screenshot'] is not None:
+                    mask &= screenshots == bool(rule['screenshot'])
+                if rule['folder']:
+                    mask &= np.fromiter((img['path'].startswith(rule['folder']) for img in chunk), dtype=bool, count=len(chunk))
+                scores = None
+                if rule['query']:
+                    query_mask = np.fromiter((rule['query'] in caption for caption in captions), dtype=bool, count=len(chunk))
+                    if 'column' in rule and similarities is not None:
+                        scores = similarities[:, rule['column']]
+                        query_mask |= scores >= rule['min_similarity']
+                    mask &= query_mask
+                
+                for offset in np.flatnonzero(mask):
+                    result = chunk[offset].copy()
+                    if scores is not None:
+                        result['similarity'] = float(scores[offset])
+                    yield rule['name'], result
+    
+    @metrics.timed("embed_captions")
+    def embed_captions(self, processed_images: List[Dict[str, str]]) -> Optional[np.ndarray]:
+        """Embed image captions in batches through the shared embedding service."""
+        if not processed_images:
+            return None
+        try:
+            return self.embedding_service.embed_texts([img['caption'] or "" for img in processed_images])
+        except Exception as e:
+            print(f"Error embedding captions: {str(e)}")
+            return None
+    
+    def _append_embeddings(self, vectors: Optional[np.ndarray], count: int):
+        """Keep caption_embeddings row-aligned with processed_images."""
+        if vectors is None:
+            if self.caption_embeddings is None or count == 0:
+                return
+            vectors = np.zeros((count, self.caption_embeddings.shape[1]), dtype=np.float32)
+        
+        if self._embedding_buffer is None:
+            # Earlier batches failed to embed; the zeroed rows pad them so rows stay aligned
+            self._embedding_rows = len(self.processed_images) - count
+            self._embedding_buffer = np.zeros((max(self._embedding_rows + count, 1024), vectors.shape[1]),
+                                              dtype=np.float32)
+        
+        rows = self._embedding_rows + count
+        if rows > len(self._embedding_buffer):
+            grown = np.zeros((max(rows, 2 * len(self._embedding_buffer)), self._embedding_buffer.shape[1]),
+                             dtype=np.float32)
+            grown[:self._embedding_rows] = self._embedding_buffer[:self._embedding_rows]
+            self._embedding_buffer = grown
+        # Rows past the old count are unused, so earlier views handed to searches stay valid
+        self._embedding_buffer[self._embedding_rows:rows] = vectors
+        self._embedding_rows = rows
+        self.caption_embeddings = self._embedding_buffer[:rows]
+    
+    def _set_embeddings(self, embeddings: Optional[np.ndarray]):
+        """Replace caption_embeddings wholesale. Caller holds the lock."""
+        self._embedding_buffer = embeddings
+        self._embedding_rows = len(embeddings) if embeddings is not None else 0
+        self.caption_embeddings = embeddings
+    
+    def semantic_scores(self, query: str, embeddings: Optional[np.ndarray]) -> Optional[np.ndarray]:
+        """Cosine similarity between the query and each row of embeddings."""
+        if embeddings is None or not len(embeddings):
+            return None
+        try:
+            query_vector = self.embedding_service.embed_query(query)
+        except Exception as e:
+            print(f"Error embedding query: {str(e)}")
+            return None
+        return embeddings @ query_vector
+    
+    @metrics.timed("rag_insert")
+    def add_images_to_llama_stack(self, processed_images: List[Dict[str, str]]) -> bool:
+        """Add processed images to Llama Stack vector DB; returns whether the upload succeeded."""
+        if not self.client:
+            return False
             
-        # Convert processed images to RAG documents
+        # One short document per image: the caption and date are all that
+        # needs embedding, and the path travels as document_id/metadata
         documents = []
         for img in processed_images:
             document = RAGDocument(
                 document_id=img['path'],
-                content=f"Image Caption: {img['caption']}\nCreation Date: {img['creation_date']}\nCreation Time: {img['creation_time']}\nFile Path: {img['path']}",
+                content=f"{img['caption']} ({img['creation_date']})",
                 mime_type="text/plain",
                 metadata={
                     "path": img['path'],
+                    "caption": img['caption'],
                     "creation_date": img['creation_date'],
                     "creation_time": img['creation_time']
                 }
             )
             documents.append(document)
         
-        # Insert documents into vector DB
+        # Insert documents into vector DB; the chunk size comfortably exceeds
+        # any document, so each image is exactly one chunk
         try:
             self.client.tool_runtime.rag_tool.insert(
                 documents=documents,
                 vector_db_id=self.vector_db_id,
-                chunk_size_in_tokens=50,
+                chunk_size_in_tokens=RAG_CHUNK_SIZE_TOKENS,
             )
             print(f"Added {len(documents)} images to Llama Stack vector database")
+            return True
         except Exception as e:
             print(f"Error adding images to Llama Stack: {str(e)}")
+            return False
+    
+    @metrics.timed("search")
+    def search_images(self, query: str, top_k: int = 5, date_range: Optional[Dict] = None,
+                      rewritten_query: Optional[str] = None) -> List[Dict]:
+        """Search for images based on query using both traditional and RAG methods.
+        
+        date_range and rewritten_query skip the LLM calls that derive them,
+        e.g. when a caller fans one query out over several stores. Results
+        are cached until the next change to the store.
+        """
+        return self._search(query, top_k, date_range, rewritten_query)[0]
+    
+    def _search(self, query: str, top_k: int, date_range: Optional[Dict],
+                rewritten_query: Optional[str]) -> Tuple[List[Dict], bool]:
+        """search_images plus whether an LLM or RAG failure degraded the results."""
+        use_rag = bool(self.client) and not self.llama_agent.circuit_open
+        with self._lock:
+            generation = self.generation
+            # The date is part of the key because "last week" moves
+            key = (normalize_query(query), top_k, generation, datetime.now().date().isoformat(), use_rag,
+                   json.dumps(date_range, sort_keys=True) if date_range else None, rewritten_query)
+            cached = self._result_cache.get(key)
+            if cached is not None:
+                self._result_cache.move_to_end(key)
+        if cached is not None:
+            metrics.incr("search_cache_hits")
+            return [dict(result) for result in cached], False
+        metrics.incr("search_cache_misses")
+        
+        results, degraded = self._search_uncached(query, top_k, date_range, rewritten_query)
+        with self._lock:
+            # Skip caching if the store changed mid-search, and never pin
+            # results from a transient failure under the RAG key
+            if self.generation == generation and self.result_cache_size and not degraded:
+                self._result_cache[key] = [dict(result) for result in results]
+                while len(self._result_cache) > self.result_cache_size:
+                    self._result_cache.popitem(last=False)
+        return results, degraded
     
-    def search_images(self, query: str, top_k: int = 5) -> List[Dict]:
-        """Search for images based on query using both traditional and RAG methods."""
-        # If Llama Stack is available, use RAG search
-        if self.client and self.llama_agent:
-            return self.search_with_llama_rag(query, top_k)
+    def _search_uncached(self, query: str, top_k: int, date_range: Optional[Dict],
+                         rewritten_query: Optional[str]) -> Tuple[List[Dict], bool]:
+        # If Llama Stack is available, use RAG search; while its circuit
+        # breaker is open, go straight to local search instead of waiting
+        if self.client and not self.llama_agent.circuit_open:
+            if not self.vector_db_ready:
+                self.setup_vector_db_with_llama_stack()
+            if self.vector_db_ready:
+                self.flush_pending_uploads()
+                with self._lock:
+                    pending = set(self._pending_uploads)
+                if not pending:
+                    return self._search_with_llama_rag(query, top_k, date_range, rewritten_query)
+                # Records that still failed to upload are invisible to RAG;
+                # score them locally and merge them in
+                date_failed = False
+                if date_range is None:
+                    date_range, date_ok = self._parse_date_query(query)
+                    date_failed = not date_ok
+                results, degraded = self._search_with_llama_rag(query, top_k, date_range, rewritten_query)
+                seen = {result['path'] for result in results}
+                results.extend(result for result in self.traditional_search(query, top_k, date_range, only_paths=pending)
+                               if result['path'] not in seen)
+                results.sort(key=lambda x: x['relevance_score'], reverse=True)
+                return results[:top_k], degraded or date_failed
         
-        # Fallback to traditional search
-        return self.traditional_search(query, top_k)
+        # Fallback to traditional search; with the breaker open this is the
+        # expected mode, not a degraded one, and the cache key says so
+        return self.traditional_search(query, top_k, date_range), False
     
-    def traditional_search(self, query: str, top_k: int = 5) -> List[Dict]:
-        """Simple keyword-based search as fallback."""
+    @metrics.timed("local_search")
+    def traditional_search(self, query: str, top_k: int = 5, date_range: Optional[Dict] = None,
+                           only_paths: Optional[set] = None) -> List[Dict]:
+        """Simple keyword-based search as fallback, optionally limited to only_paths."""
         results = []
         query_lower = query.lower()
         
         # Parse date information if present
-        date_range = self.parse_date_query(query)
+        if date_range is None:
+            date_range = self.parse_date_query(query)
+        
+        # Snapshot so concurrent add_images batches don't shift rows mid-scan
+        with self._lock:
+            images = list(self.processed_images)
+            embeddings = self.caption_embeddings
+        similarities = self.semantic_scores(query, embeddings)
         
-        for img in self.processed_images:
+        for i, img in enumerate(images):
+            if only_paths is not None and img['path'] not in only_paths:
+                continue
             score = 0
             # Check caption for keyword match
             if query_lower in img['caption'].lower():
                 score += 0.8
             
+            # Check caption for semantic match
+            if similarities is not None and similarities[i] >= SEMANTIC_MATCH_THRESHOLD:
+                score += float(similarities[i])
+            
             # Check date match if date range is specified
             if date_range["start_date"] and self.is_date_in_range(img['creation_date'], date_range):
                 score += 0.9
@@ -118,84 +750,149 @@ class VectorStore:
         results.sort(key=lambda x: x['relevance_score'], reverse=True)
         return results[:top_k]
     
-    def search_with_llama_rag(self, query: str, top_k: int = 5) -> List[Dict]:
+    def search_with_llama_rag(self, query: str, top_k: int = 5, date_range: Optional[Dict] = None,
+                              rewritten_query: Optional[str] = None) -> List[Dict]:
         """Search for images using Llama Stack RAG."""
+        return self._search_with_llama_rag(query, top_k, date_range, rewritten_query)[0]
+    
+    def _search_with_llama_rag(self, query: str, top_k: int, date_range: Optional[Dict],
+                               rewritten_query: Optional[str]) -> Tuple[List[Dict], bool]:
+        """RAG results, and whether a failure made them fall back to worse ones."""
+        degraded = False
         try:
             # Rewrite query to be more effective for RAG
-            rewritten_query = self.llama_agent.rewrite_query(query)
-            
-            # Use RAG tool to search
-            response = self.client.tool_runtime.rag_tool.query(
-                vector_db_ids=[self.vector_db_id],
-                content=rewritten_query,
-                top_k=top_k
-            )
+            if rewritten_query is None:
+                try:
+                    rewritten_query = self.llama_agent.rewrite_query(query, strict=True)
+                except Exception:
+                    rewritten_query = query
+                    degraded = True
             
-            # Process results
-            results = []
-            seen_paths = set()
+            # Parse date information if present
+            if date_range is None:
+                date_range, date_ok = self._parse_date_query(query)
+                degraded = degraded or not date_ok
             
-            for chunk in response:
-                # Extract path from chunk content
-                path_match = re.search(r'File Path: (.*?)(?:\n|$)', chunk.content)
-                if path_match:
-                    path = path_match.group(1).strip()
-                    
-                    # Avoid duplicates
-                    if path in seen_paths:
-                        continue
-                    seen_paths.add(path)
-                    
-                    # Find corresponding image in our local store
-                    for img in self.processed_images:
-                        if img['path'] == path:
-                            result = img.copy()
-                            result['relevance_score'] = chunk.score if hasattr(chunk, 'score') else 0.9
-                            results.append(result)
-                            break
+            # Over-fetch so duplicate, deleted and out-of-range hits don't
+            # leave top_k short, widening until it is filled or hits run out
+            fetch_k = max(top_k, int(top_k * self.rag_overfetch))
+            while True:
+                # vector_io returns each chunk with its metadata and score,
+                # unlike rag_tool.query's single joined context string
+                with metrics.timer("rag_query"):
+                    response = self.client.vector_io.query(
+                        vector_db_id=self.vector_db_id,
+                        query=rewritten_query,
+                        params={"max_chunks": fetch_k},
+                    )
+                hits = list(zip(response.chunks, response.scores))
+                with metrics.timer("rag_result_mapping"):
+                    results = self._map_rag_hits(hits, date_range)
+                if len(results) >= top_k or len(hits) < fetch_k or fetch_k >= top_k * RAG_MAX_OVERFETCH:
+                    break
+                fetch_k = min(fetch_k * 2, top_k * RAG_MAX_OVERFETCH)
+                metrics.incr("rag_overfetch_retries")
             
-            # Parse date information if present
-            date_range = self.parse_date_query(query)
-            if date_range["start_date"]:
-                results = self.filter_by_date(results, date_range)
+            # Remember how much over-fetch this store needs for next time
+            if hits:
+                usable = max(len(results), 1) / len(hits)
+                self.rag_overfetch = min(max(1.0, 1.2 / usable), RAG_MAX_OVERFETCH)
             
             # Sort by relevance score
             results.sort(key=lambda x: x['relevance_score'], reverse=True)
-            return results[:top_k]
+            results = results[:top_k]
+            if len(results) < top_k:
+                # Dead chunks (or a compaction in progress) crowded live images
+                # out of the fetch; fill the rest from local search
+                seen = {result['path'] for result in results}
+                local = [result for result in self.traditional_search(query, top_k, date_range)
+                         if result['path'] not in seen]
+                if local:
+                    metrics.incr("rag_local_topups")
+                    results.extend(local[:top_k - len(results)])
+            return results, degraded
             
         except Exception as e:
             print(f"Error in RAG search: {str(e)}")
+            metrics.incr("rag_search_fallbacks")
             # Fallback to traditional search
-            return self.traditional_search(query, top_k)
+            return self.traditional_search(query, top_k, date_range), True
+    
+    def _map_rag_hits(self, hits: List[Tuple], date_range: Dict) -> List[Dict]:
+        """Local records for (chunk, score) hits, one per image, skipping deleted and out-of-range ones.
+        
+        Raises if no hit carries a recognizable path, so an unexpected
+        response shape falls back to local search instead of returning nothing.
+        """
+        results = []
+        seen_paths = set()
+        recognized = 0
+        with self._lock:
+            for chunk, score in hits:
+                metadata = chunk.metadata or {}
+                path = metadata.get('path') or metadata.get('document_id')
+                if not path:
+                    # Documents indexed before the compact format carried the path in the text
+                    content = chunk.content if isinstance(chunk.content, str) else ''
+                    path_match = re.search(r'File Path: (.*?)(?:\n|$)', content)
+                    path = path_match.group(1).strip() if path_match else None
+                if not path:
+                    continue
+                recognized += 1
+                if path in seen_paths or path in self.deleted_paths:
+                    continue
+                seen_paths.add(path)
+                row = self._path_index.get(path)
+                if row is None:
+                    continue
+                img = self.processed_images[row]
+                if metadata.get('caption') is not None and metadata['caption'] != img['caption']:
+                    # A chunk from before the image was recaptioned; the current one is also indexed
+                    seen_paths.discard(path)
+                    metrics.incr("rag_stale_hits")
+                    continue
+                if date_range.get("start_date") and not self.is_date_in_range(img['creation_date'], date_range):
+                    continue
+                result = img.copy()
+                result['relevance_score'] = float(score)
+                results.append(result)
+        if hits and not recognized:
+            raise ValueError(f"None of {len(hits)} RAG chunks carried an image path")
+        return results
     
     def parse_date_query(self, query: str) -> Dict[str, Optional[str]]:
         """Extract date information from query."""
-        if not self.llama_agent:
-            return {"start_date": None, "end_date": None}
+        return self._parse_date_query(query)[0]
+    
+    @metrics.timed("date_parse")
+    def _parse_date_query(self, query: str) -> Tuple[Dict[str, Optional[str]], bool]:
+        """The date range and whether it came from the LLM rather than a fallback."""
+        if not self.llama_agent or self.llama_agent.circuit_open:
+            return {"start_date": None, "end_date": None}, False
         
         try:
-            response = self.llama_agent.client.inference.chat_completion(
-                model=self.llama_agent.model_id,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that extracts date information from queries."},
-                    {"role": "user", "content": f"Extract the date information from this query: '{query}'. Return a JSON with start_date and end_date in YYYY-MM-DD format. If no specific end date is mentioned, use the end of the mentioned period."}
-                ],
-                stream=False
-            )
+            text = self.llama_agent.complete([
+                {"role": "system", "content": "You are a helpful assistant that extracts date information from queries."},
+                {"role": "user", "content": f"Extract the date information from this query: '{query}'. Return a JSON with start_date and end_date in YYYY-MM-DD format. If no specific end date is mentioned, use the end of the mentioned period."}
+            ])
             
             # Extract JSON from response
-            json_match = re.search(r'\{.*\}', response.text, re.DOTALL)
+            json_match = re.search(r'\{.*\}', text, re.DOTALL)
             if json_match:
                 try:
                     date_info = json.loads(json_match.group(0))
-                    return date_info
                 except:
-                    pass
+                    date_info = None
+                if date_info:
+                    if date_info.get("start_date"):
+                        for listener in self.date_query_listeners:
+                            listener(date_info)
+                    return date_info, True
         except Exception as e:
             print(f"Error parsing date query: {str(e)}")
         
         # Fallback to default date range
-        return {"start_date": None, "end_date": None}
+        return {"start_date": None, "end_date": None}, False
     
     def is_date_in_range(self, date_str: str, date_range: Dict[str, str]) -> bool:
         """Check if a date is within the specified range."""
@@ -221,29 +918,22 @@ class VectorStore:
         
         return [img for img in images if self.is_date_in_range(img['creation_date'], date_range)]
     
+    @metrics.timed("confirmation")
     def confirm_deletion(self, images: List[Dict], query: str) -> str:
         """Generate confirmation message for deletion using Llama."""
-        if not self.llama_agent:
+        if not self.llama_agent or self.llama_agent.circuit_open:
             # Fallback confirmation message
             return f"Are you sure you want to delete these {len(images)} images matching '{query}'?"
         
-        # Format image list
-        image_list = "\n".join([
-            f"- {img['path']} (Caption: {img['caption']}, Date: {img['creation_date']})"
-            for img in images
-        ])
+        # Aggregate large result sets so the prompt stays within budget
+        image_list = summarize_images(images)
         
         # Ask Llama to generate confirmation
         try:
-            response = self.llama_agent.client.inference.chat_completion(
-                model=self.llama_agent.model_id,
-                messages=[
-                    {"role": "system", "content": "You are a helpful assistant that helps users manage their image files."},
-                    {"role": "user", "content": f"Based on the query '{query}', I found these images:\n{image_list}\n\nGenerate a confirmation message asking if the user wants to delete these {len(images)} images. Mention the date range if applicable."}
-                ],
-                stream=False
-            )
-            return response.text
+            return self.llama_agent.complete([
+                {"role": "system", "content": "You are a helpful assistant that helps users manage their image files."},
+                {"role": "user", "content": f"Based on the query '{query}', I found these images:\n{image_list}\n\nGenerate a confirmation message asking if the user wants to delete these {len(images)} images. Mention the date range if applicable."}
+            ])
         except Exception as e:
             print(f"Error generating confirmation: {str(e)}")
             # Fallback confirmation message